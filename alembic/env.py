@@ -10,6 +10,8 @@ from alembic import context
 # Import the project settings and Base model
 from src.core.config import get_settings
 from src.database.base_class import Base
+from src.database.partitions import PARTITION_NAME_PATTERN
+from src.models.message import SEARCH_VECTOR_COLUMN
 # Make sure to import all models so they are registered with Base.metadata
 from src.models.all_models import User, Conversation, Message, ConversationParticipant # noqa
 
@@ -32,6 +34,22 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    """
+    Keep autogenerate away from schema objects the models deliberately don't map:
+    the messages partitions (and their indexes) and the full-text search column and index.
+    """
+    if type_ == "table" and reflected and PARTITION_NAME_PATTERN.match(name or ""):
+        return False
+    if type_ == "index" and reflected and PARTITION_NAME_PATTERN.match(getattr(object.table, "name", "")):
+        return False
+    if type_ == "column" and reflected and name == SEARCH_VECTOR_COLUMN and object.table.name == "messages":
+        return False
+    if type_ == "index" and reflected and name == "ix_messages_search_vector":
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -54,6 +72,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -63,7 +82,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
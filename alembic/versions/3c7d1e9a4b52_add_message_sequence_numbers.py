@@ -0,0 +1,69 @@
+"""Add message sequence numbers
+
+Revision ID: 3c7d1e9a4b52
+Revises: 9e57f82b2dd1
+Create Date: 2026-10-16 23:45:12.418903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7d1e9a4b52'
+down_revision: Union[str, Sequence[str], None] = '9e57f82b2dd1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversations', sa.Column('last_seq', sa.BigInteger(), server_default=sa.text('0'), nullable=False))
+    op.add_column('messages', sa.Column('seq', sa.BigInteger(), nullable=True))
+    op.add_column('conversation_participants', sa.Column('last_seen_seq', sa.BigInteger(), server_default=sa.text('0'), nullable=False))
+    op.add_column('conversation_participants', sa.Column('deleted_unread_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+    # Backfill: number existing messages per conversation in (created_at, id) order
+    op.execute("""
+        UPDATE messages AS m
+        SET seq = numbered.rn
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS rn
+            FROM messages
+        ) AS numbered
+        WHERE m.id = numbered.id
+    """)
+    op.execute("""
+        UPDATE conversations AS c
+        SET last_seq = COALESCE((SELECT max(m.seq) FROM messages m WHERE m.conversation_id = c.id), 0)
+    """)
+    # Read positions: translate last_seen_message_id into a sequence number
+    op.execute("""
+        UPDATE conversation_participants AS p
+        SET last_seen_seq = m.seq
+        FROM messages m
+        WHERE m.id = p.last_seen_message_id
+    """)
+    op.execute("""
+        UPDATE conversation_participants AS p
+        SET deleted_unread_count = (
+            SELECT count(*) FROM messages m
+            WHERE m.conversation_id = p.conversation_id
+              AND m.is_deleted
+              AND m.seq > p.last_seen_seq
+        )
+    """)
+
+    op.alter_column('messages', 'seq', existing_type=sa.BigInteger(), nullable=False)
+    op.create_index('ix_messages_conversation_id_seq', 'messages', ['conversation_id', 'seq'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_id_seq', table_name='messages')
+    op.drop_column('conversation_participants', 'deleted_unread_count')
+    op.drop_column('conversation_participants', 'last_seen_seq')
+    op.drop_column('messages', 'seq')
+    op.drop_column('conversations', 'last_seq')
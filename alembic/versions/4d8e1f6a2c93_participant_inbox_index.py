@@ -0,0 +1,33 @@
+"""Inbox index on conversation_participants
+
+Revision ID: 4d8e1f6a2c93
+Revises: b2f6c9e1d478
+Create Date: 2026-10-17 09:12:44.381020
+
+Replaces the (user_id, conversation_id) index with (user_id, is_active, conversation_id), so the
+inbox finds a user's active chats from the index alone before joining conversations in order of
+activity (ix_conversations_last_activity_at_id).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8e1f6a2c93'
+down_revision: Union[str, Sequence[str], None] = 'b2f6c9e1d478'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_conversation_participants_inbox', 'conversation_participants', ['user_id', 'is_active', 'conversation_id'], unique=False)
+    op.drop_index('ix_conversation_participants_user_id_conversation_id', table_name='conversation_participants')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_conversation_participants_user_id_conversation_id', 'conversation_participants', ['user_id', 'conversation_id'], unique=False)
+    op.drop_index('ix_conversation_participants_inbox', table_name='conversation_participants')
@@ -0,0 +1,43 @@
+"""Keyset inbox: last_activity_at and supporting indexes
+
+Revision ID: 7b2e4f0c9d13
+Revises: 3c7d1e9a4b52
+Create Date: 2026-10-16 23:58:40.102377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e4f0c9d13'
+down_revision: Union[str, Sequence[str], None] = '3c7d1e9a4b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversations', sa.Column('last_activity_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+    # Backfill from the latest message, falling back to the last update / creation time
+    op.execute("""
+        UPDATE conversations AS c
+        SET last_activity_at = COALESCE(
+            (SELECT max(m.created_at) FROM messages m WHERE m.conversation_id = c.id),
+            c.updated_at,
+            c.created_at
+        )
+    """)
+
+    op.create_index('ix_conversations_last_activity_at_id', 'conversations', [sa.literal_column('last_activity_at DESC'), sa.literal_column('id DESC')], unique=False)
+    op.create_index('ix_conversation_participants_user_id_conversation_id', 'conversation_participants', ['user_id', 'conversation_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversation_participants_user_id_conversation_id', table_name='conversation_participants')
+    op.drop_index('ix_conversations_last_activity_at_id', table_name='conversations')
+    op.drop_column('conversations', 'last_activity_at')
@@ -0,0 +1,41 @@
+"""Message idempotency keys
+
+Revision ID: a7d4e2c8b915
+Revises: f3b9c1d4e6a7
+Create Date: 2026-10-17 03:12:45.381920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d4e2c8b915'
+down_revision: Union[str, Sequence[str], None] = 'f3b9c1d4e6a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_idempotency_keys',
+        sa.Column('sender_id', sa.UUID(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=128), nullable=False),
+        sa.Column('conversation_id', sa.UUID(), nullable=False),
+        sa.Column('message_id', sa.UUID(), nullable=False),
+        sa.Column('message_created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('sender_id', 'idempotency_key')
+    )
+    op.create_index('ix_message_idempotency_keys_created_at', 'message_idempotency_keys', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_idempotency_keys_created_at', table_name='message_idempotency_keys')
+    op.drop_table('message_idempotency_keys')
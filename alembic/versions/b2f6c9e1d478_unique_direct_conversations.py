@@ -0,0 +1,113 @@
+"""Unique direct conversations
+
+Revision ID: b2f6c9e1d478
+Revises: a7d4e2c8b915
+Create Date: 2026-10-17 03:58:02.664113
+
+Direct conversations get a direct_key (the sorted ids of their two participants) with a unique
+index, so there is at most one direct chat per pair of users.
+
+Existing duplicates are merged into the oldest chat of each pair: messages (and idempotency keys)
+move over, messages are renumbered by (created_at, id), each participant's read position is the
+furthest one they had in any of the merged chats, and the other chats are deleted.
+Direct conversations that don't have exactly two participants are left without a key.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2f6c9e1d478'
+down_revision: Union[str, Sequence[str], None] = 'a7d4e2c8b915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversations', sa.Column('direct_key', sa.String(), nullable=True))
+
+    # Every direct chat with its pair key, and the chat of its pair that is kept
+    op.execute("""
+        CREATE TEMPORARY TABLE direct_merges ON COMMIT DROP AS
+        SELECT d.conversation_id, d.direct_key,
+               first_value(d.conversation_id) OVER (PARTITION BY d.direct_key ORDER BY c.created_at, c.id) AS keeper_id
+        FROM (
+            SELECT p.conversation_id, string_agg(p.user_id::text, ':' ORDER BY p.user_id::text) AS direct_key
+            FROM conversation_participants p
+            JOIN conversations c ON c.id = p.conversation_id
+            WHERE c.is_group IS NOT TRUE
+            GROUP BY p.conversation_id
+            HAVING count(*) = 2
+        ) d
+        JOIN conversations c ON c.id = d.conversation_id
+    """)
+    op.execute("""
+        CREATE TEMPORARY TABLE merged_conversations ON COMMIT DROP AS
+        SELECT DISTINCT keeper_id AS id FROM direct_merges WHERE conversation_id <> keeper_id
+    """)
+
+    op.execute("""
+        UPDATE messages m SET conversation_id = d.keeper_id
+        FROM direct_merges d
+        WHERE m.conversation_id = d.conversation_id AND d.conversation_id <> d.keeper_id
+    """)
+    op.execute("""
+        UPDATE message_idempotency_keys k SET conversation_id = d.keeper_id
+        FROM direct_merges d
+        WHERE k.conversation_id = d.conversation_id AND d.conversation_id <> d.keeper_id
+    """)
+    op.execute("""
+        UPDATE messages m SET seq = r.seq
+        FROM (
+            SELECT id, created_at, row_number() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq
+            FROM messages
+            WHERE conversation_id IN (SELECT id FROM merged_conversations)
+        ) r
+        WHERE m.id = r.id AND m.created_at = r.created_at
+    """)
+
+    # Read positions: the furthest message (in the merged numbering) each participant had seen in any of the chats
+    op.execute("""
+        UPDATE conversation_participants p
+        SET last_seen_message_id = r.message_id, last_seen_seq = coalesce(r.seq, 0)
+        FROM (
+            SELECT DISTINCT ON (d.keeper_id, dp.user_id) d.keeper_id, dp.user_id, m.id AS message_id, m.seq
+            FROM direct_merges d
+            JOIN conversation_participants dp ON dp.conversation_id = d.conversation_id
+            LEFT JOIN messages m ON m.conversation_id = d.keeper_id AND m.id = dp.last_seen_message_id
+            WHERE d.keeper_id IN (SELECT id FROM merged_conversations)
+            ORDER BY d.keeper_id, dp.user_id, m.seq DESC NULLS LAST
+        ) r
+        WHERE p.conversation_id = r.keeper_id AND p.user_id = r.user_id
+    """)
+    op.execute("""
+        UPDATE conversation_participants p
+        SET deleted_unread_count = (
+            SELECT count(*) FROM messages m
+            WHERE m.conversation_id = p.conversation_id AND m.seq > p.last_seen_seq AND m.is_deleted
+        )
+        WHERE p.conversation_id IN (SELECT id FROM merged_conversations)
+    """)
+    op.execute("""
+        UPDATE conversations c
+        SET last_seq = (SELECT count(*) FROM messages m WHERE m.conversation_id = c.id),
+            last_activity_at = (
+                SELECT max(dc.last_activity_at) FROM direct_merges d
+                JOIN conversations dc ON dc.id = d.conversation_id
+                WHERE d.keeper_id = c.id
+            )
+        WHERE c.id IN (SELECT id FROM merged_conversations)
+    """)
+
+    op.execute("DELETE FROM conversations WHERE id IN (SELECT conversation_id FROM direct_merges WHERE conversation_id <> keeper_id)")
+    op.execute("UPDATE conversations c SET direct_key = d.direct_key FROM direct_merges d WHERE c.id = d.conversation_id")
+    op.create_index('ix_conversations_direct_key', 'conversations', ['direct_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema. Merged conversations stay merged."""
+    op.drop_index('ix_conversations_direct_key', table_name='conversations')
+    op.drop_column('conversations', 'direct_key')
@@ -0,0 +1,30 @@
+"""Add id to the message pagination index for composite keyset cursors
+
+Revision ID: c4f1a9d27e80
+Revises: 7b2e4f0c9d13
+Create Date: 2026-10-17 00:41:12.530114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f1a9d27e80'
+down_revision: Union[str, Sequence[str], None] = '7b2e4f0c9d13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index('ix_messages_conversation_id_created_at_desc', table_name='messages')
+    op.create_index('ix_messages_conversation_id_created_at_desc', 'messages', ['conversation_id', sa.literal_column('created_at DESC'), sa.literal_column('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_id_created_at_desc', table_name='messages')
+    op.create_index('ix_messages_conversation_id_created_at_desc', 'messages', ['conversation_id', sa.literal_column('created_at DESC')], unique=False)
@@ -0,0 +1,133 @@
+"""Partition messages by month on created_at
+
+Revision ID: d8a3b6e15f42
+Revises: c4f1a9d27e80
+Create Date: 2026-10-17 00:12:37.905514
+
+The existing table is not rewritten: it is renamed to `messages_legacy` and attached as the
+partition holding everything up to the end of the current month (or of the latest message),
+and new monthly partitions follow it. Attaching needs two extra indexes on the old table.
+On large installations build them beforehand without blocking writes, and this migration
+will reuse them:
+
+    CREATE UNIQUE INDEX CONCURRENTLY messages_id_created_at_key ON messages (id, created_at);
+    CREATE INDEX CONCURRENTLY messages_conversation_id_seq_idx ON messages (conversation_id, seq);
+
+Partitioned tables can't carry unique constraints that omit the partition key, so:
+- the primary key becomes (id, created_at);
+- (conversation_id, seq) is no longer enforced unique by an index (sequence numbers are still
+  allocated under the conversation row lock);
+- conversation_participants.last_seen_message_id loses its foreign key.
+"""
+from typing import Sequence, Union
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8a3b6e15f42'
+down_revision: Union[str, Sequence[str], None] = 'c4f1a9d27e80'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created ahead of time; the application keeps extending this (see src/database/partitions.py)
+MONTHS_AHEAD = 3
+
+MESSAGE_COLUMNS = "id, conversation_id, sender_id, content, message_type, media_url, is_deleted, created_at, updated_at, seq"
+
+
+def _next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.drop_constraint('conversation_participants_last_seen_message_id_fkey', 'conversation_participants', type_='foreignkey')
+
+    # Indexes the partitioned parent will require from the legacy partition (no-ops if pre-built)
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS messages_id_created_at_key ON messages (id, created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS messages_conversation_id_seq_idx ON messages (conversation_id, seq)")
+
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    # The (id, created_at) index becomes the partition's share of the new primary key
+    op.execute("ALTER TABLE messages_legacy DROP CONSTRAINT messages_pkey")
+    op.execute("ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_id_created_at_key")
+    op.execute("ALTER INDEX ix_messages_conversation_id_created_at_desc RENAME TO messages_legacy_conversation_id_created_at_id_idx")
+    op.execute("DROP INDEX ix_messages_conversation_id_seq")
+    op.execute("ALTER INDEX messages_conversation_id_seq_idx RENAME TO messages_legacy_conversation_id_seq_idx")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id UUID NOT NULL,
+            conversation_id UUID NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+            sender_id UUID NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            content VARCHAR,
+            message_type VARCHAR,
+            media_url VARCHAR,
+            is_deleted BOOLEAN,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE,
+            seq BIGINT NOT NULL,
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.create_index('ix_messages_conversation_id_created_at_desc', 'messages', ['conversation_id', sa.literal_column('created_at DESC'), sa.literal_column('id DESC')], unique=False)
+    op.create_index('ix_messages_conversation_id_seq', 'messages', ['conversation_id', 'seq'], unique=False)
+
+    # The legacy partition covers everything before the first monthly partition
+    latest = bind.execute(sa.text("SELECT greatest(now(), max(created_at)) FROM messages_legacy")).scalar()
+    boundary = _next_month(latest.astimezone(timezone.utc))
+
+    # A validated CHECK lets ATTACH skip scanning the legacy table
+    op.execute(f"ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_created_at_check CHECK (created_at < '{boundary.isoformat()}') NOT VALID")
+    op.execute("ALTER TABLE messages_legacy VALIDATE CONSTRAINT messages_legacy_created_at_check")
+    op.execute(f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')")
+
+    month = boundary
+    for _ in range(MONTHS_AHEAD):
+        following = _next_month(month)
+        op.execute(
+            f"CREATE TABLE messages_y{month.year:04d}m{month.month:02d} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_partitioned_pkey")
+    op.execute("ALTER INDEX ix_messages_conversation_id_created_at_desc RENAME TO messages_partitioned_conversation_id_created_at_id_idx")
+    op.execute("ALTER INDEX ix_messages_conversation_id_seq RENAME TO messages_partitioned_conversation_id_seq_idx")
+
+    op.create_table('messages',
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('conversation_id', sa.UUID(), nullable=False),
+        sa.Column('sender_id', sa.UUID(), nullable=False),
+        sa.Column('content', sa.String(), nullable=True),
+        sa.Column('message_type', sa.String(), nullable=True),
+        sa.Column('media_url', sa.String(), nullable=True),
+        sa.Column('is_deleted', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('seq', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(f"INSERT INTO messages ({MESSAGE_COLUMNS}) SELECT {MESSAGE_COLUMNS} FROM messages_partitioned")
+    op.execute("DROP TABLE messages_partitioned CASCADE")
+
+    op.create_index('ix_messages_conversation_id_created_at_desc', 'messages', ['conversation_id', sa.literal_column('created_at DESC'), sa.literal_column('id DESC')], unique=False)
+    op.create_index('ix_messages_conversation_id_seq', 'messages', ['conversation_id', 'seq'], unique=True)
+
+    op.execute("""
+        UPDATE conversation_participants AS p
+        SET last_seen_message_id = NULL
+        WHERE last_seen_message_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = p.last_seen_message_id)
+    """)
+    op.create_foreign_key('conversation_participants_last_seen_message_id_fkey', 'conversation_participants', 'messages', ['last_seen_message_id'], ['id'], ondelete='SET NULL')
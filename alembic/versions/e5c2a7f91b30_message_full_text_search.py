@@ -0,0 +1,35 @@
+"""Message full-text search
+
+Revision ID: e5c2a7f91b30
+Revises: d8a3b6e15f42
+Create Date: 2026-10-17 01:02:11.418307
+
+Adds a generated tsvector column over messages.content and a GIN index on it. Both are
+created on the partitioned parent and cascade to every partition; adding the stored column
+rewrites each partition once.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c2a7f91b30'
+down_revision: Union[str, Sequence[str], None] = 'd8a3b6e15f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED"
+    )
+    op.execute("CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX ix_messages_search_vector")
+    op.execute("ALTER TABLE messages DROP COLUMN search_vector")
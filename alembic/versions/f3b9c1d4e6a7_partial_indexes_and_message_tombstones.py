@@ -0,0 +1,84 @@
+"""Partial indexes and message tombstones
+
+Revision ID: f3b9c1d4e6a7
+Revises: e5c2a7f91b30
+Create Date: 2026-10-17 01:41:53.127604
+
+- messages.is_deleted becomes NOT NULL (default false), via a validated CHECK so the table isn't
+  scanned under an exclusive lock;
+- messages.deleted_at records when a message was soft deleted (backfilled from updated_at);
+- the pagination index only covers live messages, and two small partial indexes back the
+  tombstone compaction job.
+
+Indexes on the partitioned table are built partition by partition with CREATE INDEX CONCURRENTLY
+and attached to an index created ON ONLY the parent, so writes aren't blocked while they build.
+"""
+from typing import List, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9c1d4e6a7'
+down_revision: Union[str, Sequence[str], None] = 'e5c2a7f91b30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _partitions() -> List[str]:
+    result = op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass ORDER BY c.relname"
+    ))
+    return list(result.scalars())
+
+
+def _create_partitioned_index(name: str, suffix: str, definition: str) -> None:
+    """Builds `definition` (columns + WHERE) on every partition concurrently, then on the parent."""
+    with op.get_context().autocommit_block():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY messages {definition}")
+        for partition in _partitions():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{suffix} ON {partition} {definition}")
+            op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition}_{suffix}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("UPDATE messages SET is_deleted = false WHERE is_deleted IS NULL")
+    op.execute("ALTER TABLE messages ALTER COLUMN is_deleted SET DEFAULT false")
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_is_deleted_not_null CHECK (is_deleted IS NOT NULL) NOT VALID")
+    op.execute("ALTER TABLE messages VALIDATE CONSTRAINT messages_is_deleted_not_null")
+    op.execute("ALTER TABLE messages ALTER COLUMN is_deleted SET NOT NULL")
+    op.execute("ALTER TABLE messages DROP CONSTRAINT messages_is_deleted_not_null")
+
+    op.add_column('messages', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE messages SET deleted_at = coalesce(updated_at, created_at) WHERE is_deleted")
+
+    _create_partitioned_index(
+        'ix_messages_conversation_id_created_at_live', 'conversation_id_created_at_live_idx',
+        "(conversation_id, created_at DESC, id DESC) WHERE is_deleted = false"
+    )
+    op.execute("DROP INDEX ix_messages_conversation_id_created_at_desc")
+    op.execute("ALTER INDEX ix_messages_conversation_id_created_at_live RENAME TO ix_messages_conversation_id_created_at_desc")
+
+    _create_partitioned_index(
+        'ix_messages_tombstones_deleted_at', 'tombstones_deleted_at_idx',
+        "(deleted_at) WHERE is_deleted = true AND (content IS NOT NULL OR media_url IS NOT NULL)"
+    )
+    _create_partitioned_index(
+        'ix_messages_media_url', 'media_url_idx',
+        "(media_url) WHERE media_url IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_media_url', table_name='messages')
+    op.drop_index('ix_messages_tombstones_deleted_at', table_name='messages')
+    op.drop_index('ix_messages_conversation_id_created_at_desc', table_name='messages')
+    op.create_index('ix_messages_conversation_id_created_at_desc', 'messages', ['conversation_id', sa.literal_column('created_at DESC'), sa.literal_column('id DESC')], unique=False)
+
+    op.drop_column('messages', 'deleted_at')
+    op.execute("ALTER TABLE messages ALTER COLUMN is_deleted DROP NOT NULL")
+    op.execute("ALTER TABLE messages ALTER COLUMN is_deleted DROP DEFAULT")
@@ -0,0 +1,121 @@
+"""
+Compares the legacy WebSocket fan-out (decode each Redis event, re-encode it for every socket,
+await each send in turn) with forwarding the publisher's pre-encoded frame to per-connection
+outbound queues.
+
+No database or Redis needed: events go straight into the pub/sub reader and the sockets only
+record what they are sent, encoding it the way Starlette's send_json does. Reports the CPU time
+per event delivered to --recipients users with --sockets connections each, and the wall time
+until every healthy socket has all events. With --slow-ms, one recipient's socket takes that
+long per send: the legacy loop waits for it on every event, the queued fan-out doesn't.
+
+    python -m benchmarks.bench_fanout --recipients 500 --events 200 --slow-ms 5
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from src.core.connection_manager import manager
+from src.core.pubsub import RedisPubSubManager, encode_event
+
+class RecordingSocket:
+    # Frames sent to sockets without a delay, across all sockets
+    healthy_sent = 0
+
+    def __init__(self, delay: float = 0):
+        self.sent = 0
+        self.delay = delay
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            RecordingSocket.healthy_sent += 1
+        self.sent += 1
+
+    async def send_json(self, data):
+        # What starlette.websockets.WebSocket.send_json does in text mode
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+class LegacyReader(RedisPubSubManager):
+    """The reader as it was: json.loads per event, send_json per socket."""
+    async def reader_task(self):
+        async for message in self.pubsub.listen():
+            data = json.loads(message["data"])
+            for pid in data.get("participant_ids", []):
+                for connection in list(manager.active_connections.get(pid, ())):
+                    await connection.websocket.send_json(data.get("data", {}))
+
+class ReplayPubSub:
+    def __init__(self, events: list):
+        self.events = events
+
+    async def listen(self):
+        for event in self.events:
+            yield {"type": "message", "data": event}
+
+def make_message(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "conversation_id": str(uuid.uuid4()), "sender_id": str(uuid.uuid4()),
+        "seq": i, "content": "A reasonably ordinary chat message, about a sentence long. " * 2,
+        "message_type": "text", "media_url": None, "is_deleted": False,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+async def run(name: str, reader_cls, events: list, sockets: list):
+    reader = reader_cls()
+    reader.pubsub = ReplayPubSub(events)
+    healthy = [s for s in sockets if not s.delay]
+    RecordingSocket.healthy_sent = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await reader.reader_task()
+    # Queued frames are written by the connections' writer tasks
+    while RecordingSocket.healthy_sent < len(events) * len(healthy):
+        await asyncio.sleep(0)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    delivered = sum(s.sent for s in healthy)
+    print(
+        f"{name:>7}: {cpu / len(events) * 1000:.3f} ms CPU/event, {cpu / delivered * 1e6:.2f} us/frame, "
+        f"{wall * 1000:.0f} ms until all healthy sockets had every event ({delivered} frames)"
+    )
+    # Start the next run with empty queues
+    for connections in manager.active_connections.values():
+        for connection in connections:
+            connection.queue.clear()
+    for s in sockets:
+        s.sent = 0
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--sockets", type=int, default=2)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--slow-ms", type=float, default=0, help="per-send delay of one recipient's socket")
+    args = parser.parse_args()
+
+    user_ids = [str(uuid.uuid4()) for _ in range(args.recipients)]
+    sockets = []
+    for n, user_id in enumerate(user_ids):
+        for _ in range(args.sockets):
+            socket = RecordingSocket(delay=args.slow_ms / 1000 if n == 0 and not sockets else 0)
+            await manager.connect(user_id, socket)
+            sockets.append(socket)
+
+    messages = [make_message(i) for i in range(args.events)]
+    legacy_events = [json.dumps({"type": "new_message", "participant_ids": user_ids, "data": m}) for m in messages]
+    events = [encode_event({"type": "new_message", "participant_ids": user_ids}, json.dumps(m)) for m in messages]
+
+    print(f"recipients={args.recipients} sockets/user={args.sockets} events={args.events} slow_ms={args.slow_ms}")
+    await run("legacy", LegacyReader, legacy_events, sockets)
+    await run("encoded", RedisPubSubManager, events, sockets)
+
+if __name__ == "__main__":
+    asyncio.run(main())
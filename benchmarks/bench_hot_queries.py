@@ -0,0 +1,142 @@
+"""
+Compares hot queries built per call with the repository's prebuilt statements.
+
+Runs against the database in DATABASE_URL (migrated to head). It creates its own users,
+conversation and messages, then runs the participant lookup, the member list and a keyset
+page from several concurrent workers, once with statements rebuilt on every call (the legacy
+repository) and once through MessageRepository. It reports the process CPU time per call,
+which is where the difference lies: both variants hit the compiled cache, but only the
+prebuilt statements skip rebuilding the select() and recomputing its cache key.
+
+    python -m benchmarks.bench_hot_queries --calls 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import desc, event, select, tuple_
+from sqlalchemy.engine.default import CACHE_HIT
+
+from src.core.membership_cache import membership_cache
+from src.database.session import AsyncSessionLocal, engine
+from src.models.all_models import User, Conversation, ConversationParticipant, Message
+from src.modules.messages.repository import MessageRepository
+
+async def setup_conversation(members: int, messages: int) -> tuple:
+    async with AsyncSessionLocal() as db:
+        users = [
+            User(id=uuid.uuid4(), email=f"bench-{uuid.uuid4().hex}@example.com", username=f"bench-{uuid.uuid4().hex}", hashed_password="x")
+            for _ in range(members)
+        ]
+        db.add_all(users)
+        await db.flush()
+        conversation = Conversation(id=uuid.uuid4(), title="bench", is_group=True, creator_id=users[0].id)
+        db.add(conversation)
+        await db.flush()
+        db.add_all([ConversationParticipant(conversation_id=conversation.id, user_id=u.id) for u in users])
+        now = datetime.now(timezone.utc)
+        rows = [
+            Message(
+                conversation_id=conversation.id, sender_id=users[i % members].id, content=f"message {i}",
+                message_type="text", created_at=now - timedelta(seconds=messages - i), seq=i + 1
+            )
+            for i in range(messages)
+        ]
+        db.add_all(rows)
+        await db.commit()
+        positions = [(m.created_at, m.id) for m in rows]
+        return str(conversation.id), [str(u.id) for u in users], positions
+
+class LegacyQueries:
+    """The hot queries as the repository used to build them: a fresh select() per call."""
+    def __init__(self, db):
+        self.db = db
+
+    async def get_participant(self, conversation_id: str, user_id: str):
+        stmt = select(ConversationParticipant).where(
+            ConversationParticipant.conversation_id == uuid.UUID(conversation_id),
+            ConversationParticipant.user_id == uuid.UUID(user_id)
+        )
+        return (await self.db.execute(stmt)).scalars().first()
+
+    async def get_active_participant_ids(self, conversation_id: str):
+        stmt = select(ConversationParticipant.user_id, ConversationParticipant.is_active).where(
+            ConversationParticipant.conversation_id == uuid.UUID(conversation_id)
+        )
+        return [str(user_id) for user_id, _ in (await self.db.execute(stmt)).all()]
+
+    async def get_messages_page(self, conversation_id: str, limit: int, position):
+        created_at, message_id = position
+        stmt = (
+            select(Message)
+            .where(
+                Message.conversation_id == uuid.UUID(conversation_id),
+                Message.is_deleted == False,
+                tuple_(Message.created_at, Message.id) < tuple_(created_at, message_id),
+                Message.created_at <= created_at
+            )
+            .order_by(desc(Message.created_at), desc(Message.id))
+            .limit(limit)
+        )
+        return list((await self.db.execute(stmt)).scalars().all())
+
+async def worker(queries_factory, conversation_id: str, user_ids: list, positions: list, calls: int, offset: int):
+    async with AsyncSessionLocal() as db:
+        queries = queries_factory(db)
+        for i in range(calls):
+            step = offset + i
+            await queries.get_participant(conversation_id, user_ids[step % len(user_ids)])
+            # Bypass the membership cache so the statement is executed every time
+            membership_cache.clear()
+            await queries.get_active_participant_ids(conversation_id)
+            await queries.get_messages_page(conversation_id, 50, positions[step % len(positions)])
+
+async def run(name: str, queries_factory, conversation_id: str, user_ids: list, positions: list, calls: int, concurrency: int, cache_hits: list):
+    # Warm up connections and statement caches
+    await worker(queries_factory, conversation_id, user_ids, positions, 10, 0)
+
+    cache_hits[:] = [0, 0]
+    per_worker = calls // concurrency
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[
+        worker(queries_factory, conversation_id, user_ids, positions, per_worker, n * per_worker)
+        for n in range(concurrency)
+    ])
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    statements = per_worker * concurrency * 3
+    print(
+        f"{name:>8}: {cpu / statements * 1e6:.1f} us CPU/query, "
+        f"{statements / wall:.0f} queries/s, "
+        f"compiled cache hits {cache_hits[0]}/{cache_hits[1]}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    cache_hits = [0, 0]
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def count_cache_hit(conn, cursor, statement, parameters, context, executemany):
+        cache_hits[0] += context.cache_hit == CACHE_HIT
+        cache_hits[1] += 1
+
+    conversation_id, user_ids, positions = await setup_conversation(args.members, args.messages)
+    print(f"dialect={engine.dialect.name} calls={args.calls} concurrency={args.concurrency}")
+    # Alternating rounds, so neither variant benefits from running second
+    for _ in range(args.rounds):
+        await run("legacy", LegacyQueries, conversation_id, user_ids, positions, args.calls, args.concurrency, cache_hits)
+        await run("prebuilt", MessageRepository, conversation_id, user_ids, positions, args.calls, args.concurrency, cache_hits)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
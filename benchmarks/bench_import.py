@@ -0,0 +1,70 @@
+"""
+Measures history import throughput.
+
+Generates an NDJSON file with `--conversations` conversations of `--messages` messages each
+(written by a couple of freshly created users), then imports it with HistoryImporter against
+DATABASE_URL (migrated to head) and prints the final report.
+
+    python -m benchmarks.bench_import --conversations 100 --messages 2000 --batch-size 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from src.database.session import AsyncSessionLocal, engine
+from src.models.all_models import User
+from src.modules.imports.importer import HistoryImporter, iter_lines, _file_chunks
+
+async def create_users(count: int) -> list:
+    async with AsyncSessionLocal() as db:
+        users = [
+            User(id=uuid.uuid4(), email=f"bench-{uuid.uuid4().hex}@example.com", username=f"bench-{uuid.uuid4().hex}", hashed_password="x")
+            for _ in range(count)
+        ]
+        db.add_all(users)
+        await db.commit()
+        return [str(u.id) for u in users]
+
+def write_history(path: str, user_ids: list, conversations: int, messages: int):
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    with open(path, "w") as f:
+        for _ in range(conversations):
+            conversation_id = str(uuid.uuid4())
+            f.write(json.dumps({"kind": "conversation", "id": conversation_id, "is_group": True, "creator_id": user_ids[0]}) + "\n")
+            for user_id in user_ids:
+                f.write(json.dumps({"kind": "participant", "conversation_id": conversation_id, "user_id": user_id}) + "\n")
+            for i in range(messages):
+                f.write(json.dumps({
+                    "kind": "message",
+                    "conversation_id": conversation_id,
+                    "sender_id": user_ids[i % len(user_ids)],
+                    "content": f"historical message number {i}",
+                    "created_at": (start + timedelta(seconds=i)).isoformat()
+                }) + "\n")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    user_ids = await create_users(2)
+    fd, path = tempfile.mkstemp(suffix=".ndjson")
+    os.close(fd)
+    try:
+        write_history(path, user_ids, args.conversations, args.messages)
+        print(f"dialect={engine.dialect.name} file={os.path.getsize(path) / 1e6:.1f} MB batch_size={args.batch_size}")
+        importer = HistoryImporter(AsyncSessionLocal, batch_size=args.batch_size)
+        report = await importer.run(iter_lines(_file_chunks(path)))
+        print(report.model_dump_json(indent=2))
+    finally:
+        os.unlink(path)
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Compares the legacy add-participants path (load the whole membership, add ORM objects) with the
+chunked INSERT ... ON CONFLICT one, on very large groups.
+
+Runs against the database in DATABASE_URL (migrated to head). It creates its own users and
+conversations, then grows a group to --members through each path, adds a few more members to the
+full group, and (bulk path only) removes a share of them again, reporting time and peak Python
+memory of every step.
+
+    python -m benchmarks.bench_participants --members 50000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
+
+from src.database.session import AsyncSessionLocal, engine
+from src.models.all_models import User, Conversation, ConversationParticipant
+from src.modules.conversations.participants import bulk_add_participants, bulk_remove_participants
+
+async def create_users(count: int) -> list:
+    ids = [uuid.uuid4() for _ in range(count)]
+    async with AsyncSessionLocal() as db:
+        rows = [{"id": i, "email": f"bench-{i.hex}@example.com", "username": f"bench-{i.hex}", "hashed_password": "x"} for i in ids]
+        for start in range(0, len(rows), 10000):
+            await db.execute(insert(User), rows[start:start + 10000])
+        await db.commit()
+    return ids
+
+async def create_conversation(creator_id: uuid.UUID) -> uuid.UUID:
+    async with AsyncSessionLocal() as db:
+        conversation = Conversation(id=uuid.uuid4(), title="bench", is_group=True, creator_id=creator_id)
+        db.add(conversation)
+        await db.flush()
+        db.add(ConversationParticipant(conversation_id=conversation.id, user_id=creator_id, role="admin"))
+        await db.commit()
+        return conversation.id
+
+async def add_legacy(conversation_id: uuid.UUID, user_ids: list) -> int:
+    async with AsyncSessionLocal() as db:
+        stmt = (
+            select(Conversation)
+            .options(selectinload(Conversation.participants))
+            .where(Conversation.id == conversation_id)
+        )
+        conversation = (await db.execute(stmt)).scalars().first()
+        existing_ids = {p.user_id for p in conversation.participants}
+        new_participants = [
+            ConversationParticipant(conversation_id=conversation.id, user_id=pid, role="member")
+            for pid in user_ids if pid not in existing_ids
+        ]
+        db.add_all(new_participants)
+        await db.commit()
+        return len(new_participants)
+
+async def add_bulk(conversation_id: uuid.UUID, user_ids: list) -> int:
+    async with AsyncSessionLocal() as db:
+        added = await bulk_add_participants(db, conversation_id, user_ids)
+        await db.commit()
+        return len(added)
+
+async def remove_bulk(conversation_id: uuid.UUID, user_ids: list) -> int:
+    async with AsyncSessionLocal() as db:
+        removed = await bulk_remove_participants(db, conversation_id, user_ids)
+        await db.commit()
+        return len(removed)
+
+async def measure(name: str, step, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = await step(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>32}: {count:>6} rows, {elapsed * 1000:9.1f} ms, peak {peak / 2**20:7.1f} MiB")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=50000)
+    parser.add_argument("--extra", type=int, default=100)
+    args = parser.parse_args()
+
+    user_ids = await create_users(args.members + args.extra)
+    members, extra = user_ids[:args.members], user_ids[args.members:]
+    print(f"dialect={engine.dialect.name} members={args.members} extra={args.extra}")
+
+    for name, add in (("legacy", add_legacy), ("bulk", add_bulk)):
+        conversation_id = await create_conversation(members[0])
+        await measure(f"{name}: add {args.members}", add, conversation_id, members)
+        await measure(f"{name}: add {args.extra} to full group", add, conversation_id, extra)
+        await measure(f"{name}: re-add {args.extra} members", add, conversation_id, extra)
+        if add is add_bulk:
+            await measure(f"{name}: remove {args.members // 5}", remove_bulk, conversation_id, members[1:args.members // 5 + 1])
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Compares the legacy multi-query send path with the fused single-statement one.
+
+Runs against the database in DATABASE_URL (migrated to head). It creates its own users and
+conversation, then sends messages through both paths, reporting the number of statements and
+the per-message latency of each.
+
+    python -m benchmarks.bench_send_message --messages 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import event, func, update
+
+from src.core.ids import uuid7
+from src.database.session import AsyncSessionLocal, engine
+from src.models.all_models import User, Conversation, ConversationParticipant, Message
+from src.modules.messages.repository import MessageRepository
+
+async def setup_conversation(members: int) -> tuple:
+    async with AsyncSessionLocal() as db:
+        users = [
+            User(id=uuid.uuid4(), email=f"bench-{uuid.uuid4().hex}@example.com", username=f"bench-{uuid.uuid4().hex}", hashed_password="x")
+            for _ in range(members)
+        ]
+        db.add_all(users)
+        await db.flush()
+        conversation = Conversation(id=uuid.uuid4(), title="bench", is_group=True, creator_id=users[0].id)
+        db.add(conversation)
+        await db.flush()
+        db.add_all([ConversationParticipant(conversation_id=conversation.id, user_id=u.id) for u in users])
+        await db.commit()
+        return str(conversation.id), str(users[0].id)
+
+async def create_message_legacy(db, conversation_id: str, sender_id: str, content: str) -> Message:
+    """
+    The legacy insert: an unchecked sequence bump, then an ORM add flushed on commit.
+    """
+    now = datetime.now(timezone.utc)
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.id == uuid.UUID(conversation_id))
+        .values(last_seq=Conversation.last_seq + 1, last_activity_at=now, updated_at=func.now())
+        .returning(Conversation.last_seq)
+        .execution_options(synchronize_session=False)
+    )
+    message = Message(
+        id=uuid7(now),
+        created_at=now,
+        conversation_id=uuid.UUID(conversation_id),
+        sender_id=uuid.UUID(sender_id),
+        seq=result.scalar_one(),
+        content=content,
+        message_type="text"
+    )
+    db.add(message)
+    return message
+
+async def send_legacy(conversation_id: str, sender_id: str, content: str):
+    async with AsyncSessionLocal() as db:
+        repo = MessageRepository(db)
+        await repo.get_conversation(conversation_id)
+        await repo.get_participant(conversation_id, sender_id)
+        await repo.get_active_participant_ids(conversation_id)
+        message = await create_message_legacy(db, conversation_id, sender_id, content)
+        await db.commit()
+        await db.refresh(message)
+
+async def send_fused(conversation_id: str, sender_id: str, content: str):
+    async with AsyncSessionLocal() as db:
+        repo = MessageRepository(db)
+        _, participant_ids = await repo.insert_message_if_allowed(conversation_id, sender_id, content, "text", None)
+        if participant_ids is None:
+            await repo.get_active_participant_ids(conversation_id)
+        await db.commit()
+
+async def run(name: str, send, conversation_id: str, sender_id: str, messages: int, counter: list):
+    # Warm up connections and statement caches
+    for _ in range(10):
+        await send(conversation_id, sender_id, "warmup")
+
+    counter[0] = 0
+    latencies = []
+    for i in range(messages):
+        start = time.perf_counter()
+        await send(conversation_id, sender_id, f"message {i}")
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    print(
+        f"{name:>7}: {counter[0] / messages:.1f} statements/message, "
+        f"mean {statistics.mean(latencies) * 1000:.3f} ms, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.3f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--members", type=int, default=10)
+    args = parser.parse_args()
+
+    # Counts statements sent to the server (COMMIT included, as it is a round trip too)
+    counter = [0]
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_statement(*_):
+        counter[0] += 1
+    @event.listens_for(engine.sync_engine, "commit")
+    def count_commit(*_):
+        counter[0] += 1
+
+    conversation_id, sender_id = await setup_conversation(args.members)
+    print(f"dialect={engine.dialect.name} messages={args.messages} members={args.members}")
+    await run("legacy", send_legacy, conversation_id, sender_id, args.messages, counter)
+    await run("fused", send_fused, conversation_id, sender_id, args.messages, counter)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
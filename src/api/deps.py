@@ -1,8 +1,8 @@
-from typing import Annotated, Generator
+from typing import Annotated, AsyncGenerator, Generator
 from fastapi import Depends, HTTPException, status, Query, WebSocketException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.ext.asyncio import AsyncSession
-from src.database.session import get_db
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from src.database.session import get_db, get_session_factory, AsyncSessionLocal, AsyncReadSessionLocal, read_your_writes
 from src.core.config import get_settings
 from src.core.interfaces import AuthProvider
 from src.core.storage_interfaces import StorageProvider
@@ -16,14 +16,20 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/login"
 )
 
+def build_auth_provider(db: AsyncSession) -> AuthProvider:
+    """
+    Builds the authentication provider for the given session.
+    Currently hardcoded to BasicAuthProvider, but can be switched based on config.
+    """
+    return BasicAuthProvider(db_session=db)
+
 async def get_auth_provider(
     db: AsyncSession = Depends(get_db)
 ) -> AuthProvider:
     """
     Dependency to get the authentication provider.
-    Currently hardcoded to BasicAuthProvider, but can be switched based on config.
     """
-    return BasicAuthProvider(db_session=db)
+    return build_auth_provider(db)
 
 async def get_storage_provider() -> StorageProvider:
     """
@@ -52,15 +58,28 @@ async def get_current_user(
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
 
+async def get_current_superuser(
+    current_user: User = Depends(get_current_user)
+) -> User:
+    """
+    Dependency restricting an endpoint to superusers (internal/admin endpoints).
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
+    return current_user
+
 async def get_current_user_ws(
     token: str = Query(...),
-    auth_provider: AuthProvider = Depends(get_auth_provider)
+    session_factory: async_sessionmaker = Depends(get_session_factory)
 ) -> User:
     """
     Dependency for WebSocket authentication via query parameter.
+    The session is only held for the token check: a `get_db` dependency would stay open
+    (and keep a pooled connection checked out) for the whole lifetime of the socket.
     """
     try:
-        user = await auth_provider.get_current_user(token)
+        async with session_factory() as db:
+            user = await build_auth_provider(db).get_current_user(token)
     except Exception:
         raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
         
@@ -68,6 +87,32 @@ async def get_current_user_ws(
         raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
     return user
 
+async def _read_session_factory(user: User) -> async_sessionmaker:
+    # Users who wrote within the read-your-writes window are pinned to the primary
+    if await read_your_writes.is_pinned(str(user.id)):
+        return AsyncSessionLocal
+    return AsyncReadSessionLocal
+
+async def get_read_db(
+    current_user: User = Depends(get_current_user)
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only endpoints, served by the read replica.
+    Users who wrote within the read-your-writes window are pinned to the primary.
+    """
+    async with (await _read_session_factory(current_user))() as session:
+        yield session
+
+async def get_read_session_factory(
+    current_user: User = Depends(get_current_user)
+) -> async_sessionmaker:
+    """
+    Read-only counterpart of `get_session_factory`, for endpoints that manage the session
+    lifetime themselves (e.g. streaming responses). Same replica routing as `get_read_db`.
+    """
+    return await _read_session_factory(current_user)
+
 CurrentUser = Annotated[User, Depends(get_current_user)]
 DB = Annotated[AsyncSession, Depends(get_db)]
+ReadDB = Annotated[AsyncSession, Depends(get_read_db)]
 
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
@@ -17,14 +18,81 @@ class Settings(BaseSettings):
     # Using asyncpg driver for PostgreSQL
     DATABASE_URL: str
     
+    # Connection pool and driver tuning
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800 # seconds, -1 disables
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100 # asyncpg prepared statements cached per connection
+    DB_PGBOUNCER_MODE: bool = False # disables prepared statement caching for transaction-pooling PgBouncer
+    
+    # Optional read replica for list endpoints (falls back to DATABASE_URL)
+    DATABASE_READ_URL: Optional[str] = None
+    # Users who wrote within this window read from the primary
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    
     # Redis
     REDIS_URL: str
+    # Message events are published per user shard; workers only subscribe to the shards of users connected to them.
+    # A worker with U connected users subscribes to about 1 - e^(-U/shards) of the shards (and receives that share
+    # of all events): ~6% for 1000 users at 16384 shards. More shards filter better but cost one PUBLISH per distinct
+    # recipient shard (large groups) and one event log stream per shard. Changing it makes reconnecting clients resync.
+    REDIS_EVENT_SHARDS: int = 16384
+    # Durable log of message events, replayed to clients reconnecting with a last_event_id:
+    # "none", "redis" (Redis Streams) or "memory" (in-process, single instance only)
+    EVENT_LOG_BACKEND: str = "none"
+    EVENT_LOG_MAX_EVENTS: int = 1000 # kept per shard (each shard holds the events of only ~users/REDIS_EVENT_SHARDS users)
+    EVENT_LOG_REPLAY_MAX_EVENTS: int = 200 # further behind than this, the client is told to resync (keep below WS_SEND_QUEUE_SIZE)
     
     # Security
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Authenticated principal cache (avoids a users lookup per request)
+    AUTH_CACHE_MAX_SIZE: int = 10000
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    
+    # Password hashing (argon2 runs off the event loop on this pool)
+    PASSWORD_HASH_EXECUTOR: str = "thread" # "thread" or "process"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    
+    # Conversation participant cache (bounded by the total number of cached members)
+    MEMBERSHIP_CACHE_MAX_MEMBERS: int = 200000
+    MEMBERSHIP_CACHE_TTL_SECONDS: int = 30
+    
+    # Participants added/removed per statement by the bulk membership endpoints
+    PARTICIPANT_BATCH_SIZE: int = 5000
+    
+    # Outbound WebSocket frames queued per connection; a full queue drops its oldest frame or evicts the connection
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_QUEUE_OVERFLOW: str = "drop_oldest" # "drop_oldest" or "disconnect"
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0
+    
+    # Upper bound on messages accepted by one batch send
+    MESSAGE_BATCH_MAX_ITEMS: int = 100
+    
+    # Monthly message partitions kept created ahead of time (PostgreSQL), and how often to check
+    MESSAGE_PARTITION_MONTHS_AHEAD: int = 3
+    MESSAGE_PARTITION_CHECK_INTERVAL_SECONDS: int = 6 * 3600
+    
+    # Read receipts are buffered in memory and written in batches (see read_receipts.py)
+    READ_RECEIPT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    READ_RECEIPT_FLUSH_BATCH_SIZE: int = 1000
+    READ_RECEIPT_MAX_PENDING: int = 100000
+    
+    # Deleted messages keep their content this long before compaction clears it
+    TOMBSTONE_GRACE_SECONDS: int = 7 * 24 * 3600
+    TOMBSTONE_COMPACTION_BATCH_SIZE: int = 500
+    TOMBSTONE_COMPACTION_INTERVAL_SECONDS: int = 3600
+    
+    # Retried sends carrying the same idempotency key return the original message for this long
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 3600
+    IDEMPOTENCY_KEY_PURGE_INTERVAL_SECONDS: int = 3600
+    IDEMPOTENCY_CACHE_MAX_ENTRIES: int = 100000
+    
     class Config:
         # Load variables from .env file
         env_file = ".env"
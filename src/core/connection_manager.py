@@ -1,45 +1,255 @@
-import uuid
-from typing import Dict, List, Any
-from fastapi import WebSocket
+import asyncio
+import bisect
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import orjson
+from fastapi import WebSocket, status
+
+from src.core.config import get_settings
+from src.core.metrics import LatencyHistogram
+
+settings = get_settings()
+logger = logging.getLogger("chat_api")
+
+# What to do when a client's outbound queue is full
+OVERFLOW_DROP_OLDEST = "drop_oldest" # discard the oldest queued frame (the client misses it)
+OVERFLOW_DISCONNECT = "disconnect" # close the connection; the client reconnects and catches up
+
+# Upper bounds of the queue depth buckets reported by stats()
+QUEUE_DEPTH_BUCKETS = (0, 1, 8, 64, 512)
+
+class ClientConnection:
+    """
+    One WebSocket with its bounded outbound queue, drained by a dedicated writer task.
+    Enqueueing never waits, so a slow or stalled client only ever delays itself.
+    """
+    def __init__(self, manager: "ConnectionManager", user_id: str, websocket: WebSocket, replaying: bool = False):
+        self.manager = manager
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue: Deque[str] = deque()
+        self.dropped = 0
+        self.closed = False
+        self.sending_since: Optional[float] = None
+        # Live (event id, frame) pairs held back while missed events are replayed
+        self.held: Optional[List[Tuple[Optional[str], str]]] = [] if replaying else None
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: str, event_id: Optional[str] = None):
+        if self.closed:
+            return
+        if self.held is not None:
+            self.held.append((event_id, frame))
+            return
+        if len(self.queue) >= self.manager.max_queue:
+            if self.manager.overflow_policy == OVERFLOW_DISCONNECT:
+                self.manager.evict(self, "queue_overflow")
+                return
+            self.queue.popleft()
+            self.dropped += 1
+            self.manager.frames_dropped += 1
+        self.queue.append(frame)
+        self._ready.set()
+
+    def finish_replay(self, frames: List[Tuple[Optional[str], str]]):
+        """
+        Queues the replayed frames, then the live ones held meanwhile, minus those that were
+        replayed too (published between subscribing and reading the log).
+        """
+        held, self.held = self.held or [], None
+        replayed = {event_id for event_id, _ in frames if event_id is not None}
+        for event_id, frame in frames:
+            self.enqueue(frame, event_id)
+        for event_id, frame in held:
+            if event_id is None or event_id not in replayed:
+                self.enqueue(frame, event_id)
+
+    def close(self):
+        """
+        Stops the writer; frames still queued are discarded.
+        """
+        self.closed = True
+        self.queue.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+            frame = self.queue.popleft()
+            # Checked by the manager's watchdog, which evicts sends stalled past the timeout
+            self.sending_since = start = loop.time()
+            try:
+                await self.websocket.send_text(frame)
+            except Exception as e:
+                logger.warning(f"Failed to send to websocket for user {self.user_id}: {e}. Disconnecting.")
+                self.manager.send_failures += 1
+                self.manager.disconnect(self.user_id, self.websocket)
+                return
+            self.sending_since = None
+            self.manager.send_latency.observe(loop.time() - start)
+            self.manager.frames_sent += 1
 
 class ConnectionManager:
     """
     Manages active WebSocket connections to the API.
     A single user might have multiple active connections (e.g., mobile and desktop).
+
+    Outgoing frames are queued per connection (see ClientConnection) rather than sent inline, so
+    fan-out to many users is a series of non-blocking enqueues. Queues are bounded (`max_queue`);
+    a full queue either drops its oldest frame or gets its connection evicted (`overflow_policy`),
+    and a connection whose send stalls for `send_timeout` seconds is evicted too.
     """
-    def __init__(self):
-        # Maps user ID (as string) to a list of active WebSockets
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, max_queue: int = 256, overflow_policy: str = OVERFLOW_DROP_OLDEST, send_timeout: float = 10.0):
+        if overflow_policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT):
+            raise ValueError(f"Unknown websocket queue overflow policy: {overflow_policy}")
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        # Maps user ID (as string) to the user's active connections
+        self.active_connections: Dict[str, List[ClientConnection]] = {}
+        # Closing handshakes of evicted connections, kept referenced until they finish
+        self._closing: Set[asyncio.Task] = set()
+        self._watchdog: Optional[asyncio.Task] = None
+        # Presence hooks (set by the pub/sub manager to follow which users are connected here):
+        # awaited when a user's first connection opens, called when their last one closes
+        self.on_user_online: Optional[Callable[[str], Awaitable[None]]] = None
+        self.on_user_offline: Optional[Callable[[str], None]] = None
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.send_failures = 0
+        self.evictions: Dict[str, int] = {"queue_overflow": 0, "send_timeout": 0}
+        self.send_latency = LatencyHistogram()
 
-    async def connect(self, user_id: str, websocket: WebSocket):
+    async def connect(self, user_id: str, websocket: WebSocket, replaying: bool = False) -> ClientConnection:
+        """
+        Registers a connection. With `replaying`, live frames are held back until
+        ClientConnection.finish_replay is given the missed ones.
+        """
         await websocket.accept()
         if user_id not in self.active_connections:
             self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+            if self.on_user_online is not None:
+                await self.on_user_online(user_id)
+        connection = ClientConnection(self, user_id, websocket, replaying)
+        self.active_connections.setdefault(user_id, []).append(connection)
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch_sends())
+        return connection
 
-    def disconnect(self, user_id: str, websocket: WebSocket):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+    def disconnect(self, user_id: str, websocket: WebSocket) -> Optional[ClientConnection]:
+        connections = self.active_connections.get(user_id)
+        if not connections:
+            return None
+        for connection in connections:
+            if connection.websocket is websocket:
+                connections.remove(connection)
+                connection.close()
+                break
+        else:
+            return None
+        if not connections:
+            del self.active_connections[user_id]
+            if self.on_user_offline is not None:
+                self.on_user_offline(user_id)
+            if not self.active_connections and self._watchdog is not None:
+                self._watchdog.cancel()
+                self._watchdog = None
+        return connection
+
+    def evict(self, connection: ClientConnection, reason: str):
+        """
+        Drops a connection that can't keep up and closes its socket in the background.
+        """
+        if self.disconnect(connection.user_id, connection.websocket) is None:
+            return
+        self.evictions[reason] += 1
+        logger.warning(f"Evicted slow websocket of user {connection.user_id} ({reason})")
+        task = asyncio.create_task(self._close_socket(connection.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _watch_sends(self):
+        """
+        Evicts connections whose current send has been stalled for longer than `send_timeout`.
+        One sweep for all connections instead of a timer per frame.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.send_timeout / 2)
+            deadline = loop.time() - self.send_timeout
+            stalled = [
+                c for connections in self.active_connections.values() for c in connections
+                if c.sending_since is not None and c.sending_since < deadline
+            ]
+            for connection in stalled:
+                self.evict(connection, "send_timeout")
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=status.WS_1013_TRY_AGAIN_LATER), timeout=self.send_timeout)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: Any, user_id: str):
         """
         Send a JSON message to all active connections of a specific user.
-        Cleans up any connections that fail to send (dead connections).
         """
         if user_id in self.active_connections:
-            # Iterate over a copy of the list so we can remove items safely
-            connections = list(self.active_connections[user_id])
-            for connection in connections:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger("chat_api")
-                    logger.warning(f"Failed to send to websocket for user {user_id}: {e}. Disconnecting.")
-                    self.disconnect(user_id, connection)
+            self.send_text(orjson.dumps(message).decode(), user_id)
+
+    def send_text_to_users(self, frame: str, user_ids: Iterable[str], event_id: Optional[str] = None) -> int:
+        """
+        Queue an already encoded frame on every active connection of each user (the same frame for all).
+        Returns how many of the users are connected here.
+        """
+        active = self.active_connections
+        delivered = 0
+        for user_id in user_ids:
+            if user_id in active:
+                self.send_text(frame, user_id, event_id)
+                delivered += 1
+        return delivered
+
+    def send_text(self, frame: str, user_id: str, event_id: Optional[str] = None):
+        """
+        Queue an already encoded frame on all active connections of a specific user.
+        """
+        # Iterate over a copy: an overflowing connection may be evicted on the way
+        for connection in list(self.active_connections.get(user_id, ())):
+            connection.enqueue(frame, event_id)
+
+    def stats(self) -> dict:
+        depths = [len(c.queue) for connections in self.active_connections.values() for c in connections]
+        buckets = [0] * (len(QUEUE_DEPTH_BUCKETS) + 1)
+        for depth in depths:
+            buckets[bisect.bisect_left(QUEUE_DEPTH_BUCKETS, depth)] += 1
+        depth_buckets = {f"le_{bound}": n for bound, n in zip(QUEUE_DEPTH_BUCKETS, buckets)}
+        depth_buckets["gt_max"] = buckets[-1]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(depths),
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_depths": depth_buckets,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "send_failures": self.send_failures,
+            "evictions": dict(self.evictions),
+            "send_latency": self.send_latency.snapshot(),
+        }
 
 # Global instance for the server
-manager = ConnectionManager()
+manager = ConnectionManager(
+    max_queue=settings.WS_SEND_QUEUE_SIZE,
+    overflow_policy=settings.WS_SEND_QUEUE_OVERFLOW,
+    send_timeout=settings.WS_SEND_TIMEOUT_SECONDS
+)
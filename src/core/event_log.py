@@ -0,0 +1,91 @@
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+import redis.asyncio as redis
+
+from src.core.event_log_interfaces import EventLog
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    """
+    "<ms>-<seq>" -> (ms, seq), for ordering. Raises ValueError for anything else.
+    """
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+class MemoryEventLog:
+    """
+    In-process event log, for tests and single-instance deployments. Lost on restart.
+    """
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        # shard -> ((ms, seq), id, event), oldest first
+        self._shards: Dict[int, Deque[Tuple[Tuple[int, int], str, str]]] = {}
+        self._last = (0, 0)
+
+    def _next_id(self) -> Tuple[int, int]:
+        ms = int(time.time() * 1000)
+        self._last = (ms, 0) if ms > self._last[0] else (self._last[0], self._last[1] + 1)
+        return self._last
+
+    async def append(self, events: Sequence[Tuple[int, str]]) -> List[str]:
+        ids = []
+        for shard, event in events:
+            key = self._next_id()
+            event_id = f"{key[0]}-{key[1]}"
+            self._shards.setdefault(shard, deque(maxlen=self.max_events)).append((key, event_id, event))
+            ids.append(event_id)
+        return ids
+
+    async def read_after(self, shard: int, last_event_id: str, count: int) -> Tuple[List[Tuple[str, str]], bool]:
+        after = parse_event_id(last_event_id)
+        entries = self._shards.get(shard, ())
+        complete = not entries or entries[0][0] <= after or len(entries) < self.max_events
+        return [(event_id, event) for key, event_id, event in entries if key > after][:count], complete
+
+    async def close(self):
+        pass
+
+class RedisStreamEventLog:
+    """
+    Event log on Redis Streams: one stream per shard ("<prefix>:<shard>"), trimmed to about
+    `max_events` entries on every append (approximate MAXLEN, which Redis applies cheaply).
+    """
+    def __init__(self, url: str, max_events: int, prefix: str = "chat_event_log"):
+        self.redis_conn = redis.from_url(url, decode_responses=True)
+        self.max_events = max_events
+        self.prefix = prefix
+
+    def stream(self, shard: int) -> str:
+        return f"{self.prefix}:{shard}"
+
+    async def append(self, events: Sequence[Tuple[int, str]]) -> List[str]:
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for shard, event in events:
+                pipe.xadd(self.stream(shard), {"event": event}, maxlen=self.max_events, approximate=True)
+            return await pipe.execute()
+
+    async def read_after(self, shard: int, last_event_id: str, count: int) -> Tuple[List[Tuple[str, str]], bool]:
+        after = parse_event_id(last_event_id)
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            pipe.xrange(self.stream(shard), count=1)
+            pipe.xrange(self.stream(shard), min=f"({after[0]}-{after[1]}", count=count)
+            oldest, entries = await pipe.execute()
+        # The oldest entry still kept being past the client's position means the events in
+        # between may have been trimmed (or there were none; the client can't tell either way)
+        complete = not oldest or parse_event_id(oldest[0][0]) <= after
+        return [(event_id, fields["event"]) for event_id, fields in entries], complete
+
+    async def close(self):
+        await self.redis_conn.aclose()
+
+def build_event_log(backend: str, url: str, max_events: int) -> Optional[EventLog]:
+    """
+    The event log configured by EVENT_LOG_BACKEND, or None when disabled.
+    """
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return MemoryEventLog(max_events)
+    if backend == "redis":
+        return RedisStreamEventLog(url, max_events)
+    raise ValueError(f"Unknown event log backend: {backend}")
@@ -0,0 +1,28 @@
+from typing import List, Protocol, Sequence, Tuple
+
+class EventLog(Protocol):
+    """
+    Interface for the durable log of realtime events, kept per event shard with bounded retention.
+    Lets reconnecting clients replay what they missed instead of re-fetching conversations.
+    Supports Redis Streams and an in-memory stand-in.
+    """
+
+    async def append(self, events: Sequence[Tuple[int, str]]) -> List[str]:
+        """
+        Appends encoded events, given as (shard, event) pairs.
+
+        Returns:
+            List[str]: The ids assigned to the events, in order. Ids are "<ms>-<seq>" like Redis
+            stream ids, and increase within a shard.
+        """
+        ...
+
+    async def read_after(self, shard: int, last_event_id: str, count: int) -> Tuple[List[Tuple[str, str]], bool]:
+        """
+        Reads up to `count` (id, event) pairs of a shard following `last_event_id`.
+        The flag is False when events after `last_event_id` may already have been trimmed.
+        """
+        ...
+
+    async def close(self) -> None:
+        ...
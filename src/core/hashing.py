@@ -0,0 +1,87 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+from src.core import security
+from src.core.config import get_settings
+from src.core.metrics import LatencyHistogram
+
+settings = get_settings()
+
+class PasswordHasher:
+    """
+    Runs argon2 hashing/verification on a bounded worker pool so it never blocks the event loop.
+    Requests beyond `max_pending` in-flight operations are rejected with 503 instead of queueing unboundedly.
+    """
+    def __init__(self, executor_kind: str = "thread", max_workers: int = 4, max_pending: int = 64):
+        if executor_kind not in ("thread", "process"):
+            raise ValueError(f"Unsupported password hash executor: {executor_kind}")
+        self.executor_kind = executor_kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+
+        self.pending = 0
+        self.rejected = 0
+        # Latencies include time spent waiting for a free worker
+        self.hash_latency = LatencyHistogram()
+        self.verify_latency = LatencyHistogram()
+
+    def _get_executor(self) -> Executor:
+        # Created lazily so importing the module (e.g. in tests) doesn't spawn workers
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, histogram: LatencyHistogram, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent authentication requests, please retry",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+            histogram.observe(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hash_latency, security.get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.verify_latency, security.verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "max_workers": self.max_workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "hash_latency": self.hash_latency.snapshot(),
+            "verify_latency": self.verify_latency.snapshot(),
+        }
+
+# Global instance for the server
+password_hasher = PasswordHasher(
+    executor_kind=settings.PASSWORD_HASH_EXECUTOR,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING
+)
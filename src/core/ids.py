@@ -0,0 +1,28 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+# How far a message's created_at may drift from the time embedded in its UUIDv7 id
+UUID7_MAX_SKEW = timedelta(minutes=1)
+
+def uuid7(at: Optional[datetime] = None) -> uuid.UUID:
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48-bit Unix millisecond timestamp followed by random bits.
+    Message ids embed their creation time this way, so an id alone is enough to find
+    the `messages` partition holding it.
+    """
+    if at is None:
+        at = datetime.now(timezone.utc)
+    millis = int(at.timestamp() * 1000) & ((1 << 48) - 1)
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (millis << 80) | (0x7 << 76) | ((rand >> 62) & 0xFFF) << 64 | (0b10 << 62) | (rand & ((1 << 62) - 1))
+    return uuid.UUID(int=value)
+
+def uuid7_time(value: uuid.UUID) -> Optional[datetime]:
+    """
+    Creation time embedded in a version 7 UUID, or None for any other version.
+    """
+    if value.version != 7:
+        return None
+    return datetime.fromtimestamp((value.int >> 80) / 1000, tz=timezone.utc)
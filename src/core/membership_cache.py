@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from src.core.config import get_settings
+
+settings = get_settings()
+
+@dataclass
+class _CachedMembership:
+    members: Dict[str, bool] # user_id -> is_active
+    expires_at: float
+
+class MembershipCache:
+    """
+    Bounded LRU + TTL cache of conversation participant sets, so messaging hot paths
+    don't query `conversation_participants` on every request.
+
+    Memory is bounded by the total number of cached members (`max_members`), not by the number of
+    conversations; a conversation larger than the whole budget is simply never cached.
+
+    Fills are versioned: a caller takes `version()` *before* reading participants from the database
+    and passes it back to `set()`. Any invalidation of that conversation in between bumps its version,
+    so a fill that raced with a membership change is discarded instead of caching the old member set.
+    Invalidations are broadcast to other instances over Redis (see `RedisPubSubManager.invalidate_membership`);
+    the TTL bounds staleness if a broadcast is ever missed.
+    """
+    def __init__(self, max_members: int, ttl_seconds: float, max_versions: int = 100000):
+        self.max_members = max_members
+        self.ttl_seconds = ttl_seconds
+        self.max_versions = max_versions
+        self._entries: "OrderedDict[str, _CachedMembership]" = OrderedDict()
+        self._size = 0
+        # Per-conversation invalidation counters. Only recently invalidated conversations are tracked;
+        # forgetting one bumps the epoch, which conservatively voids every fill in flight.
+        self._versions: "OrderedDict[str, int]" = OrderedDict()
+        self._epoch = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def version(self, conversation_id: str) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(conversation_id, 0)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, bool]]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(conversation_id)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(conversation_id)
+        self.hits += 1
+        return entry.members
+
+    def set(self, conversation_id: str, members: Dict[str, bool], version: Tuple[int, int]):
+        if version != self.version(conversation_id):
+            self.stale_fills += 1
+            return
+        if len(members) > self.max_members:
+            return
+
+        self._remove(conversation_id)
+        self._entries[conversation_id] = _CachedMembership(dict(members), time.monotonic() + self.ttl_seconds)
+        self._size += len(members)
+
+        while self._size > self.max_members:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, conversation_id: str):
+        """
+        Drops the cached participants of a conversation and voids any fill of it still in flight.
+        """
+        self._remove(conversation_id)
+        self._versions[conversation_id] = self._versions.pop(conversation_id, 0) + 1
+        while len(self._versions) > self.max_versions:
+            self._versions.popitem(last=False)
+            self._epoch += 1
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        self._versions.clear()
+        self._epoch += 1
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._entries),
+            "members": self._size,
+            "max_members": self.max_members,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
+
+    def _remove(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= len(entry.members)
+
+# Global instance for the server
+membership_cache = MembershipCache(
+    max_members=settings.MEMBERSHIP_CACHE_MAX_MEMBERS,
+    ttl_seconds=settings.MEMBERSHIP_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,36 @@
+import bisect
+from typing import Sequence
+
+# Upper bounds (in milliseconds) of the default latency buckets
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class LatencyHistogram:
+    """
+    Minimal in-process latency histogram with fixed bucket bounds.
+    Cheap enough to update on hot paths; exported as plain dicts for internal endpoints.
+    """
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        # The last slot counts observations above the highest bound
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}ms": n for bound, n in zip(self.buckets_ms, self.counts)}
+        buckets["gt_max"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "buckets": buckets,
+        }
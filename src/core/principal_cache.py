@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.core.config import get_settings
+from src.models.all_models import User
+
+settings = get_settings()
+
+@dataclass
+class _CachedPrincipal:
+    user_id: str
+    values: dict
+    expires_at: float
+
+class PrincipalCache:
+    """
+    Bounded LRU + TTL cache of authenticated principals, keyed by the raw access token.
+    A hit skips both the JWT decode and the `users` lookup.
+
+    Entries never outlive the token's own `exp` claim, and are dropped whenever the
+    underlying user row is updated or deleted through the ORM (see the listeners below).
+    The cache is per-process, so on other workers a change becomes visible after at most `ttl_seconds`.
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _CachedPrincipal]" = OrderedDict()
+        # Secondary index so a user row change can drop every token issued to that user
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(token)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        # Hand out a fresh detached instance per request so callers never share ORM state
+        user = User(**entry.values)
+        make_transient_to_detached(user)
+        return user
+
+    def set(self, token: str, user: User, token_exp: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+        lifetime = self.ttl_seconds
+        if token_exp is not None:
+            lifetime = min(lifetime, token_exp - time.time())
+        if lifetime <= 0:
+            return
+
+        user_id = str(user.id)
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = _CachedPrincipal(user_id, values, time.monotonic() + lifetime)
+        self._tokens_by_user.setdefault(user_id, set()).add(token)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str):
+        """
+        Drops every cached token belonging to the given user.
+        """
+        tokens = self._tokens_by_user.pop(str(user_id), None)
+        if not tokens:
+            return
+        for token in tokens:
+            self._entries.pop(token, None)
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry.user_id]
+
+# Global instance for the server
+principal_cache = PrincipalCache(
+    max_size=settings.AUTH_CACHE_MAX_SIZE,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS
+)
+
+# Any ORM-level change to a user row (is_active, password, deletion...) drops its cached principals.
+# Bulk `update(User)` statements bypass these hooks and must call `principal_cache.invalidate_user` themselves.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_principal(mapper, connection, target: User):
+    if target.id is not None:
+        principal_cache.invalidate_user(str(target.id))
@@ -1,53 +1,254 @@
-import json
 import asyncio
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+import orjson
 import redis.asyncio as redis
 from src.core.config import get_settings
 from src.core.connection_manager import manager
+from src.core.event_log import build_event_log, parse_event_id
+from src.core.event_log_interfaces import EventLog
+from src.core.membership_cache import membership_cache
 import logging
 
 settings = get_settings()
 logger = logging.getLogger("chat_api")
 
+# new_message events carry the client frame already encoded, spliced in as their last member
+# ({"type": ..., "participant_ids": [...], "data": <frame>}). Readers slice the frame out and
+# forward it as is, so the body is encoded once by the publisher and never decoded in between.
+# The event is still plain JSON, so readers that decode it whole keep working.
+FRAME_MARKER = ',"data":'
+
+def encode_event(header: dict, frame: str) -> str:
+    return orjson.dumps(header).decode()[:-1] + FRAME_MARKER + frame + "}"
+
+# Sent instead of a replay when the client is too far behind (or events can't be replayed):
+# it has to re-fetch its conversations
+RESYNC_FRAME = '{"event_type":"resync_required"}'
+
+# Events read from the log per round trip while replaying
+REPLAY_PAGE_SIZE = 500
+
+def frame_with_event_id(frame: str, event_id: str) -> str:
+    """
+    Adds the event id to an encoded frame (a JSON object), so clients can resume from it.
+    """
+    prefix = orjson.dumps({"event_id": event_id}).decode()[:-1]
+    return prefix + ("}" if frame == "{}" else "," + frame[1:])
+
+def decode_event(raw: str) -> Tuple[dict, Optional[str]]:
+    """
+    Splits an event into its header and pre-encoded frame (None for events without one).
+    """
+    marker = raw.find(FRAME_MARKER)
+    if marker == -1:
+        return orjson.loads(raw), None
+    return orjson.loads(raw[:marker] + "}"), raw[marker + len(FRAME_MARKER):-1]
+
+def user_shard(user_id: str, shards: int) -> int:
+    """
+    The event shard of a user. crc32 rather than hash(), which differs between processes.
+    """
+    return zlib.crc32(user_id.encode()) % shards
+
 class RedisPubSubManager:
     """
     Handles Redis connection and PubSub operations.
     This enables horizontal scaling by broadcasting events across all API instances.
+
+    Message events are routed by interest: users are spread over `shards` channels
+    ("chat_events:<shard>"), each instance subscribes only to the shards of the users connected
+    to it (refcounted, driven by the connection manager), and publish_message sends each shard
+    just its own recipients. An instance still receives the events of every user sharing a shard
+    with one of its users: with U local users it subscribes to about 1 - e^(-U/shards) of the
+    shards, so `shards` has to be well above the users per instance for the filtering to pay off.
+    The price of more shards is one PUBLISH per distinct recipient shard (a message to a large
+    group approaches one per member) and more, smaller event log streams. stats() reports the
+    events received against those with a local recipient, to measure it.
+    Control events (membership invalidation) still go to every instance on the `chat_events` channel.
+
+    With an event log, message events are appended to it (per shard) before being published,
+    and carry the id they got there, which clients pass back as `last_event_id` on reconnect.
     """
-    def __init__(self):
+    def __init__(self, shards: int = 16384, event_log: Optional[EventLog] = None, replay_max_events: int = 200):
         self.redis_conn = None
         self.pubsub = None
         self.channel_name = "chat_events"
+        self.shards = shards
+        self.event_log = event_log
+        self.replay_max_events = replay_max_events
+        # Locally connected users per shard; a shard is subscribed while its count is positive
+        self.shard_users: Counter = Counter()
+        self.subscribed_shards: Set[int] = set()
+        self._pending_unsubscribes: Set[asyncio.Task] = set()
         self._reader_task = None
+        # new_message events read from the subscribed channels, and those with a recipient connected here
+        self.events_received = 0
+        self.events_delivered = 0
+
+    def shard_channel(self, shard: int) -> str:
+        return f"{self.channel_name}:{shard}"
 
     async def connect(self):
         self.redis_conn = redis.from_url(settings.REDIS_URL, decode_responses=True)
         self.pubsub = self.redis_conn.pubsub()
-        await self.pubsub.subscribe(self.channel_name)
+        # Users that connected before Redis was: their shards are subscribed in the same command
+        for user_id in list(manager.active_connections):
+            self.shard_users[user_shard(user_id, self.shards)] += 1
+        self.subscribed_shards.update(self.shard_users)
+        await self.pubsub.subscribe(self.channel_name, *(self.shard_channel(shard) for shard in self.subscribed_shards))
+        manager.on_user_online = self.user_online
+        manager.on_user_offline = self.user_offline
         logger.info("Connected to Redis PubSub")
         self._reader_task = asyncio.create_task(self.reader_task())
 
     async def disconnect(self):
+        manager.on_user_online = None
+        manager.on_user_offline = None
         if self._reader_task:
             self._reader_task.cancel()
         if self.pubsub:
-            await self.pubsub.unsubscribe(self.channel_name)
+            await self.pubsub.unsubscribe()
             await self.pubsub.close()
         if self.redis_conn:
             await self.redis_conn.aclose()
+        if self.event_log is not None:
+            await self.event_log.close()
+        self.shard_users.clear()
+        self.subscribed_shards.clear()
         logger.info("Disconnected from Redis PubSub")
 
+    async def user_online(self, user_id: str):
+        """
+        Called by the connection manager when a user's first local connection opens.
+        Subscribes to the user's shard before the connection starts receiving.
+        """
+        shard = user_shard(user_id, self.shards)
+        self.shard_users[shard] += 1
+        if shard in self.subscribed_shards:
+            return
+        self.subscribed_shards.add(shard)
+        try:
+            await self.pubsub.subscribe(self.shard_channel(shard))
+        except Exception as e:
+            self.subscribed_shards.discard(shard)
+            logger.error(f"Failed to subscribe to event shard {shard}: {e}")
+
+    def user_offline(self, user_id: str):
+        """
+        Called by the connection manager when a user's last local connection closes.
+        """
+        shard = user_shard(user_id, self.shards)
+        self.shard_users[shard] -= 1
+        if self.shard_users[shard] <= 0:
+            del self.shard_users[shard]
+            task = asyncio.create_task(self._unsubscribe_shard(shard))
+            self._pending_unsubscribes.add(task)
+            task.add_done_callback(self._pending_unsubscribes.discard)
+
+    async def _unsubscribe_shard(self, shard: int):
+        # A user of the shard may have connected again in the meantime
+        if shard in self.shard_users or shard not in self.subscribed_shards:
+            return
+        self.subscribed_shards.discard(shard)
+        try:
+            await self.pubsub.unsubscribe(self.shard_channel(shard))
+        except Exception as e:
+            # Harmless: events for users who aren't connected here are skipped
+            logger.error(f"Failed to unsubscribe from event shard {shard}: {e}")
+
     async def publish_message(self, message_data: dict, participant_ids: list[str]):
         """
-        Publish a new message event to the Redis channel.
+        Publish a new message event to the shard channels of its recipients.
         message_data: dict representing the message (json serializable)
         participant_ids: list of string UUIDs to receive the message
         """
+        by_shard: Dict[int, List[str]] = {}
+        for user_id in participant_ids:
+            by_shard.setdefault(user_shard(user_id, self.shards), []).append(user_id)
+        frame = orjson.dumps(message_data).decode()
+        events = [
+            (shard, {"type": "new_message", "participant_ids": user_ids})
+            for shard, user_ids in by_shard.items()
+        ]
+
+        event_ids: List[Optional[str]] = [None] * len(events)
+        if self.event_log is not None:
+            try:
+                event_ids = await self.event_log.append([(shard, encode_event(header, frame)) for shard, header in events])
+            except Exception as e:
+                # Still delivered live; only a reconnecting client could miss it
+                logger.error(f"Failed to append to the event log: {e}")
+
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for (shard, header), event_id in zip(events, event_ids):
+                if event_id is None:
+                    pipe.publish(self.shard_channel(shard), encode_event(header, frame))
+                else:
+                    header["event_id"] = event_id
+                    pipe.publish(self.shard_channel(shard), encode_event(header, frame_with_event_id(frame, event_id)))
+            await pipe.execute()
+
+    async def replay_events(self, user_id: str, last_event_id: str) -> List[Tuple[Optional[str], str]]:
+        """
+        The (event id, frame) pairs of a user's events after `last_event_id`, read from the event
+        log. Just the resync frame when they can't all be replayed: no log, an unknown id, events
+        already trimmed, or more than `replay_max_events` of them.
+        """
+        resync = [(None, RESYNC_FRAME)]
+        if self.event_log is None:
+            return resync
+        try:
+            parse_event_id(last_event_id)
+        except ValueError:
+            return resync
+
+        shard = user_shard(user_id, self.shards)
+        frames: List[Tuple[Optional[str], str]] = []
+        cursor = last_event_id
+        try:
+            while True:
+                entries, complete = await self.event_log.read_after(shard, cursor, REPLAY_PAGE_SIZE)
+                if not complete:
+                    return resync
+                for event_id, raw in entries:
+                    header, frame = decode_event(raw)
+                    if frame is None or user_id not in header.get("participant_ids", ()):
+                        continue
+                    if len(frames) == self.replay_max_events:
+                        return resync
+                    frames.append((event_id, frame_with_event_id(frame, event_id)))
+                if len(entries) < REPLAY_PAGE_SIZE:
+                    return frames
+                cursor = entries[-1][0]
+        except Exception as e:
+            logger.error(f"Failed to replay events for user {user_id}: {e}")
+            return resync
+
+    def stats(self) -> dict:
+        return {
+            "shards": self.shards,
+            "subscribed_shards": len(self.subscribed_shards),
+            "events_received": self.events_received,
+            "events_delivered": self.events_delivered,
+        }
+
+    async def invalidate_membership(self, conversation_id: str):
+        """
+        Drops the cached participants of a conversation on this instance and on every other one.
+        Call after the membership change has been committed.
+        """
+        membership_cache.invalidate(conversation_id)
         payload = {
-            "type": "new_message",
-            "participant_ids": participant_ids,
-            "data": message_data
+            "type": "membership_changed",
+            "conversation_id": conversation_id
         }
-        await self.redis_conn.publish(self.channel_name, json.dumps(payload))
+        try:
+            await self.redis_conn.publish(self.channel_name, orjson.dumps(payload).decode())
+        except Exception as e:
+            # Other instances will still pick the change up once their entry expires
+            logger.error(f"Failed to publish membership invalidation: {e}")
 
     async def reader_task(self):
         """
@@ -57,21 +258,30 @@ class RedisPubSubManager:
             async for message in self.pubsub.listen():
                 if message["type"] == "message":
                     try:
-                        data = json.loads(message["data"])
-                    except json.JSONDecodeError:
+                        data, frame = decode_event(message["data"])
+                    except orjson.JSONDecodeError:
                         continue
                         
                     if data.get("type") == "new_message":
-                        p_ids = data.get("participant_ids", [])
-                        msg_data = data.get("data", {})
+                        if frame is None:
+                            # Published in the older, fully decoded format: encode it once here
+                            frame = orjson.dumps(data.get("data", {})).decode()
                         
                         # Only send to active connections on THIS worker
-                        for pid in p_ids:
-                            await manager.send_personal_message(msg_data, pid)
+                        self.events_received += 1
+                        if manager.send_text_to_users(frame, data.get("participant_ids", []), data.get("event_id")):
+                            self.events_delivered += 1
+
+                    elif data.get("type") == "membership_changed":
+                        membership_cache.invalidate(data.get("conversation_id", ""))
                             
         except asyncio.CancelledError:
             pass
         except Exception as e:
             logger.error(f"Redis PubSub reader error: {e}")
 
-pubsub_manager = RedisPubSubManager()
+pubsub_manager = RedisPubSubManager(
+    shards=settings.REDIS_EVENT_SHARDS,
+    event_log=build_event_log(settings.EVENT_LOG_BACKEND, settings.REDIS_URL, settings.EVENT_LOG_MAX_EVENTS),
+    replay_max_events=settings.EVENT_LOG_REPLAY_MAX_EVENTS
+)
@@ -31,3 +31,10 @@ class StorageProvider(Protocol):
         Deletes a file by its key.
         """
         ...
+
+    def is_issued_key(self, key: str) -> bool:
+        """
+        Whether `key` has the shape of the keys `upload` returns. Anything else (e.g. a media_url
+        a client made up) must never be deleted.
+        """
+        ...
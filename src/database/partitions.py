@@ -0,0 +1,190 @@
+"""
+Maintenance of the monthly range partitions of `messages` (PostgreSQL only).
+
+`messages` is partitioned by `created_at`: one partition per calendar month (UTC), named
+`messages_yYYYYmMM`, plus `messages_legacy` holding everything written before partitioning
+was introduced. On any other backend, or on an unpartitioned table, every function here is a no-op.
+
+Command line usage:
+
+    python -m src.database.partitions list
+    python -m src.database.partitions ensure --months-ahead 3
+    python -m src.database.partitions detach --older-than-months 24 [--drop]
+"""
+import argparse
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger("chat_api")
+
+PARENT_TABLE = "messages"
+PARTITION_NAME_PATTERN = re.compile(r"^messages_(y\d{4}m\d{2}|legacy)$")
+
+# Serializes partition DDL across API instances and CLI runs
+_ADVISORY_LOCK_KEY = 0x6D736770 # "msgp"
+
+_BOUND_PATTERN = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+class Partition(NamedTuple):
+    name: str
+    lower: Optional[datetime] # None for MINVALUE
+    upper: Optional[datetime] # None for MAXVALUE
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'")).astimezone(timezone.utc)
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": PARENT_TABLE})
+    return result.scalar() is not None
+
+async def list_partitions(conn: AsyncConnection) -> List[Partition]:
+    if not await is_partitioned(conn):
+        return []
+    result = await conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+    """), {"table": PARENT_TABLE})
+
+    partitions = []
+    for name, bound in result.all():
+        match = _BOUND_PATTERN.search(bound or "")
+        if match is None:
+            continue # DEFAULT partition
+        partitions.append(Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    partitions.sort(key=lambda p: p.lower or datetime.min.replace(tzinfo=timezone.utc))
+    return partitions
+
+async def ensure_partitions(conn: AsyncConnection, start: datetime, end: datetime) -> List[str]:
+    """
+    Creates the monthly partitions needed to hold rows created between `start` and `end` (inclusive).
+    Months already covered by an existing partition are skipped. Returns the names of new partitions.
+    Runs inside the caller's transaction.
+    """
+    if not await is_partitioned(conn):
+        return []
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+
+    existing = await list_partitions(conn)
+    def covered(lower: datetime, upper: datetime) -> bool:
+        return any(
+            (p.lower is None or p.lower < upper) and (p.upper is None or p.upper > lower)
+            for p in existing
+        )
+
+    created = []
+    month = month_start(start)
+    while month <= end:
+        next_month = add_months(month, 1)
+        if not covered(month, next_month):
+            name = partition_name(month)
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+            ))
+            existing.append(Partition(name, month, next_month))
+            created.append(name)
+        month = next_month
+    return created
+
+async def ensure_future_partitions(conn: AsyncConnection, months_ahead: int) -> List[str]:
+    """
+    Makes sure the current month and the next `months_ahead` months have a partition.
+    """
+    this_month = month_start(datetime.now(timezone.utc))
+    return await ensure_partitions(conn, this_month, add_months(this_month, months_ahead))
+
+async def detach_partitions(
+    conn: AsyncConnection,
+    older_than: datetime,
+    drop: bool = False,
+    concurrently: bool = False
+) -> List[str]:
+    """
+    Detaches (and optionally drops) every partition holding only rows created before `older_than`.
+    Detached partitions stay around as plain tables until dropped, e.g. to be archived first.
+    `concurrently` avoids blocking queries on `messages` but requires an AUTOCOMMIT connection.
+    """
+    detached = []
+    for partition in await list_partitions(conn):
+        if partition.upper is None or partition.upper > older_than:
+            continue
+        option = " CONCURRENTLY" if concurrently else ""
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {partition.name}{option}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {partition.name}"))
+        detached.append(partition.name)
+    return detached
+
+async def maintain_partitions(engine: AsyncEngine, months_ahead: int, interval_seconds: float):
+    """
+    Background task keeping future partitions created, so inserts never hit a missing month.
+    """
+    while True:
+        try:
+            async with engine.begin() as conn:
+                created = await ensure_future_partitions(conn, months_ahead)
+            if created:
+                logger.info(f"Created message partitions: {', '.join(created)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Message partition maintenance failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+async def main():
+    from src.database.session import engine
+
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the messages table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    ensure = commands.add_parser("ensure")
+    ensure.add_argument("--months-ahead", type=int, default=3)
+    detach = commands.add_parser("detach")
+    detach.add_argument("--older-than-months", type=int, required=True)
+    detach.add_argument("--drop", action="store_true", help="Drop the partitions once detached")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "list":
+            async with engine.connect() as conn:
+                for p in await list_partitions(conn):
+                    print(f"{p.name}\t{p.lower.isoformat() if p.lower else 'MINVALUE'}\t{p.upper.isoformat() if p.upper else 'MAXVALUE'}")
+        elif args.command == "ensure":
+            async with engine.begin() as conn:
+                print("\n".join(await ensure_future_partitions(conn, args.months_ahead)) or "Nothing to create")
+        else:
+            cutoff = add_months(month_start(datetime.now(timezone.utc)), -args.older_than_months)
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                detached = await detach_partitions(conn, cutoff, drop=args.drop, concurrently=True)
+            print("\n".join(detached) or "Nothing to detach")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
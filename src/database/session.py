@@ -1,18 +1,70 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import time
+import uuid
+from collections import OrderedDict
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from src.core.config import get_settings
+from src.core.metrics import LatencyHistogram
 import logging
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records how long each checkout waited for a connection.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_histogram = LatencyHistogram()
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_histogram.observe(time.perf_counter() - start)
+
+def _engine_options(database_url: str) -> dict:
+    """
+    Builds create_async_engine keyword arguments from settings.
+    """
+    options = {
+        "echo": settings.DEBUG,
+        "future": True,
+        "poolclass": InstrumentedAsyncQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+    if make_url(database_url).get_driver_name() == "asyncpg":
+        connect_args = {"ssl": False}
+        if settings.DB_PGBOUNCER_MODE:
+            # PgBouncer (transaction pooling) can hand each transaction a different server connection,
+            # so named prepared statements must be neither cached nor reused.
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        else:
+            # asyncpg's own statement cache and SQLAlchemy's prepared statement cache per connection
+            connect_args["statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+            connect_args["prepared_statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+        options["connect_args"] = connect_args
+
+    return options
+
 # Create the Async Engine
 # echo=True will log all SQL queries, useful for debugging but should be False in prod
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.DEBUG,
-    future=True,
-    connect_args={"ssl": False}
-)
+engine = create_async_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 
 # Create the session factory
 # exclude_pending=True ensures we only return committed data by default
@@ -23,10 +75,93 @@ AsyncSessionLocal = async_sessionmaker(
     autoflush=False
 )
 
+# Optional read replica. Without DATABASE_READ_URL, reads simply go to the primary engine.
+if settings.DATABASE_READ_URL:
+    read_engine = create_async_engine(settings.DATABASE_READ_URL, **_engine_options(settings.DATABASE_READ_URL))
+else:
+    read_engine = engine
+
+AsyncReadSessionLocal = async_sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False
+)
+
+class ReadYourWritesTracker:
+    """
+    Remembers which users wrote recently, so their reads stay on the primary
+    until the replica has had time to replay the write.
+
+    Markers are kept in this process (bounded to `max_size` users, oldest writers forgotten first)
+    and, once `redis_conn` is set by the application's lifespan, in Redis as keys expiring with the
+    window, so a read served by another worker than the write is pinned too. Without Redis
+    (tests, a single worker) the local markers alone apply.
+    """
+    def __init__(self, window_seconds: float, max_size: int = 100000, key_prefix: str = "read_your_writes:"):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self.key_prefix = key_prefix
+        self.redis_conn = None
+        self._last_write: "OrderedDict[str, float]" = OrderedDict()
+
+    async def mark_write(self, user_id: str):
+        """
+        Call after committing a user's write and before responding to them.
+        """
+        self._last_write.pop(user_id, None)
+        self._last_write[user_id] = time.monotonic()
+        while len(self._last_write) > self.max_size:
+            self._last_write.popitem(last=False)
+        if self.redis_conn is not None:
+            try:
+                await self.redis_conn.set(self.key_prefix + user_id, 1, px=max(1, int(self.window_seconds * 1000)))
+            except Exception as e:
+                logger.error(f"Failed to share read-your-writes marker of user {user_id}: {e}")
+
+    async def is_pinned(self, user_id: str) -> bool:
+        written_at = self._last_write.get(user_id)
+        if written_at is not None:
+            if time.monotonic() - written_at < self.window_seconds:
+                return True
+            del self._last_write[user_id]
+        if self.redis_conn is None:
+            return False
+        try:
+            return bool(await self.redis_conn.exists(self.key_prefix + user_id))
+        except Exception as e:
+            # Can't tell: the primary is always up to date
+            logger.error(f"Failed to check read-your-writes marker of user {user_id}: {e}")
+            return True
+
+read_your_writes = ReadYourWritesTracker(window_seconds=settings.READ_YOUR_WRITES_SECONDS)
+
+def get_pool_stats(target: AsyncEngine = engine) -> dict:
+    """
+    Live connection pool statistics, used to size the pool from real traffic.
+    """
+    pool = target.sync_engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+        })
+    if isinstance(pool, InstrumentedAsyncQueuePool):
+        stats["timeouts"] = pool.timeouts
+        stats["checkout_wait"] = pool.wait_histogram.snapshot()
+    return stats
+
 async def get_db() -> AsyncSession:
     """
     Dependency injection for database sessions.
-    
+
     Yields:
         AsyncSession: An asynchronous database session.
     """
@@ -39,3 +174,11 @@ async def get_db() -> AsyncSession:
             raise
         finally:
             await session.close()
+
+def get_session_factory() -> async_sessionmaker:
+    """
+    Dependency returning the session factory itself.
+    Used where the caller must bound the session lifetime explicitly (e.g. WebSockets),
+    instead of holding a `get_db` session for as long as the request is open.
+    """
+    return AsyncSessionLocal
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from src.core.config import get_settings
@@ -16,13 +17,41 @@ async def lifespan(app: FastAPI):
     Use this for connecting to DBs, Redis, etc.
     """
     from src.core.pubsub import pubsub_manager
+    from src.core.hashing import password_hasher
+    from src.database.partitions import maintain_partitions
+    from src.database.session import AsyncSessionLocal, engine, read_your_writes
+    from src.modules.messages.read_receipts import read_receipt_buffer
+    from src.modules.messages.compaction import tombstone_compactor
+    from src.modules.messages.idempotency import purge_idempotency_keys
+    from src.api.deps import get_storage_provider
     logger.info("Application starting up...")
     await pubsub_manager.connect()
+    # Shares read-your-writes markers between workers
+    read_your_writes.redis_conn = pubsub_manager.redis_conn
+    partition_task = asyncio.create_task(maintain_partitions(
+        engine, settings.MESSAGE_PARTITION_MONTHS_AHEAD, settings.MESSAGE_PARTITION_CHECK_INTERVAL_SECONDS
+    ))
+    receipts_task = asyncio.create_task(read_receipt_buffer.run(settings.READ_RECEIPT_FLUSH_INTERVAL_SECONDS))
+    tombstone_compactor.storage = await get_storage_provider()
+    compaction_task = asyncio.create_task(tombstone_compactor.run(settings.TOMBSTONE_COMPACTION_INTERVAL_SECONDS))
+    idempotency_task = asyncio.create_task(purge_idempotency_keys(
+        AsyncSessionLocal, settings.IDEMPOTENCY_KEY_TTL_SECONDS, settings.IDEMPOTENCY_KEY_PURGE_INTERVAL_SECONDS
+    ))
     
     yield
     
     logger.info("Application shutting down...")
+    partition_task.cancel()
+    receipts_task.cancel()
+    compaction_task.cancel()
+    idempotency_task.cancel()
+    try:
+        await read_receipt_buffer.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush read receipts on shutdown ({len(read_receipt_buffer)} lost): {e}")
+    read_your_writes.redis_conn = None
     await pubsub_manager.disconnect()
+    password_hasher.shutdown()
 
 def create_app() -> FastAPI:
     """
@@ -59,6 +88,9 @@ def create_app() -> FastAPI:
     from src.modules.realtime.router import router as realtime_router
     app.include_router(realtime_router, tags=["Realtime"])
     
+    from src.modules.admin.router import router as admin_router
+    app.include_router(admin_router, prefix=f"{settings.API_V1_STR}/admin", tags=["Admin"])
+    
     return app
 
 app = create_app()
@@ -7,10 +7,12 @@ from src.models.user import User
 from src.models.conversation import Conversation
 from src.models.participant import ConversationParticipant
 from src.models.message import Message
+from src.models.idempotency_key import MessageIdempotencyKey
 
 __all__ = [
     "User",
     "Conversation",
     "ConversationParticipant",
-    "Message"
+    "Message",
+    "MessageIdempotencyKey"
 ]
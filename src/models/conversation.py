@@ -1,6 +1,8 @@
-from sqlalchemy import Column, String, Boolean, ForeignKey
+from sqlalchemy import Column, String, Boolean, ForeignKey, BigInteger, DateTime, Index, desc
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from datetime import datetime, timezone
 import uuid
 from src.database.base_class import Base
 
@@ -15,11 +17,24 @@ class Conversation(Base):
     is_group = Column(Boolean, default=False)
     is_archived = Column(Boolean, default=False, nullable=False)
     
-    # Optional metadata or state
-    # last_message_at can be added later
+    # Sequence number of the latest message, bumped atomically on every insert
+    last_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
+    
+    # Time of the latest message (or creation), used to order the inbox.
+    # Set from the application clock so keyset cursors compare consistently on every backend.
+    last_activity_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        nullable=False
+    )
     
     creator_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     
+    # Direct chats only: the canonical key of the user pair (see direct_conversation_key), unique so
+    # there is at most one direct chat per pair. Cleared when the chat becomes a group.
+    direct_key = Column(String, nullable=True)
+    
     # Relationships
     creator = relationship("User", back_populates="created_conversations")
     participants = relationship(
@@ -33,3 +48,12 @@ class Conversation(Base):
         cascade="all, delete-orphan",
         order_by="desc(Message.created_at)"
     )
+
+def direct_conversation_key(user_a: uuid.UUID, user_b: uuid.UUID) -> str:
+    """The direct_key of the direct chat between two users: both ids, sorted."""
+    return ":".join(sorted((str(user_a), str(user_b))))
+
+# Finds the direct chat of a pair of users (and keeps it unique)
+Index('ix_conversations_direct_key', Conversation.direct_key, unique=True)
+# Supports the keyset-paginated inbox: ORDER BY last_activity_at DESC, id DESC
+Index('ix_conversations_last_activity_at_id', desc(Conversation.last_activity_at), desc(Conversation.id))
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, String, ForeignKey, DateTime, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from src.database.base_class import Base
+
+class MessageIdempotencyKey(Base):
+    """
+    A client-supplied idempotency key of a sent message, so a retried send returns the original message.
+    """
+    __tablename__ = "message_idempotency_keys"
+
+    # Keys are generated by clients, so they are only unique per sender
+    sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    idempotency_key = Column(String(128), primary_key=True)
+
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    # No foreign key (messages.id alone isn't unique on the partitioned table); (id, created_at) is its primary key
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    message_created_at = Column(DateTime(timezone=True), nullable=False)
+
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now(), nullable=False)
+
+# Expired keys are purged oldest first (see idempotency.py)
+Index('ix_message_idempotency_keys_created_at', MessageIdempotencyKey.created_at)
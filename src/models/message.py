@@ -1,7 +1,9 @@
-from sqlalchemy import Column, String, Boolean, ForeignKey, Index, desc
+from datetime import datetime, timezone
+from sqlalchemy import Column, String, Boolean, ForeignKey, Index, BigInteger, DateTime, DDL, and_, desc, event, false, or_
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-import uuid
+from sqlalchemy.sql import func
+from src.core.ids import uuid7
 from src.database.base_class import Base
 
 class Message(Base):
@@ -10,19 +12,75 @@ class Message(Base):
     """
     __tablename__ = "messages"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # On PostgreSQL the table is range-partitioned by created_at (monthly, see src/database/partitions.py),
+    # which must therefore be part of the primary key. Ids are UUIDv7 embedding the creation time,
+    # so a lookup by id alone can still be narrowed to one partition.
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    created_at = Column(DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc), server_default=func.now(), nullable=False)
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Monotonically increasing position within the conversation (1, 2, 3, ...)
+    seq = Column(BigInteger, nullable=False)
     
     content = Column(String, nullable=True) # Text content
     message_type = Column(String, default="text") # e.g., 'text', 'image', 'system'
     media_url = Column(String, nullable=True) # For attachments
     
-    is_deleted = Column(Boolean, default=False)
+    is_deleted = Column(Boolean, default=False, server_default=false(), nullable=False)
+    # When the message was soft deleted; the tombstone's content is dropped some time later (see compaction.py)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
     sender = relationship("User", back_populates="messages")
 
-# Explicit composite index for efficient cursor-based backward pagination
-Index('ix_messages_conversation_id_created_at_desc', Message.conversation_id, desc(Message.created_at))
+# Composite index serving keyset pagination over (created_at, id) in both directions.
+# Partial: pages never show deleted messages, so tombstones are kept out of the hottest index.
+_live = Message.is_deleted == False
+Index(
+    'ix_messages_conversation_id_created_at_desc',
+    Message.conversation_id, desc(Message.created_at), desc(Message.id),
+    postgresql_where=_live, sqlite_where=_live
+)
+# Not unique: a partitioned table can't enforce uniqueness without the partition key.
+# Sequence numbers are allocated under the conversation row lock instead (see allocate_seq).
+Index('ix_messages_conversation_id_seq', Message.conversation_id, Message.seq)
+# Tombstones still holding content, i.e. the compaction job's backlog (empties as it catches up)
+_uncompacted = and_(Message.is_deleted == True, or_(Message.content.is_not(None), Message.media_url.is_not(None)))
+Index('ix_messages_tombstones_deleted_at', Message.deleted_at, postgresql_where=_uncompacted, sqlite_where=_uncompacted)
+# Lets compaction check whether any other message still references an attachment
+_has_media = Message.media_url.is_not(None)
+Index('ix_messages_media_url', Message.media_url, postgresql_where=_has_media, sqlite_where=_has_media)
+
+# Full-text search over message content (see MessageRepository.search_messages).
+# PostgreSQL: a generated tsvector column with a GIN index (added by migration, so it's not mapped here).
+# SQLite: an external-content FTS5 table kept in sync by triggers.
+# Both tokenize without stemming, so results match across backends.
+SEARCH_CONFIG = "simple"
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_FTS_TABLE = "messages_fts"
+
+_search_ddl = {
+    "postgresql": [
+        f"ALTER TABLE messages ADD COLUMN {SEARCH_VECTOR_COLUMN} tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))) STORED",
+        f"CREATE INDEX ix_messages_search_vector ON messages USING gin ({SEARCH_VECTOR_COLUMN})",
+    ],
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_FTS_TABLE} USING fts5(content, content='messages', content_rowid='rowid')",
+        f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE} (rowid, content) VALUES (new.rowid, new.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE} ({SEARCH_FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE} ({SEARCH_FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO {SEARCH_FTS_TABLE} (rowid, content) VALUES (new.rowid, new.content);
+        END""",
+    ],
+}
+for _dialect, _statements in _search_ddl.items():
+    for _statement in _statements:
+        event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+event.listen(Message.__table__, "before_drop", DDL(f"DROP TABLE IF EXISTS {SEARCH_FTS_TABLE}").execute_if(dialect="sqlite"))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, Boolean
+from sqlalchemy import Column, String, ForeignKey, Boolean, BigInteger, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from src.database.base_class import Base
@@ -15,8 +15,22 @@ class ConversationParticipant(Base):
     
     role = Column(String, default="member") # e.g., 'admin', 'member'
     is_active = Column(Boolean, default=True, nullable=False) # False if user leaves
-    last_seen_message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    # No foreign key: messages.id alone isn't unique on the partitioned messages table
+    last_seen_message_id = Column(UUID(as_uuid=True), nullable=True)
+    # Read position as a message sequence number, so unread = conversation.last_seq - last_seen_seq - deleted_unread_count
+    last_seen_seq = Column(BigInteger, default=0, server_default="0", nullable=False)
+    # Deleted messages past the read position (kept in step by soft deletes and read updates)
+    deleted_unread_count = Column(Integer, default=0, server_default="0", nullable=False)
     
     # Relationships
     user = relationship("User", back_populates="participations")
     conversation = relationship("Conversation", back_populates="participants")
+
+# The composite PK leads with conversation_id; the inbox looks up a user's active chats:
+# WHERE user_id = ? AND is_active (conversation_id comes from the index, for the join)
+Index(
+    'ix_conversation_participants_inbox',
+    ConversationParticipant.user_id,
+    ConversationParticipant.is_active,
+    ConversationParticipant.conversation_id
+)
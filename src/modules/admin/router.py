@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, File, Query, UploadFile
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.api import deps
+from src.core.connection_manager import manager
+from src.core.membership_cache import membership_cache
+from src.core.principal_cache import principal_cache
+from src.core.pubsub import pubsub_manager
+from src.database.session import get_pool_stats, get_session_factory
+from src.modules.messages.idempotency import idempotency_cache
+from src.modules.imports.importer import HistoryImporter, iter_lines, READ_CHUNK_SIZE
+from src.schemas.imports import ImportReport
+from src.models.all_models import User
+
+router = APIRouter()
+
+@router.get("/db/pool")
+async def db_pool_stats(
+    current_user: User = Depends(deps.get_current_superuser)
+) -> dict:
+    """
+    Live statistics of the primary engine's connection pool (checked out, overflow, checkout wait histogram).
+    """
+    return get_pool_stats()
+
+@router.get("/caches")
+async def cache_stats(
+    current_user: User = Depends(deps.get_current_superuser)
+) -> dict:
+    """
+    Hit/miss/eviction counters of the in-process caches.
+    """
+    return {
+        "principals": principal_cache.stats(),
+        "memberships": membership_cache.stats(),
+        "idempotency_keys": idempotency_cache.stats(),
+    }
+
+@router.get("/realtime")
+async def realtime_stats(
+    current_user: User = Depends(deps.get_current_superuser)
+) -> dict:
+    """
+    WebSocket connections of this worker: outbound queue depths, dropped frames and evictions,
+    and the event shards it is subscribed to.
+    """
+    return {**manager.stats(), "event_routing": pubsub_manager.stats()}
+
+@router.post("/import", response_model=ImportReport)
+async def import_history(
+    file: UploadFile = File(..., description="NDJSON history file, optionally gzip-compressed (.gz)"),
+    batch_size: int = Query(5000, ge=1, le=50000),
+    current_user: User = Depends(deps.get_current_superuser),
+    session_factory: async_sessionmaker = Depends(get_session_factory)
+) -> ImportReport:
+    """
+    Bulk-imports conversations, participants and messages from an NDJSON upload.
+    Batches are committed as they go; `completed` is false if the import stopped early.
+    Very large migrations should use the command line importer instead (`python -m src.modules.imports.importer`).
+    """
+    async def chunks():
+        while chunk := await file.read(READ_CHUNK_SIZE):
+            yield chunk
+
+    importer = HistoryImporter(session_factory, batch_size=batch_size, invalidate_membership=pubsub_manager.invalidate_membership)
+    return await importer.run(iter_lines(chunks(), gzipped=(file.filename or "").endswith(".gz")))
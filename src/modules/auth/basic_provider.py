@@ -1,6 +1,7 @@
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -9,10 +10,15 @@ from jose import JWTError, jwt
 from src.core.interfaces import AuthProvider
 from src.core.config import get_settings
 from src.core import security
+from src.core.hashing import password_hasher
+from src.core.principal_cache import principal_cache
 from src.models.all_models import User
 
 settings = get_settings()
 
+# Built once: every authenticated request that misses the principal cache runs it
+USER_BY_ID_QUERY = select(User).where(User.id == bindparam("user_id"))
+
 class BasicAuthProvider(AuthProvider):
     """
     Standard username/password authentication using OAuth2 Password Bearer flow.
@@ -49,7 +55,7 @@ class BasicAuthProvider(AuthProvider):
         if not user:
             return None
         
-        if not self.verify_password(password, user.hashed_password):
+        if not await password_hasher.verify(password, user.hashed_password):
             return None
             
         return user
@@ -71,7 +77,12 @@ class BasicAuthProvider(AuthProvider):
     async def get_current_user(self, token: str) -> User:
         """
         Decodes JWT token and retrieves user from DB.
+        Verified principals are cached per token, so the hot path needs neither.
         """
+        cached_user = principal_cache.get(token)
+        if cached_user is not None:
+            return cached_user
+
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -85,29 +96,16 @@ class BasicAuthProvider(AuthProvider):
         except JWTError:
             raise credentials_exception
             
-        # For simplicity, we query by ID or email. 
-        # Ideally the token 'sub' should be the user ID (UUID).
-        # But if we stored email/username in sub, we query that.
-        # Let's assume 'sub' is user ID for robustness, or handle email.
-        
-        # Validating if it's a UUID or email
-        # For this implementation, let's assume we store user_id as 'sub' in token creation
-        
-        stmt = select(User).where(str(User.id) == username) # Casting might be tricky in SQL, better to just try fetching
-        # If 'sub' is not UUID formatted string, this might fail if we cast to UUID
-        # So commonly we store user_id (str) in token.
-        
-        # Let's fix this logic: we will store user_id as string in 'sub'
+        # 'sub' holds the user id
         try:
-            import uuid
             user_uuid = uuid.UUID(username)
-            stmt = select(User).where(User.id == user_uuid)
-            result = await self.db.execute(stmt)
-            user = result.scalars().first()
         except ValueError:
-            user = None
+            raise credentials_exception
+        result = await self.db.execute(USER_BY_ID_QUERY, {"user_id": user_uuid})
+        user = result.scalars().first()
             
         if user is None:
             raise credentials_exception
             
+        principal_cache.set(token, user, token_exp=payload.get("exp"))
         return user
@@ -0,0 +1,85 @@
+import uuid
+from typing import List, Optional, Sequence
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import get_settings
+from src.models.all_models import Conversation, ConversationParticipant, Message
+
+settings = get_settings()
+
+participants_table = ConversationParticipant.__table__
+conversations_table = Conversation.__table__
+messages_table = Message.__table__
+
+def _chunks(ids: Sequence[uuid.UUID], size: Optional[int]):
+    """The distinct ids, in chunks of `size`."""
+    size = size or settings.PARTICIPANT_BATCH_SIZE
+    ids = list(dict.fromkeys(ids))
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+async def bulk_add_participants(
+    db: AsyncSession,
+    conversation_id: uuid.UUID,
+    user_ids: Sequence[uuid.UUID],
+    chunk_size: Optional[int] = None
+) -> List[uuid.UUID]:
+    """
+    Adds users to a conversation, `chunk_size` (default PARTICIPANT_BATCH_SIZE) rows per INSERT ... ON CONFLICT. Users who had been
+    removed are reactivated; current members are left alone. Returns the users added or reactivated.
+    The existing membership is never loaded, so this costs the same in a 50-member and a 50k-member group.
+    Reactivated members come back with everything read: their old read position (and its deleted
+    message count) went stale while they were away.
+    """
+    p = participants_table
+    c = conversations_table
+    m = messages_table
+    last_seq = select(c.c.last_seq).where(c.c.id == conversation_id).scalar_subquery()
+    last_message_id = select(m.c.id).where(m.c.conversation_id == conversation_id, m.c.seq == last_seq).limit(1).scalar_subquery()
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = (
+        insert(p)
+        .on_conflict_do_update(
+            index_elements=[p.c.conversation_id, p.c.user_id],
+            set_={
+                "is_active": True,
+                "last_seen_seq": last_seq,
+                "last_seen_message_id": last_message_id,
+                "deleted_unread_count": 0
+            },
+            where=p.c.is_active == False
+        )
+        .returning(p.c.user_id)
+    )
+    added = []
+    for chunk in _chunks(user_ids, chunk_size):
+        rows = [{"conversation_id": conversation_id, "user_id": user_id, "role": "member", "is_active": True} for user_id in chunk]
+        result = await db.execute(stmt, rows)
+        added.extend(result.scalars())
+    return added
+
+async def bulk_remove_participants(
+    db: AsyncSession,
+    conversation_id: uuid.UUID,
+    user_ids: Sequence[uuid.UUID],
+    chunk_size: Optional[int] = None
+) -> List[uuid.UUID]:
+    """
+    Marks users as no longer active in a conversation (they keep their read position and can be
+    added back), `chunk_size` per UPDATE. Returns the users that were active members.
+    """
+    p = participants_table
+    removed = []
+    for chunk in _chunks(user_ids, chunk_size):
+        stmt = (
+            update(p)
+            .where(p.c.conversation_id == conversation_id, p.c.user_id.in_(chunk), p.c.is_active == True)
+            .values(is_active=False)
+            .returning(p.c.user_id)
+        )
+        result = await db.execute(stmt)
+        removed.extend(result.scalars())
+    return removed
@@ -1,24 +1,36 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional, Tuple
+from datetime import datetime
+import uuid
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy import Select, select, text, desc, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 
 from src.api import deps
-from src.schemas.conversation import ConversationCreate, ConversationResponse, ConversationDetail, ConversationAddParticipants
+from src.core.cursors import encode_cursor, decode_cursor
+from src.schemas.conversation import (
+    ConversationCreate, ConversationResponse, ConversationDetail, ConversationAddParticipants, ConversationRemoveParticipants
+)
 from src.models.all_models import Conversation, User, ConversationParticipant
+from src.models.conversation import direct_conversation_key
+from src.database.session import read_your_writes
+from src.core.pubsub import pubsub_manager
+from src.modules.messages.read_receipts import read_receipt_buffer
+from src.modules.conversations.participants import bulk_add_participants, bulk_remove_participants
 
 router = APIRouter()
 
 @router.post("/", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
 async def create_conversation(
     conversation_in: ConversationCreate,
+    response: Response,
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(deps.get_db)
 ) -> Conversation:
     """
     Create a new conversation.
-    For direct chats, checks if one already exists.
+    For direct chats, returns the existing chat with that user if there is one (200 instead of 201).
     """
     participant_ids = set(conversation_in.participant_ids)
     
@@ -33,11 +45,14 @@ async def create_conversation(
         if target_user_id == current_user.id:
              raise HTTPException(status_code=400, detail="Cannot create direct chat with yourself")
 
-        # Check existing direct conversation
-        # Logic: Find a conversation where both users are participants and is_group is False
-        # This query is complex in raw SQL or ORM without specific setup. 
-        # Simplified approach: Create new for now, or use a specific finder.
-        pass
+        user_id = current_user.id
+        conversation, created = await _get_or_create_direct_conversation(db, user_id, target_user_id, conversation_in.title)
+        if not created:
+            response.status_code = status.HTTP_200_OK
+            return conversation
+        await read_your_writes.mark_write(str(user_id))
+        await pubsub_manager.invalidate_membership(str(conversation.id))
+        return conversation
 
     # Create Conversation
     conversation = Conversation(
@@ -63,89 +78,140 @@ async def create_conversation(
         )
     
     db.add_all(participants)
+    await read_your_writes.mark_write(str(current_user.id))
+    conversation_id = str(conversation.id)
     await db.commit()
+    await pubsub_manager.invalidate_membership(conversation_id)
     await db.refresh(conversation)
     
     return conversation
 
-@router.get("/", response_model=List[ConversationResponse])
-async def list_conversations(
-    current_user: User = Depends(deps.get_current_user),
-    db: AsyncSession = Depends(deps.get_db),
-    skip: int = 0,
-    limit: int = 100
-) -> List[Conversation]:
+async def _get_or_create_direct_conversation(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    other_user_id: uuid.UUID,
+    title: Optional[str]
+) -> Tuple[Conversation, bool]:
+    """
+    Returns (the direct chat between the two users, whether it was just created).
+    Both the lookup and the insert go through the unique direct_key index: a concurrent request
+    for the same pair waits on it and then finds the chat instead of creating a second one.
+    """
+    key = direct_conversation_key(user_id, other_user_id)
+    existing = select(Conversation).where(Conversation.direct_key == key)
+    conversation = (await db.execute(existing)).scalars().first()
+    if conversation is not None:
+        return conversation, False
+
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    conversations_table = Conversation.__table__
+    stmt = (
+        insert(conversations_table)
+        .values(id=uuid.uuid4(), title=title, is_group=False, creator_id=user_id, direct_key=key)
+        .on_conflict_do_nothing(index_elements=["direct_key"])
+        .returning(conversations_table.c.id)
+    )
+    conversation_id = (await db.execute(stmt)).scalar()
+    if conversation_id is None:
+        # Created concurrently; its transaction has committed by the time the insert gave way
+        return (await db.execute(existing)).scalars().one(), False
+
+    db.add_all([
+        ConversationParticipant(conversation_id=conversation_id, user_id=user_id, role="admin"),
+        ConversationParticipant(conversation_id=conversation_id, user_id=other_user_id, role="member")
+    ])
+    await db.commit()
+    conversation = (await db.execute(select(Conversation).where(Conversation.id == conversation_id))).scalars().one()
+    return conversation, True
+
+def build_inbox_query(user_id: uuid.UUID, limit: int, position: Optional[Tuple[datetime, uuid.UUID]] = None) -> Select:
     """
-    List conversations the current user is a participant of.
+    Inbox page query: (conversation, unread count, last_seen_seq) rows after the keyset `position`.
+    The user's active chats come from ix_conversation_participants_inbox alone; conversations are
+    ordered and paged on their own activity index (ix_conversations_last_activity_at_id).
     """
-    # Join ConversationParticipant to filter by user_id
+    unread_count = (
+        Conversation.last_seq
+        - ConversationParticipant.last_seen_seq
+        - ConversationParticipant.deleted_unread_count
+    ).label("unread_count")
     stmt = (
-        select(Conversation)
-        .join(ConversationParticipant)
-        .options(selectinload(Conversation.participants))
+        select(Conversation, unread_count, ConversationParticipant.last_seen_seq)
+        .join(ConversationParticipant, ConversationParticipant.conversation_id == Conversation.id)
         .where(
-            ConversationParticipant.user_id == current_user.id,
+            ConversationParticipant.user_id == user_id,
             ConversationParticipant.is_active == True
         )
-        .order_by(desc(Conversation.updated_at))
-        .offset(skip)
+        .order_by(desc(Conversation.last_activity_at), desc(Conversation.id))
         .limit(limit)
     )
+    if position is not None:
+        stmt = stmt.where(tuple_(Conversation.last_activity_at, Conversation.id) < tuple_(*position))
+    return stmt
+
+@router.get("/", response_model=List[ConversationResponse])
+async def list_conversations(
+    response: Response,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_read_db),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    skip: int = Query(0, deprecated=True, description="Offset pagination; use `cursor` instead"),
+    limit: int = 100
+) -> List[ConversationResponse]:
+    """
+    List conversations the current user is a participant of, most recently active first.
+    Paginated by an opaque keyset cursor over (last_activity_at, id); the cursor for the
+    next page is returned in the `X-Next-Cursor` header (see build_inbox_query).
+    Unread counts come back with the listing itself: messages carry per-conversation sequence
+    numbers, so unread = last_seq - last_seen_seq - deleted_unread_count.
+    """
+    position = None
+    if cursor:
+        decoded = decode_cursor(cursor)
+        try:
+            position = (datetime.fromisoformat(decoded["t"]), uuid.UUID(decoded["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    stmt = build_inbox_query(current_user.id, limit, position)
+    if position is None and skip:
+        stmt = stmt.offset(skip)
     
     result = await db.execute(stmt)
-    conversations = result.scalars().all()
+    rows = result.all()
     
     response_list = []
-    from src.models.all_models import Message
-    from sqlalchemy import func
-    
-    # Bulk fetch the created_at timestamps for all last_seen_message_ids
-    last_seen_ids = []
-    for conv in conversations:
-        part = next((p for p in conv.participants if p.user_id == current_user.id), None)
-        if part and part.last_seen_message_id:
-            last_seen_ids.append(part.last_seen_message_id)
-            
-    last_seen_timestamps = {}
-    if last_seen_ids:
-        # Group chunks if too large, but usually a single IN clause is fine
-        ts_stmt = select(Message.id, Message.created_at).where(Message.id.in_(last_seen_ids))
-        ts_res = await db.execute(ts_stmt)
-        for msg_id, created_at in ts_res.all():
-            last_seen_timestamps[msg_id] = created_at
-            
-    for conv in conversations:
-        # We already have participants loaded via selectinload
-        part = next((p for p in conv.participants if p.user_id == current_user.id), None)
-        
-        unread_count = 0
-        if part:
-            if part.last_seen_message_id and part.last_seen_message_id in last_seen_timestamps:
-                last_time = last_seen_timestamps[part.last_seen_message_id]
-                c_stmt = select(func.count(Message.id)).where(
-                    Message.conversation_id == conv.id,
-                    Message.created_at > last_time,
-                    Message.is_deleted == False
-                )
-                c_res = await db.execute(c_stmt)
-                unread_count = c_res.scalar() or 0
-            else:
-                # Never seen any message, count all non-deleted
-                c_stmt = select(func.count(Message.id)).where(
-                    Message.conversation_id == conv.id,
-                    Message.is_deleted == False
-                )
-                c_res = await db.execute(c_stmt)
-                unread_count = c_res.scalar() or 0
-                
-        # Build the response model
+    user_id = str(current_user.id)
+    for conv, unread, last_seen_seq in rows:
+        # Read receipts not yet written behind still count (deleted messages past them may be
+        # counted as unread until the write lands)
+        pending_seq = read_receipt_buffer.pending_seq(user_id, str(conv.id))
+        if pending_seq is not None and pending_seq > last_seen_seq:
+            unread = conv.last_seq - pending_seq
         conv_resp = ConversationResponse.model_validate(conv)
-        conv_dict = conv_resp.model_dump()
-        conv_dict["unread_count"] = unread_count
-        response_list.append(ConversationResponse(**conv_dict))
+        response_list.append(conv_resp.model_copy(update={"unread_count": max(unread or 0, 0)}))
+
+    if rows and len(rows) == limit:
+        last = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor({"t": last.last_activity_at.isoformat(), "id": str(last.id)})
 
     return response_list
 
+async def _get_managed_conversation(db: AsyncSession, conversation_id: str, user_id: uuid.UUID) -> Conversation:
+    """
+    The conversation, if `user_id` may manage its membership (only its creator can, for now).
+    """
+    try:
+        conv_uuid = uuid.UUID(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    result = await db.execute(select(Conversation).where(Conversation.id == conv_uuid))
+    conversation = result.scalars().first()
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.creator_id != user_id:
+        raise HTTPException(status_code=403, detail="Only the creator can manage participants")
+    return conversation
+
 @router.post("/{conversation_id}/participants", status_code=status.HTTP_200_OK)
 async def add_participants(
     conversation_id: str,
@@ -154,52 +220,53 @@ async def add_participants(
     db: AsyncSession = Depends(deps.get_db)
 ):
     """
-    Add participants to an existing conversation.
-    Only strictly for group chats or converting direct to group?
-    For now, allow adding to any conversation.
+    Add participants to an existing conversation (a direct chat becomes a group).
+    Users who already are members are skipped; users who had been removed are added back.
+    Rows are inserted in chunks without loading the existing membership, so this scales to very large groups.
     """
-    # Verify conversation exists and user is a participant (or admin)
-    # Ideally only admins/creator should add.
-    import uuid
-    stmt = (
-        select(Conversation)
-        .options(selectinload(Conversation.participants))
-        .where(Conversation.id == uuid.UUID(conversation_id))
-    )
-    result = await db.execute(stmt)
-    conversation = result.scalars().first()
-    
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    user_id = current_user.id
+    conversation = await _get_managed_conversation(db, conversation_id, user_id)
 
-    # Check if current user is admin/creator of the conversation
-    # We need to check ConversationParticipant role for current_user
-    # Simplified: Check if current_user.id == conversation.creator_id
-    if conversation.creator_id != current_user.id:
-         raise HTTPException(status_code=403, detail="Only the creator can add participants")
-         
-    # Check if direct chat -> maybe prevent adding? 
-    # Or upgrade to group?
-    # For simplicity, if not is_group, we mark it as group now?
-    if not conversation.is_group:
-        conversation.is_group = True
-        db.add(conversation)
+    try:
+        added = await bulk_add_participants(db, conversation.id, participants_in.participant_ids)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # Add new participants
-    existing_ids = {p.user_id for p in conversation.participants}
-    new_participants = []
-    
-    # Iterate over UUIDs directly from Pydantic model
-    for pid in participants_in.participant_ids:
-        if pid in existing_ids:
-            continue
-            
-        new_participants.append(
-            ConversationParticipant(conversation_id=conversation.id, user_id=pid, role="member")
-        )
-    
-    if new_participants:
-        db.add_all(new_participants)
+    if added:
+        if not conversation.is_group:
+            conversation.is_group = True
+            # No longer the pair's direct chat; a new one can be opened
+            conversation.direct_key = None
+        await read_your_writes.mark_write(str(user_id))
         await db.commit()
+        await pubsub_manager.invalidate_membership(conversation_id)
         
-    return {"message": "Participants added successfully"}
+    return {"message": "Participants added successfully", "added": len(added)}
+
+@router.post("/{conversation_id}/participants/remove", status_code=status.HTTP_200_OK)
+async def remove_participants(
+    conversation_id: str,
+    participants_in: ConversationRemoveParticipants,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_db)
+):
+    """
+    Remove participants from a group conversation, in bulk. Removed users can no longer send to it
+    and it leaves their inbox; adding them again restores them.
+    Direct chats are refused: they stay the pair's chat (found again through direct_key).
+    """
+    user_id = current_user.id
+    conversation = await _get_managed_conversation(db, conversation_id, user_id)
+    if not conversation.is_group:
+        raise HTTPException(status_code=400, detail="Participants cannot be removed from a direct chat")
+    if conversation.creator_id in participants_in.participant_ids:
+        raise HTTPException(status_code=400, detail="The creator cannot be removed")
+
+    removed = await bulk_remove_participants(db, conversation.id, participants_in.participant_ids)
+    if removed:
+        await read_your_writes.mark_write(str(user_id))
+        await db.commit()
+        await pubsub_manager.invalidate_membership(conversation_id)
+
+    return {"message": "Participants removed successfully", "removed": len(removed)}
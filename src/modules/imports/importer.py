@@ -0,0 +1,359 @@
+"""
+Bulk import of chat history from NDJSON.
+
+Each line is one record, discriminated by `kind` (see `src.schemas.imports`):
+
+    {"kind": "conversation", "id": "...", "title": "...", "is_group": true, "creator_id": "..."}
+    {"kind": "participant", "conversation_id": "...", "user_id": "...", "role": "admin"}
+    {"kind": "message", "conversation_id": "...", "sender_id": "...", "content": "...", "created_at": "..."}
+
+Users must already exist. Records are validated and loaded in batches, one transaction per batch:
+on PostgreSQL messages are streamed with COPY and participants are COPYed into a staging table
+and merged with ON CONFLICT DO NOTHING; other backends (SQLite) use batched executemany.
+
+Command line usage (reads `.gz` files transparently):
+
+    python -m src.modules.imports.importer history.ndjson.gz --batch-size 10000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select, text, update, bindparam, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.core.ids import UUID7_MAX_SKEW, uuid7, uuid7_time
+from src.database.partitions import ensure_partitions
+from src.models.all_models import Conversation, ConversationParticipant, Message, User
+from src.schemas.imports import ImportConversation, ImportParticipant, ImportMessage, ImportRecord, ImportReport
+
+logger = logging.getLogger("chat_api")
+
+# Only the first few rejected lines are kept in the report, so memory stays bounded
+MAX_REPORTED_ERRORS = 20
+READ_CHUNK_SIZE = 1024 * 1024
+
+MESSAGE_COLUMNS = ["id", "conversation_id", "sender_id", "seq", "content", "message_type", "media_url", "is_deleted", "created_at", "deleted_at"]
+PARTICIPANT_COLUMNS = ["conversation_id", "user_id", "role", "is_active", "last_seen_seq", "created_at"]
+
+_record_adapter = TypeAdapter(ImportRecord)
+
+def _utc(value: Optional[datetime]) -> datetime:
+    # Naive timestamps are taken as UTC; everything is stored normalized to UTC
+    if value is None:
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+async def iter_lines(chunks: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[bytes]:
+    """
+    Splits a stream of (optionally gzip-compressed) byte chunks into lines, holding at most one partial line.
+    """
+    decompressor = zlib.decompressobj(wbits=31) if gzipped else None
+    pending = b""
+    async for chunk in chunks:
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if decompressor is not None:
+        pending += decompressor.flush()
+    for line in pending.split(b"\n"):
+        yield line
+
+class HistoryImporter:
+    """
+    Streams NDJSON history records into the database in fixed-size batches.
+    Memory use is bounded by `batch_size`, independently of the size of the input.
+    """
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = 5000,
+        progress: Optional[Callable[[ImportReport], None]] = None,
+        invalidate_membership: Optional[Callable[[str], Awaitable[None]]] = None
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.progress = progress
+        self.invalidate_membership = invalidate_membership
+        self.report = ImportReport()
+        self._started = 0.0
+
+    async def run(self, lines: AsyncIterator[Union[bytes, str]]) -> ImportReport:
+        self._started = time.perf_counter()
+        batch: List[Tuple[int, object]] = []
+        try:
+            async for line in lines:
+                self.report.lines += 1
+                if not line.strip():
+                    continue
+                try:
+                    record = _record_adapter.validate_json(line)
+                except ValidationError as e:
+                    error = e.errors()[0]
+                    self._reject(self.report.lines, f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}")
+                    continue
+
+                batch.append((self.report.lines, record))
+                if len(batch) >= self.batch_size:
+                    await self._load_batch(batch)
+                    batch = []
+
+            if batch:
+                await self._load_batch(batch)
+            self.report.completed = True
+        except SQLAlchemyError as e:
+            # Batches committed so far stay imported; the report says where it stopped
+            logger.error(f"History import failed at line {self.report.lines}: {e}")
+            self.report.errors.append(f"line {self.report.lines}: batch failed: {e.__class__.__name__}: {e}".splitlines()[0])
+
+        self._update_timing()
+        return self.report
+
+    def _reject(self, line_no: int, reason: str):
+        self.report.rejected += 1
+        if len(self.report.errors) < MAX_REPORTED_ERRORS:
+            self.report.errors.append(f"line {line_no}: {reason}")
+
+    def _update_timing(self):
+        self.report.elapsed_seconds = round(time.perf_counter() - self._started, 3)
+        loaded = self.report.conversations + self.report.participants + self.report.messages
+        if self.report.elapsed_seconds > 0:
+            self.report.rows_per_second = round(loaded / self.report.elapsed_seconds, 1)
+
+    async def _load_batch(self, batch: List[Tuple[int, object]]):
+        conversations = [(n, r) for n, r in batch if isinstance(r, ImportConversation)]
+        participants = [(n, r) for n, r in batch if isinstance(r, ImportParticipant)]
+        messages = [(n, r) for n, r in batch if isinstance(r, ImportMessage)]
+
+        async with self.session_factory() as db:
+            is_postgres = db.get_bind().dialect.name == "postgresql"
+            if is_postgres:
+                # Staging table for the participant merge. Executing it first also opens the
+                # transaction that the raw connection's COPY below then runs in.
+                await db.execute(text(
+                    "CREATE TEMP TABLE IF NOT EXISTS import_participants "
+                    "(LIKE conversation_participants INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                ))
+
+            # 1. Referenced users must exist (one query per batch)
+            user_ids = {r.creator_id for _, r in conversations if r.creator_id}
+            user_ids |= {r.user_id for _, r in participants} | {r.sender_id for _, r in messages}
+            known_users = await self._existing_users(db, user_ids)
+
+            conversation_rows = []
+            for n, r in conversations:
+                if r.creator_id and r.creator_id not in known_users:
+                    self._reject(n, f"unknown creator_id {r.creator_id}")
+                    continue
+                created_at = _utc(r.created_at)
+                conversation_rows.append({
+                    "id": r.id, "title": r.title, "is_group": r.is_group, "is_archived": r.is_archived,
+                    "creator_id": r.creator_id, "created_at": created_at, "last_activity_at": created_at
+                })
+            if conversation_rows:
+                insert = postgresql.insert if is_postgres else sqlite.insert
+                table = Conversation.__table__
+                stmt = insert(table).on_conflict_do_nothing(index_elements=["id"]).returning(table.c.id)
+                result = await db.execute(stmt, conversation_rows)
+                self.report.conversations += len(result.all())
+
+            # 2. Referenced conversations must exist; locking them keeps sequence numbers consistent with live sends
+            conversation_ids = {r.conversation_id for _, r in participants} | {r.conversation_id for _, r in messages}
+            last_seqs = await self._lock_conversations(db, conversation_ids)
+
+            participant_rows = []
+            for n, r in participants:
+                if r.conversation_id not in last_seqs:
+                    self._reject(n, f"unknown conversation_id {r.conversation_id}")
+                elif r.user_id not in known_users:
+                    self._reject(n, f"unknown user_id {r.user_id}")
+                else:
+                    participant_rows.append((r.conversation_id, r.user_id, r.role, r.is_active, r.last_seen_seq, _utc(r.created_at)))
+
+            message_rows = []
+            bumps: Dict[uuid.UUID, List] = {}
+            for n, r in messages:
+                if r.conversation_id not in last_seqs:
+                    self._reject(n, f"unknown conversation_id {r.conversation_id}")
+                    continue
+                if r.sender_id not in known_users:
+                    self._reject(n, f"unknown sender_id {r.sender_id}")
+                    continue
+                created_at = _utc(r.created_at)
+                # Message lookups by id trust a UUIDv7's embedded time to pick the partition
+                id_time = uuid7_time(r.id) if r.id else None
+                if id_time is not None and abs(id_time - created_at) > UUID7_MAX_SKEW:
+                    self._reject(n, f"id {r.id} doesn't match created_at")
+                    continue
+                # Sequence numbers stay gap-free and unique: an explicit one must be the next one
+                seq = last_seqs[r.conversation_id] + 1
+                if r.seq is not None and r.seq != seq:
+                    self._reject(n, f"seq {r.seq} isn't the next sequence number ({seq})")
+                    continue
+                last_seqs[r.conversation_id] = seq
+                message_rows.append((
+                    r.id or uuid7(created_at), r.conversation_id, r.sender_id, seq,
+                    r.content, r.message_type, r.media_url, r.is_deleted, created_at,
+                    # Without a deletion time in the history, its creation time is the best bound
+                    (_utc(r.deleted_at) if r.deleted_at else created_at) if r.is_deleted else None
+                ))
+                bump = bumps.setdefault(r.conversation_id, [seq, created_at])
+                bump[0] = max(bump[0], seq)
+                bump[1] = max(bump[1], created_at)
+
+            # 3. Load (old history lands in the legacy partition, future-dated rows may need new ones)
+            if is_postgres:
+                if message_rows:
+                    created = [row[MESSAGE_COLUMNS.index("created_at")] for row in message_rows]
+                    await ensure_partitions(await db.connection(), min(created), max(created))
+                await self._copy_rows(db, participant_rows, message_rows)
+            else:
+                await self._insert_rows(db, participant_rows, message_rows)
+            self.report.messages += len(message_rows)
+
+            # 4. Move the conversations' sequence / activity markers past the imported messages
+            if bumps:
+                greatest = func.greatest if is_postgres else func.max
+                table = Conversation.__table__
+                stmt = (
+                    update(table)
+                    .where(table.c.id == bindparam("b_id"))
+                    .values(
+                        last_seq=greatest(table.c.last_seq, bindparam("b_seq")),
+                        last_activity_at=greatest(table.c.last_activity_at, bindparam("b_at"))
+                    )
+                )
+                await db.execute(stmt, [{"b_id": cid, "b_seq": seq, "b_at": at} for cid, (seq, at) in bumps.items()])
+
+            # 5. Unread counts subtract the deleted messages past each read position: recount them
+            # where deleted messages or participants (with their read positions) were imported
+            is_deleted = MESSAGE_COLUMNS.index("is_deleted")
+            recount = {row[1] for row in message_rows if row[is_deleted]} | {row[0] for row in participant_rows}
+            if recount:
+                await self._recount_deleted_unread(db, recount)
+
+            await db.commit()
+
+        if self.invalidate_membership is not None:
+            for conversation_id in {row[0] for row in participant_rows}:
+                await self.invalidate_membership(str(conversation_id))
+
+        self._update_timing()
+        logger.info(
+            f"Imported {self.report.lines} lines: {self.report.conversations} conversations, "
+            f"{self.report.participants} participants, {self.report.messages} messages, "
+            f"{self.report.rejected} rejected ({self.report.rows_per_second} rows/s)"
+        )
+        if self.progress is not None:
+            self.progress(self.report)
+
+    async def _existing_users(self, db: AsyncSession, user_ids: Set[uuid.UUID]) -> Set[uuid.UUID]:
+        if not user_ids:
+            return set()
+        result = await db.execute(select(User.id).where(User.id.in_(list(user_ids))))
+        return set(result.scalars().all())
+
+    async def _lock_conversations(self, db: AsyncSession, conversation_ids: Set[uuid.UUID]) -> Dict[uuid.UUID, int]:
+        if not conversation_ids:
+            return {}
+        stmt = (
+            select(Conversation.id, Conversation.last_seq)
+            .where(Conversation.id.in_(list(conversation_ids)))
+            .order_by(Conversation.id)
+            .with_for_update()
+        )
+        result = await db.execute(stmt)
+        return {cid: last_seq for cid, last_seq in result.all()}
+
+    async def _recount_deleted_unread(self, db: AsyncSession, conversation_ids: Set[uuid.UUID]):
+        p = ConversationParticipant.__table__
+        m = Message.__table__
+        deleted_unread = (
+            select(func.count())
+            .where(
+                m.c.conversation_id == p.c.conversation_id,
+                m.c.seq > p.c.last_seen_seq,
+                m.c.is_deleted == True
+            )
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(p)
+            .where(p.c.conversation_id.in_(list(conversation_ids)))
+            .values(deleted_unread_count=deleted_unread)
+        )
+
+    async def _copy(self, db: AsyncSession, table: str, rows: List[tuple], columns: List[str]):
+        """
+        COPYs rows over the raw asyncpg connection. Its errors (a duplicate message id, a violated
+        constraint) are re-raised as DBAPIError, like those of statements run through SQLAlchemy.
+        """
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        try:
+            await raw.driver_connection.copy_records_to_table(table, records=rows, columns=columns)
+        except Exception as e:
+            raise DBAPIError(f"COPY {table}", None, e) from e
+
+    async def _copy_rows(self, db: AsyncSession, participant_rows: List[tuple], message_rows: List[tuple]):
+        if participant_rows:
+            await self._copy(db, "import_participants", participant_rows, PARTICIPANT_COLUMNS)
+            columns = ", ".join(PARTICIPANT_COLUMNS)
+            result = await db.execute(text(
+                f"INSERT INTO conversation_participants ({columns}) "
+                f"SELECT {columns} FROM import_participants ON CONFLICT DO NOTHING"
+            ))
+            self.report.participants += max(result.rowcount, 0)
+
+        if message_rows:
+            await self._copy(db, "messages", message_rows, MESSAGE_COLUMNS)
+
+    async def _insert_rows(self, db: AsyncSession, participant_rows: List[tuple], message_rows: List[tuple]):
+        if participant_rows:
+            stmt = sqlite.insert(ConversationParticipant.__table__).on_conflict_do_nothing()
+            result = await db.execute(stmt, [dict(zip(PARTICIPANT_COLUMNS, row)) for row in participant_rows])
+            self.report.participants += max(result.rowcount, 0)
+
+        if message_rows:
+            await db.execute(Message.__table__.insert(), [dict(zip(MESSAGE_COLUMNS, row)) for row in message_rows])
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+async def main():
+    from src.database.session import AsyncSessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Import chat history from an NDJSON file (optionally .gz).")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    # Other API instances pick up imported memberships once their cache entries expire
+    importer = HistoryImporter(AsyncSessionLocal, batch_size=args.batch_size)
+    report = await importer.run(iter_lines(_file_chunks(args.path), gzipped=args.path.endswith(".gz")))
+    await engine.dispose()
+    print(json.dumps(report.model_dump(), indent=2))
+    raise SystemExit(0 if report.completed else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,15 @@
 import os
+import re
 import aiofiles
 import uuid
 from typing import BinaryIO
 from src.core.storage_interfaces import StorageProvider
 
+# Extensions kept from the uploaded filename (others are dropped)
+EXTENSION_PATTERN = re.compile(r"\.[A-Za-z0-9]{1,16}")
+# The keys upload() returns: a uuid4 and the extension
+ISSUED_KEY_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}(\.[A-Za-z0-9]{1,16})?")
+
 class LocalFileStorage(StorageProvider):
     """
     Stores uploaded files in a local directory.
@@ -21,6 +27,8 @@ class LocalFileStorage(StorageProvider):
         """
         # Generate a unique filename to prevent collisions
         ext = os.path.splitext(filename)[1]
+        if not EXTENSION_PATTERN.fullmatch(ext):
+            ext = ""
         unique_name = f"{uuid.uuid4()}{ext}"
         file_path = os.path.join(self.base_path, unique_name)
         
@@ -39,7 +47,7 @@ class LocalFileStorage(StorageProvider):
         rather than reading bytes into memory.
         Protocol typings might need adjustment if we return path vs bytes.
         """
-        file_path = os.path.join(self.base_path, key)
+        file_path = self._path(key)
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File {key} not found")
         return file_path
@@ -48,8 +56,21 @@ class LocalFileStorage(StorageProvider):
         """
         Deletes the file from disk.
         """
-        file_path = os.path.join(self.base_path, key)
+        file_path = self._path(key)
         if os.path.exists(file_path):
             os.remove(file_path)
             return True
         return False
+
+    def is_issued_key(self, key: str) -> bool:
+        return ISSUED_KEY_PATTERN.fullmatch(key) is not None
+
+    def _path(self, key: str) -> str:
+        """
+        The file of a key. Raises ValueError for keys resolving outside base_path ("../.env", "/etc/passwd").
+        """
+        base = os.path.realpath(self.base_path)
+        file_path = os.path.realpath(os.path.join(base, key))
+        if os.path.dirname(file_path) != base:
+            raise ValueError(f"Invalid storage key: {key!r}")
+        return file_path
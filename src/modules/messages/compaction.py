@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.core.config import get_settings
+from src.core.storage_interfaces import StorageProvider
+from src.database.session import AsyncSessionLocal
+from src.models.all_models import Message
+
+settings = get_settings()
+logger = logging.getLogger("chat_api")
+
+messages_table = Message.__table__
+
+class TombstoneCompactor:
+    """
+    Background compaction of soft-deleted messages.
+
+    A deleted message keeps its row (sequence numbers, unread counters and read positions refer to it)
+    but, once it has been deleted for longer than the grace period, not its content: content and
+    media_url are cleared (which also empties its search entry) and attachments no other message
+    references are removed from storage.
+
+    Work is done in small batches, each in its own short transaction. Rows are claimed with
+    FOR UPDATE SKIP LOCKED, so concurrent compactors (one per instance) split the work instead of
+    queueing behind each other, and nothing holds locks for long.
+    """
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        storage: Optional[StorageProvider] = None,
+        grace_seconds: float = 7 * 24 * 3600,
+        batch_size: int = 500,
+        pause_seconds: float = 0.1
+    ):
+        self.session_factory = session_factory
+        self.storage = storage
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+
+    async def compact_batch(self) -> int:
+        """
+        Compacts up to `batch_size` of the oldest eligible tombstones. Returns how many were compacted.
+        """
+        m = messages_table
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace_seconds)
+        async with self.session_factory() as db:
+            # Same predicate as ix_messages_tombstones_deleted_at, so the backlog is read from that index
+            claim = (
+                select(m.c.id, m.c.created_at, m.c.media_url)
+                .where(
+                    m.c.is_deleted == True,
+                    or_(m.c.content.is_not(None), m.c.media_url.is_not(None)),
+                    m.c.deleted_at < cutoff
+                )
+                .order_by(m.c.deleted_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = (await db.execute(claim)).all()
+            if not rows:
+                return 0
+
+            await db.execute(
+                update(m)
+                .where(tuple_(m.c.id, m.c.created_at).in_([(row.id, row.created_at) for row in rows]))
+                .values(content=None, media_url=None)
+            )
+
+            # Attachments still referenced by another message (e.g. a forwarded copy) are kept, and
+            # only keys our storage issued are ours to delete: media_url is whatever the client sent
+            media_keys = set()
+            if self.storage is not None:
+                media_keys = {row.media_url for row in rows if row.media_url and self.storage.is_issued_key(row.media_url)}
+            orphaned = set()
+            if media_keys:
+                referenced = await db.execute(select(m.c.media_url).where(m.c.media_url.in_(media_keys)).distinct())
+                orphaned = media_keys - set(referenced.scalars())
+            await db.commit()
+
+        # Only once the rows are committed, so a rollback never leaves messages pointing at deleted files
+        for key in orphaned:
+            try:
+                await self.storage.delete(key)
+            except Exception as e:
+                logger.error(f"Failed to delete media {key} of a compacted message: {e}")
+        return len(rows)
+
+    async def compact(self, max_batches: Optional[int] = None) -> int:
+        """
+        Compacts batches until the backlog is empty (or `max_batches` ran). Returns how many messages were compacted.
+        """
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            compacted = await self.compact_batch()
+            total += compacted
+            batches += 1
+            if compacted < self.batch_size:
+                break
+            # Leave room for foreground queries between batches
+            await asyncio.sleep(self.pause_seconds)
+        return total
+
+    async def run(self, interval_seconds: float):
+        """
+        Background task compacting the tombstone backlog every `interval_seconds`.
+        """
+        while True:
+            try:
+                compacted = await self.compact()
+                if compacted:
+                    logger.info(f"Compacted {compacted} deleted messages")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Tombstone compaction failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+# Global instance (attachment cleanup is wired in by the application's lifespan)
+tombstone_compactor = TombstoneCompactor(
+    AsyncSessionLocal,
+    grace_seconds=settings.TOMBSTONE_GRACE_SECONDS,
+    batch_size=settings.TOMBSTONE_COMPACTION_BATCH_SIZE
+)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.core.config import get_settings
+from src.models.all_models import MessageIdempotencyKey
+from src.schemas.message import MessageResponse
+
+settings = get_settings()
+logger = logging.getLogger("chat_api")
+
+keys_table = MessageIdempotencyKey.__table__
+
+class IdempotencyCache:
+    """
+    Bounded LRU of recently used idempotency keys -> the message they created, so a retried send
+    is answered in O(1) from memory. The `message_idempotency_keys` table stays the source of truth
+    (retries landing on another instance, or after an eviction, are resolved through it).
+    Entries expire together with the key they mirror.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # (sender_id, key) -> (expires_at, message)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, MessageResponse]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sender_id: str, key: str) -> Optional[MessageResponse]:
+        entry = self._entries.get((sender_id, key))
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[(sender_id, key)]
+            self.misses += 1
+            return None
+        self._entries.move_to_end((sender_id, key))
+        self.hits += 1
+        return entry[1]
+
+    def set(self, sender_id: str, key: str, message: MessageResponse, age_seconds: float = 0):
+        """
+        Remembers the message created under a key that was first used `age_seconds` ago.
+        """
+        remaining = self.ttl_seconds - age_seconds
+        if remaining <= 0:
+            return
+        self._entries[(sender_id, key)] = (time.monotonic() + remaining, message)
+        self._entries.move_to_end((sender_id, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+async def purge_expired_keys(session: AsyncSession, ttl_seconds: float, batch_size: int = 1000) -> int:
+    """
+    Deletes idempotency keys older than `ttl_seconds`, in batches. Returns how many were deleted.
+    """
+    k = keys_table
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    total = 0
+    while True:
+        expired = (
+            select(k.c.sender_id, k.c.idempotency_key)
+            .where(k.c.created_at < cutoff)
+            .order_by(k.c.created_at)
+            .limit(batch_size)
+        )
+        result = await session.execute(
+            delete(k).where(tuple_(k.c.sender_id, k.c.idempotency_key).in_(expired))
+        )
+        await session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+async def purge_idempotency_keys(session_factory: async_sessionmaker[AsyncSession], ttl_seconds: float, interval_seconds: float):
+    """
+    Background task purging expired idempotency keys every `interval_seconds`.
+    """
+    while True:
+        try:
+            async with session_factory() as session:
+                purged = await purge_expired_keys(session, ttl_seconds)
+            if purged:
+                logger.info(f"Purged {purged} expired idempotency keys")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Idempotency key purge failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+# Global instance
+idempotency_cache = IdempotencyCache(
+    max_entries=settings.IDEMPOTENCY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS
+)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.sql import func
+
+from src.core.config import get_settings
+from src.database.session import AsyncSessionLocal
+from src.models.all_models import ConversationParticipant, Message
+
+settings = get_settings()
+logger = logging.getLogger("chat_api")
+
+participants_table = ConversationParticipant.__table__
+messages_table = Message.__table__
+
+class ReadReceiptBuffer:
+    """
+    Write-behind buffer for read receipts.
+
+    Clients report their read position on nearly every message they display, so instead of one
+    UPDATE + commit per receipt, positions are coalesced in memory (only the newest per
+    (user, conversation) is kept, moves backwards are ignored) and written out periodically in
+    batched UPDATEs. The UPDATE itself only ever moves a position forward, so receipts buffered
+    on different instances can land in any order.
+
+    Pending positions are lost if the process dies before a flush; `lifespan` flushes on shutdown.
+    """
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        batch_size: int = 1000,
+        max_pending: int = 100000
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # (user_id, conversation_id) -> (seq, message_id)
+        self._pending: Dict[Tuple[str, str], Tuple[int, uuid.UUID]] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, conversation_id: str, user_id: str, message_id: uuid.UUID, seq: int) -> bool:
+        """
+        Buffers a read position. Returns False when the buffer is full and the receipt
+        has to be written directly instead.
+        """
+        key = (user_id, conversation_id)
+        current = self._pending.get(key)
+        if current is not None:
+            if seq > current[0]:
+                self._pending[key] = (seq, message_id)
+            return True
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+            return False
+        self._pending[key] = (seq, message_id)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def pending_seq(self, user_id: str, conversation_id: str) -> Optional[int]:
+        """
+        The buffered (not yet written) read position of a user in a conversation, if any.
+        """
+        entry = self._pending.get((user_id, conversation_id))
+        return entry[0] if entry is not None else None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """
+        Writes every buffered position, `batch_size` per statement. Returns how many were written.
+        On failure the unwritten positions go back into the buffer (unless superseded) and the error is raised.
+        """
+        async with self._flush_lock:
+            written = 0
+            while self._pending:
+                keys = list(self._pending)[:self.batch_size]
+                batch = [(key, self._pending.pop(key)) for key in keys]
+                try:
+                    await self._write(batch)
+                except BaseException:
+                    for key, entry in batch:
+                        current = self._pending.get(key)
+                        if current is None or current[0] < entry[0]:
+                            self._pending[key] = entry
+                    raise
+                # Readers aren't pinned to the primary for these: nobody waits on a flush, and the
+                # inbox overlays buffered positions from memory anyway
+                written += len(batch)
+            return written
+
+    async def _write(self, batch: List[Tuple[Tuple[str, str], Tuple[int, uuid.UUID]]]):
+        p = participants_table
+        m = messages_table
+        # Recomputed at write time, so soft deletes that happened while the receipt was buffered are counted
+        deleted_after = (
+            select(func.count())
+            .where(
+                m.c.conversation_id == p.c.conversation_id,
+                m.c.seq > bindparam("b_seq"),
+                m.c.is_deleted == True
+            )
+            .scalar_subquery()
+        )
+        stmt = (
+            update(p)
+            .where(
+                p.c.conversation_id == bindparam("b_conversation_id"),
+                p.c.user_id == bindparam("b_user_id"),
+                p.c.last_seen_seq < bindparam("b_seq")
+            )
+            .values(
+                last_seen_message_id=bindparam("b_message_id"),
+                last_seen_seq=bindparam("b_seq"),
+                deleted_unread_count=deleted_after
+            )
+        )
+        rows = [
+            {
+                "b_conversation_id": uuid.UUID(conversation_id),
+                "b_user_id": uuid.UUID(user_id),
+                "b_seq": seq,
+                "b_message_id": message_id
+            }
+            for (user_id, conversation_id), (seq, message_id) in batch
+        ]
+        async with self.session_factory() as db:
+            await db.execute(stmt, rows)
+            await db.commit()
+
+    async def run(self, interval_seconds: float):
+        """
+        Background task flushing the buffer every `interval_seconds`, or sooner once a batch is full.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                written = await self.flush()
+                if written:
+                    logger.debug(f"Flushed {written} read receipts")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush read receipts ({len(self)} pending): {e}")
+
+# Global instance
+read_receipt_buffer = ReadReceiptBuffer(
+    AsyncSessionLocal,
+    batch_size=settings.READ_RECEIPT_FLUSH_BATCH_SIZE,
+    max_pending=settings.READ_RECEIPT_MAX_PENDING
+)
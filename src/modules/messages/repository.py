@@ -1,84 +1,536 @@
-from typing import List, Optional
-from datetime import datetime
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from sqlalchemy.sql import func
-from src.models.all_models import Message, Conversation, ConversationParticipant
+from sqlalchemy import Integer, select, update, insert, literal, literal_column, bindparam, and_, desc, tuple_, table, column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.sql import Insert, Select, func
+from src.models.all_models import Message, Conversation, ConversationParticipant, MessageIdempotencyKey
+from src.models.message import SEARCH_CONFIG, SEARCH_FTS_TABLE, SEARCH_VECTOR_COLUMN
+from src.core.ids import UUID7_MAX_SKEW, uuid7, uuid7_time
+from src.core.membership_cache import membership_cache
+from src.database.session import engine, read_engine
+
+messages_table = Message.__table__
+conversations_table = Conversation.__table__
+participants_table = ConversationParticipant.__table__
+idempotency_keys_table = MessageIdempotencyKey.__table__
+
+# Columns handed back by the fused send path (enough to build a MessageResponse)
+MESSAGE_RETURNING = (
+    messages_table.c.id,
+    messages_table.c.conversation_id,
+    messages_table.c.sender_id,
+    messages_table.c.seq,
+    messages_table.c.content,
+    messages_table.c.message_type,
+    messages_table.c.media_url,
+    messages_table.c.is_deleted,
+    messages_table.c.created_at,
+)
+
+# Hot queries are built once, with bind parameters, instead of on every call. SQLAlchemy
+# memoizes a statement's cache key, so executing one of these goes straight to the compiled
+# cache; rebuilding the select() each time costs its construction plus a fresh cache key.
+PARTICIPANT_QUERY = select(ConversationParticipant).where(
+    ConversationParticipant.conversation_id == bindparam("conversation_id"),
+    ConversationParticipant.user_id == bindparam("user_id")
+)
+
+MEMBERS_QUERY = select(ConversationParticipant.user_id, ConversationParticipant.is_active).where(
+    ConversationParticipant.conversation_id == bindparam("conversation_id")
+)
+
+def _build_page_query(has_position: bool, newer: bool):
+    query = select(Message).where(
+        Message.conversation_id == bindparam("conversation_id"),
+        Message.is_deleted == False
+    )
+    # The plain created_at bounds are redundant with the row comparison but, unlike it,
+    # let PostgreSQL skip the partitions on the other side of the position
+    if has_position:
+        created_at = bindparam("created_at", type_=Message.created_at.type)
+        position = tuple_(created_at, bindparam("message_id", type_=Message.id.type))
+        if newer:
+            query = query.where(tuple_(Message.created_at, Message.id) > position, Message.created_at >= created_at)
+        else:
+            query = query.where(tuple_(Message.created_at, Message.id) < position, Message.created_at <= created_at)
+    if newer:
+        query = query.order_by(Message.created_at, Message.id)
+    else:
+        query = query.order_by(desc(Message.created_at), desc(Message.id))
+    return query.limit(bindparam("limit", type_=Integer))
+
+# (has_position, newer) -> page query
+PAGE_QUERIES = {
+    (has_position, newer): _build_page_query(has_position, newer)
+    for has_position in (False, True)
+    for newer in (False, True)
+}
 
 class MessageRepository:
     def __init__(self, db: AsyncSession):
         self.db = db
 
     async def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
-        import uuid
         stmt = select(Conversation).where(Conversation.id == uuid.UUID(conversation_id))
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
     async def get_participant(self, conversation_id: str, user_id: str) -> Optional[ConversationParticipant]:
-        import uuid
-        stmt = select(ConversationParticipant).where(
-            ConversationParticipant.conversation_id == uuid.UUID(conversation_id),
-            ConversationParticipant.user_id == uuid.UUID(user_id)
+        result = await self.db.execute(
+            PARTICIPANT_QUERY,
+            {"conversation_id": uuid.UUID(conversation_id), "user_id": uuid.UUID(user_id)}
         )
+        return result.scalars().first()
+
+    async def get_members(self, conversation_id: str) -> Dict[str, bool]:
+        """
+        Returns {user_id: is_active} for every participant of the conversation, served from the
+        membership cache when possible. Empty if the conversation doesn't exist.
+        """
+        members = membership_cache.get(conversation_id)
+        if members is not None:
+            return members
+
+        version = membership_cache.version(conversation_id)
+        result = await self.db.execute(MEMBERS_QUERY, {"conversation_id": uuid.UUID(conversation_id)})
+        members = {str(user_id): bool(is_active) for user_id, is_active in result.all()}
+
+        # Replica reads may lag behind a membership change, so only primary reads fill the cache
+        if read_engine is engine or self.db.get_bind() is engine.sync_engine:
+            membership_cache.set(conversation_id, members, version)
+        return members
+
+    async def get_active_participant_ids(self, conversation_id: str) -> List[str]:
+        """
+        The users events of the conversation are fanned out to: its active participants
+        (removed ones keep their row, but get nothing sent after they left).
+        """
+        return [user_id for user_id, is_active in (await self.get_members(conversation_id)).items() if is_active]
+
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        message_uuid = uuid.UUID(message_id)
+        stmt = select(Message).where(Message.id == message_uuid)
+        # Bounding created_at by the id's embedded time prunes every other partition
+        created = uuid7_time(message_uuid)
+        if created is not None:
+            stmt = stmt.where(Message.created_at.between(created - UUID7_MAX_SKEW, created + UUID7_MAX_SKEW))
         result = await self.db.execute(stmt)
         return result.scalars().first()
 
-    async def get_all_participant_ids(self, conversation_id: str) -> List[str]:
-        import uuid
-        stmt = select(ConversationParticipant.user_id).where(
-            ConversationParticipant.conversation_id == uuid.UUID(conversation_id)
+    async def allocate_seq(self, conversation_id: str, sender_id: str, count: int = 1) -> Optional[int]:
+        """
+        Reserves `count` sequence numbers in the conversation and returns the highest one.
+        Also bumps the conversation's updated_at/last_activity_at. The UPDATE row-locks the conversation until commit,
+        which serializes concurrent sends into it and keeps sequence numbers gap-free.
+        Returns None (nothing reserved) unless, under that lock, the conversation isn't archived
+        and `sender_id` is still an active participant.
+        """
+        member = (
+            select(ConversationParticipant.user_id)
+            .where(
+                ConversationParticipant.conversation_id == Conversation.id,
+                ConversationParticipant.user_id == uuid.UUID(sender_id),
+                ConversationParticipant.is_active == True
+            )
+            .exists()
+        )
+        stmt = (
+            update(Conversation)
+            .where(
+                Conversation.id == uuid.UUID(conversation_id),
+                Conversation.is_archived == False,
+                member
+            )
+            .values(
+                last_seq=Conversation.last_seq + count,
+                last_activity_at=datetime.now(timezone.utc),
+                updated_at=func.now()
+            )
+            .returning(Conversation.last_seq)
+            .execution_options(synchronize_session=False)
         )
         result = await self.db.execute(stmt)
-        return [str(pid) for pid in result.scalars().all()]
+        return result.scalar_one_or_none()
 
-    async def get_message(self, message_id: str) -> Optional[Message]:
-        import uuid
-        stmt = select(Message).where(Message.id == uuid.UUID(message_id))
+    async def get_send_state(self, conversation_id: str, user_id: str) -> Optional[Tuple[bool, Optional[bool]]]:
+        """
+        Returns (conversation.is_archived, participant.is_active) in one query, or None if the
+        conversation doesn't exist. participant.is_active is None when the user isn't a participant.
+        """
+        stmt = (
+            select(Conversation.is_archived, ConversationParticipant.is_active)
+            .outerjoin(
+                ConversationParticipant,
+                and_(
+                    ConversationParticipant.conversation_id == Conversation.id,
+                    ConversationParticipant.user_id == uuid.UUID(user_id)
+                )
+            )
+            .where(Conversation.id == uuid.UUID(conversation_id))
+        )
         result = await self.db.execute(stmt)
-        return result.scalars().first()
+        row = result.first()
+        return tuple(row) if row is not None else None
 
-    def create_message(
-        self, 
-        conversation_id: str, 
-        sender_id: str, 
-        content: str, 
-        message_type: str, 
-        media_url: Optional[str]
-    ) -> Message:
-        import uuid
-        message = Message(
-            conversation_id=uuid.UUID(conversation_id),
-            sender_id=uuid.UUID(sender_id),
-            content=content,
-            message_type=message_type,
-            media_url=media_url
-        )
-        self.db.add(message)
-        return message
-
-    def touch_conversation(self, conversation: Conversation):
-        conversation.updated_at = func.now()
-
-    async def get_messages_paginated(
-        self, 
-        conversation_id: str, 
-        limit: int, 
-        cursor_dt: Optional[datetime] = None
-    ) -> List[Message]:
-        import uuid
-        query = (
-            select(Message)
+    async def get_send_states(self, conversation_ids: List[str], user_id: str) -> Dict[str, Tuple[bool, Optional[bool]]]:
+        """
+        Batched `get_send_state`: {conversation_id: (is_archived, participant.is_active)} for the
+        conversations that exist.
+        """
+        stmt = (
+            select(Conversation.id, Conversation.is_archived, ConversationParticipant.is_active)
+            .outerjoin(
+                ConversationParticipant,
+                and_(
+                    ConversationParticipant.conversation_id == Conversation.id,
+                    ConversationParticipant.user_id == uuid.UUID(user_id)
+                )
+            )
+            .where(Conversation.id.in_([uuid.UUID(cid) for cid in conversation_ids]))
+        )
+        result = await self.db.execute(stmt)
+        return {str(cid): (is_archived, is_active) for cid, is_archived, is_active in result.all()}
+
+    async def insert_messages(self, rows: List[dict]) -> List[RowMapping]:
+        """
+        Inserts many messages with a single (multi-row) INSERT and returns them in input order.
+        Rows must already carry their id, seq and created_at.
+        """
+        stmt = insert(messages_table).returning(*MESSAGE_RETURNING, sort_by_parameter_order=True)
+        result = await self.db.execute(stmt, rows)
+        return list(result.mappings().all())
+
+    async def insert_message_if_allowed(
+        self,
+        conversation_id: str,
+        sender_id: str,
+        content: str,
+        message_type: str,
+        media_url: Optional[str],
+        message_id: Optional[UUID] = None,
+        created_at: Optional[datetime] = None
+    ) -> Optional[Tuple[RowMapping, Optional[List[str]]]]:
+        """
+        Inserts a message only if the sender is an active participant of a non-archived conversation.
+        Returns (message row, active participant ids) or None when the send isn't allowed.
+        The message gets `message_id`/`created_at` if given, else a new UUIDv7 and the current time.
+
+        On PostgreSQL the membership/archive check, the sequence bump, the insert and the participant
+        list are fused into a single statement (data-modifying CTEs + RETURNING, see build_fused_insert).
+        Other backends (SQLite in tests) run the same steps as separate statements; participant ids
+        are None there and must be fetched separately.
+        """
+        conv_uuid = uuid.UUID(conversation_id)
+        sender_uuid = uuid.UUID(sender_id)
+        now = created_at or datetime.now(timezone.utc)
+        message_id = message_id or uuid7(now)
+
+        if self.db.get_bind().dialect.name != "postgresql":
+            state = await self.get_send_state(conversation_id, sender_id)
+            if state is None or state[0] or not state[1]:
+                return None
+            seq = await self.allocate_seq(conversation_id, sender_id)
+            if seq is None:
+                return None
+            stmt = (
+                insert(messages_table)
+                .values(
+                    id=message_id,
+                    conversation_id=conv_uuid,
+                    sender_id=sender_uuid,
+                    seq=seq,
+                    content=content,
+                    message_type=message_type,
+                    media_url=media_url,
+                    is_deleted=False,
+                    created_at=now
+                )
+                .returning(*MESSAGE_RETURNING)
+            )
+            result = await self.db.execute(stmt)
+            return result.mappings().one(), None
+
+        stmt = self.build_fused_insert(conversation_id, sender_id, content, message_type, media_url, message_id, now)
+        result = await self.db.execute(stmt)
+        row = result.mappings().first()
+        if row is None:
+            return None
+        return row, [str(pid) for pid in row["participant_ids"] or []]
+
+    def build_fused_insert(
+        self,
+        conversation_id: str,
+        sender_id: str,
+        content: str,
+        message_type: str,
+        media_url: Optional[str],
+        message_id: UUID,
+        created_at: datetime
+    ) -> Insert:
+        """
+        The PostgreSQL statement behind insert_message_if_allowed: `member` (the membership/archive
+        check) gates `bump` (the sequence number and activity time), which feeds the INSERT. RETURNING
+        hands back the message and the active participant ids; no row means refused.
+        """
+        conv_uuid = uuid.UUID(conversation_id)
+        sender_uuid = uuid.UUID(sender_id)
+        member = (
+            select(participants_table.c.conversation_id)
+            .join(conversations_table, conversations_table.c.id == participants_table.c.conversation_id)
             .where(
-                Message.conversation_id == uuid.UUID(conversation_id),
-                Message.is_deleted == False
-            )
-            .order_by(desc(Message.created_at))
-        )
-        
-        if cursor_dt:
-            query = query.where(Message.created_at < cursor_dt)
-            
-        query = query.limit(limit)
-        result = await self.db.execute(query)
-        return list(result.scalars().all())
+                participants_table.c.conversation_id == conv_uuid,
+                participants_table.c.user_id == sender_uuid,
+                participants_table.c.is_active == True,
+                conversations_table.c.is_archived == False
+            )
+            .cte("member")
+        )
+        bump = (
+            update(conversations_table)
+            .where(conversations_table.c.id.in_(select(member.c.conversation_id)))
+            .values(
+                last_seq=conversations_table.c.last_seq + 1,
+                last_activity_at=created_at,
+                updated_at=func.now()
+            )
+            .returning(conversations_table.c.id, conversations_table.c.last_seq)
+            .cte("bump")
+        )
+        participant_ids = (
+            select(func.array_agg(participants_table.c.user_id))
+            .where(participants_table.c.conversation_id == conv_uuid, participants_table.c.is_active == True)
+            .scalar_subquery()
+        )
+        stmt = (
+            insert(messages_table)
+            .from_select(
+                ["id", "conversation_id", "sender_id", "seq", "content", "message_type", "media_url", "is_deleted", "created_at"],
+                select(
+                    literal(message_id, messages_table.c.id.type),
+                    bump.c.id,
+                    literal(sender_uuid, messages_table.c.sender_id.type),
+                    bump.c.last_seq,
+                    literal(content, messages_table.c.content.type),
+                    literal(message_type, messages_table.c.message_type.type),
+                    literal(media_url, messages_table.c.media_url.type),
+                    literal(False),
+                    literal(created_at, messages_table.c.created_at.type)
+                )
+            )
+            .returning(*MESSAGE_RETURNING, participant_ids.label("participant_ids"))
+            .add_cte(member)
+            .add_cte(bump)
+        )
+        return stmt
+
+    async def claim_idempotency_key(
+        self,
+        sender_id: str,
+        key: str,
+        conversation_id: str,
+        message_id: UUID,
+        message_created_at: datetime
+    ) -> bool:
+        """
+        Records `key` as the idempotency key of the message about to be sent. Returns False if the
+        sender already used it. A concurrent send with the same key waits on the unique index until
+        this transaction ends, then sees the key as used (or claims it, if this one rolled back).
+        """
+        is_postgres = self.db.get_bind().dialect.name == "postgresql"
+        insert_ = postgresql.insert if is_postgres else sqlite.insert
+        stmt = (
+            insert_(idempotency_keys_table)
+            .values(
+                sender_id=uuid.UUID(sender_id),
+                idempotency_key=key,
+                conversation_id=uuid.UUID(conversation_id),
+                message_id=message_id,
+                message_created_at=message_created_at,
+                created_at=message_created_at
+            )
+            .on_conflict_do_nothing()
+            .returning(idempotency_keys_table.c.message_id)
+        )
+        result = await self.db.execute(stmt)
+        return result.first() is not None
+
+    async def get_idempotent_message(self, sender_id: str, key: str) -> Optional[Tuple[str, datetime, Optional[RowMapping]]]:
+        """
+        Looks up a used idempotency key: (conversation id, when the key was used, the message it created),
+        or None if the key is unknown.
+        """
+        k = idempotency_keys_table
+        m = messages_table
+        stmt = (
+            select(k.c.conversation_id.label("key_conversation_id"), k.c.created_at.label("key_created_at"), *MESSAGE_RETURNING)
+            .select_from(k)
+            # The message's created_at is part of its primary key, so this is a single-partition lookup
+            .outerjoin(m, and_(m.c.id == k.c.message_id, m.c.created_at == k.c.message_created_at))
+            .where(k.c.sender_id == uuid.UUID(sender_id), k.c.idempotency_key == key)
+        )
+        row = (await self.db.execute(stmt)).mappings().first()
+        if row is None:
+            return None
+        return str(row["key_conversation_id"]), row["key_created_at"], row if row["id"] is not None else None
+
+    async def update_read_position(self, conversation_id: str, user_id: str, message_id, seq: int):
+        """
+        Moves a participant's read position forward to the given message (never backwards).
+        The deleted messages past it are counted by the UPDATE itself (as ReadReceiptBuffer does)
+        rather than read beforehand, so deletes committed in between aren't overwritten.
+        """
+        conv_uuid = uuid.UUID(conversation_id)
+        deleted_after = (
+            select(func.count())
+            .where(
+                messages_table.c.conversation_id == participants_table.c.conversation_id,
+                messages_table.c.seq > seq,
+                messages_table.c.is_deleted == True
+            )
+            .scalar_subquery()
+        )
+        stmt = (
+            update(participants_table)
+            .where(
+                participants_table.c.conversation_id == conv_uuid,
+                participants_table.c.user_id == uuid.UUID(user_id),
+                participants_table.c.last_seen_seq < seq
+            )
+            .values(
+                last_seen_message_id=message_id,
+                last_seen_seq=seq,
+                deleted_unread_count=deleted_after
+            )
+        )
+        await self.db.execute(stmt)
+
+    async def increment_deleted_unread(self, conversation_id: str, seq: int):
+        """
+        Accounts for a message deleted at `seq` in every participant that hasn't read past it yet.
+        """
+        stmt = (
+            update(ConversationParticipant)
+            .where(
+                ConversationParticipant.conversation_id == uuid.UUID(conversation_id),
+                ConversationParticipant.last_seen_seq < seq
+            )
+            .values(deleted_unread_count=ConversationParticipant.deleted_unread_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.execute(stmt)
+
+    async def stream_messages(self, conversation_id: str, yield_per: int = 1000) -> AsyncIterator[List[RowMapping]]:
+        """
+        Streams every non-deleted message of a conversation, oldest first, through a server-side cursor.
+        Rows come back in lists of up to `yield_per` (one driver fetch each) instead of being materialized.
+        """
+        stmt = (
+            select(*MESSAGE_RETURNING)
+            .where(
+                messages_table.c.conversation_id == uuid.UUID(conversation_id),
+                messages_table.c.is_deleted == False
+            )
+            .order_by(messages_table.c.created_at, messages_table.c.id)
+            .execution_options(yield_per=yield_per)
+        )
+        result = await self.db.stream(stmt)
+        # Iterating partitions rather than rows avoids a greenlet switch per row
+        async for rows in result.mappings().partitions():
+            yield rows
+
+    def build_page_query(
+        self,
+        conversation_id: str,
+        limit: int,
+        position: Optional[Tuple[datetime, UUID]] = None,
+        newer: bool = False
+    ) -> Tuple[Select, Dict[str, Any]]:
+        """
+        Keyset page query over (created_at, id), as a prebuilt statement and its parameters.
+        Older pages walk ix_messages_conversation_id_created_at_desc forwards, newer pages walk it
+        backwards; either way it's a bounded range scan with no sort step.
+        """
+        params = {"conversation_id": uuid.UUID(conversation_id), "limit": limit}
+        if position is not None:
+            params["created_at"], params["message_id"] = position
+        return PAGE_QUERIES[(position is not None, newer)], params
+
+    def build_search_query(
+        self,
+        user_id: str,
+        terms: List[str],
+        limit: int,
+        position: Optional[Tuple[float, datetime, UUID]] = None,
+        conversation_id: Optional[str] = None
+    ):
+        """
+        Ranked full-text search over the non-deleted messages of every conversation the user
+        participates in (or just `conversation_id`). Every term must match.
+        Results are ordered by (rank, created_at, id) descending, keyset-paged past `position`.
+        PostgreSQL matches through the GIN-indexed tsvector column, SQLite through FTS5.
+        """
+        if self.db.get_bind().dialect.name == "postgresql":
+            vector = literal_column(f"{messages_table.name}.{SEARCH_VECTOR_COLUMN}", TSVECTOR)
+            tsquery = func.plainto_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), " ".join(terms))
+            rank = func.ts_rank_cd(vector, tsquery)
+            matches = select(*MESSAGE_RETURNING, rank.label("rank")).where(vector.op("@@")(tsquery))
+        else:
+            fts = table(SEARCH_FTS_TABLE, column("rowid"))
+            # Each term quoted as an FTS5 string, so user input can't inject query syntax
+            phrase = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            fts_ref = literal_column(SEARCH_FTS_TABLE)
+            # bm25 is lower-is-better; negate it so both backends rank descending
+            rank = -func.bm25(fts_ref)
+            matches = (
+                select(*MESSAGE_RETURNING, rank.label("rank"))
+                .select_from(fts.join(messages_table, literal_column(f"{messages_table.name}.rowid") == fts.c.rowid))
+                .where(fts_ref.op("MATCH")(phrase))
+            )
+
+        member_of = select(participants_table.c.conversation_id).where(participants_table.c.user_id == uuid.UUID(user_id))
+        matches = matches.where(
+            messages_table.c.conversation_id.in_(member_of),
+            messages_table.c.is_deleted == False
+        )
+        if conversation_id is not None:
+            matches = matches.where(messages_table.c.conversation_id == uuid.UUID(conversation_id))
+
+        ranked = matches.subquery("ranked")
+        query = select(ranked)
+        if position is not None:
+            query = query.where(tuple_(ranked.c.rank, ranked.c.created_at, ranked.c.id) < tuple_(*position))
+        return query.order_by(desc(ranked.c.rank), desc(ranked.c.created_at), desc(ranked.c.id)).limit(limit)
+
+    async def search_messages(
+        self,
+        user_id: str,
+        terms: List[str],
+        limit: int,
+        position: Optional[Tuple[float, datetime, UUID]] = None,
+        conversation_id: Optional[str] = None
+    ) -> List[RowMapping]:
+        result = await self.db.execute(self.build_search_query(user_id, terms, limit, position, conversation_id))
+        return list(result.mappings().all())
+
+    async def get_messages_page(
+        self,
+        conversation_id: str,
+        limit: int,
+        position: Optional[Tuple[datetime, UUID]] = None,
+        newer: bool = False
+    ) -> List[Message]:
+        """
+        Up to `limit` messages strictly older (or, with `newer`, strictly newer) than `position`,
+        always returned newest first.
+        """
+        query, params = self.build_page_query(conversation_id, limit, position, newer)
+        result = await self.db.execute(query, params)
+        messages = list(result.scalars().all())
+        if newer:
+            messages.reverse()
+        return messages
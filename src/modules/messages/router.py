@@ -1,44 +1,118 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, status, Query
-from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID
+from fastapi import APIRouter, Depends, Header, Response, status, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from src.api import deps
-from src.schemas.message import MessageCreate, MessageResponse, MessageList, MessageRead
+from src.schemas.message import (
+    MessageCreate, MessageResponse, MessageList, MessageRead, MessageBatchCreate, MessageBatchResponse, MessageSearchList
+)
 from src.models.all_models import User
 from src.modules.messages.service import MessageService
 from src.api import deps
 
 router = APIRouter()
 
+@router.post("/messages/batch", response_model=MessageBatchResponse, status_code=status.HTTP_201_CREATED)
+async def send_messages_batch(
+    batch_in: MessageBatchCreate,
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_db)
+) -> MessageBatchResponse:
+    """
+    Send several messages (to one or more conversations) in a single request.
+    Either every message is sent or none is.
+    """
+    service = MessageService(db)
+    return await service.send_messages_batch(str(current_user.id), batch_in.items)
+
+@router.get("/messages/search", response_model=MessageSearchList)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256, description="Words to search for; every word must match"),
+    conversation_id: Optional[UUID] = Query(None, description="Only search this conversation"),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor from a previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_read_db)
+) -> MessageSearchList:
+    """
+    Search messages across the conversations the current user participates in, best match first.
+    Deleted messages are never returned.
+    """
+    service = MessageService(db)
+    return await service.search_messages(
+        str(current_user.id), q, limit, cursor, str(conversation_id) if conversation_id else None
+    )
+
 @router.post("/{conversation_id}/messages", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def send_message(
     conversation_id: str,
     message_in: MessageCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=128),
     current_user: User = Depends(deps.get_current_user),
     db: AsyncSession = Depends(deps.get_db)
 ) -> MessageResponse:
     """
     Send a message to a conversation.
     Delegates all business logic and transaction safety to the MessageService.
+    Sends carrying an idempotency key (header or `client_message_id`) are safe to retry: a retry
+    returns the original message, marked with `Idempotent-Replayed: true`.
     """
     service = MessageService(db)
-    return await service.send_message(conversation_id, str(current_user.id), message_in)
+    message, replayed = await service.send_message(conversation_id, str(current_user.id), message_in, idempotency_key)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return message
 
 @router.get("/{conversation_id}/messages", response_model=MessageList)
 async def list_messages(
     conversation_id: str,
-    cursor: Optional[str] = Query(None, description="ISO timestamp of the last seen message for pagination"),
-    limit: int = Query(20, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor/prev_cursor from a previous page"),
+    around: Optional[UUID] = Query(None, description="Return a window of messages centred on this message"),
+    limit: int = Query(20, ge=1, le=100),
     current_user: User = Depends(deps.get_current_user),
-    db: AsyncSession = Depends(deps.get_db)
+    db: AsyncSession = Depends(deps.get_read_db)
 ) -> MessageList:
     """
-    List messages in a conversation.
-    Uses cursor-based pagination (backward from newest).
+    List messages in a conversation, newest first.
+    Uses keyset cursors over (created_at, id): `next_cursor` pages back in time, `prev_cursor` forward.
     Delegates membership validation and querying to MessageService.
     """
     service = MessageService(db)
-    return await service.list_messages(conversation_id, str(current_user.id), limit, cursor)
+    return await service.list_messages(
+        conversation_id, str(current_user.id), limit, cursor, str(around) if around else None
+    )
+
+@router.get("/{conversation_id}/messages/export")
+async def export_messages(
+    conversation_id: str,
+    compress: bool = Query(False, alias="gzip", description="Return a gzip-compressed file"),
+    current_user: User = Depends(deps.get_current_user),
+    session_factory: async_sessionmaker = Depends(deps.get_read_session_factory)
+) -> StreamingResponse:
+    """
+    Export the full history of a conversation as NDJSON (one message per line, oldest first).
+    The response is streamed, so it works for conversations of any size.
+    """
+    # The session must outlive this handler: it is closed by the stream once the export is sent
+    db = session_factory()
+    try:
+        chunks = await MessageService(db).export_messages(conversation_id, str(current_user.id), compress)
+    except Exception:
+        await db.close()
+        raise
+
+    filename = f"conversation-{conversation_id}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        # Also covers a stream that never started (closing twice is harmless)
+        background=BackgroundTask(db.close)
+    )
 
 @router.put("/{conversation_id}/messages/read", status_code=status.HTTP_200_OK)
 async def mark_read(
@@ -1,111 +1,436 @@
-from typing import List, Optional, Tuple
-from datetime import datetime
+import re
+import uuid
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.schemas.message import MessageCreate, MessageResponse, MessageList
+from src.schemas.message import (
+    MessageCreate, MessageResponse, MessageList, MessageBatchItem, MessageBatchResponse, MessageSearchResult, MessageSearchList
+)
 from src.modules.messages.repository import MessageRepository
+from src.modules.messages.read_receipts import read_receipt_buffer
+from src.modules.messages.idempotency import idempotency_cache
 from src.core.pubsub import pubsub_manager
+from src.core.cursors import encode_cursor, decode_cursor
+from src.core.ids import uuid7
+from src.database.session import read_your_writes
+from src.core.config import get_settings
 import logging
 
+settings = get_settings()
 logger = logging.getLogger("chat_api")
 
+# Exported NDJSON is flushed to the client in chunks of roughly this size
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Search terms beyond this many are ignored (every term must match, so more rarely helps)
+SEARCH_MAX_TERMS = 16
+
 class MessageService:
     def __init__(self, db: AsyncSession):
         self.db = db
         self.repo = MessageRepository(db)
 
-    async def send_message(self, conversation_id: str, sender_id: str, message_in: MessageCreate) -> MessageResponse:
-        """
-        Validates business rules and sends a message.
+    async def send_message(
+        self,
+        conversation_id: str,
+        sender_id: str,
+        message_in: MessageCreate,
+        idempotency_key: Optional[str] = None
+    ) -> Tuple[MessageResponse, bool]:
         """
-        # 1. Validate conversation exists and is not archived
-        conversation = await self.repo.get_conversation(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        
-        if conversation.is_archived:
-            raise HTTPException(status_code=403, detail="Cannot send messages to an archived conversation")
+        Validates business rules and sends a message. Returns (message, replayed).
 
-        # 2. Validate sender is an active participant
-        participant = await self.repo.get_participant(conversation_id, sender_id)
-        if not participant:
-            raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
-            
-        if not participant.is_active:
-            raise HTTPException(status_code=403, detail="You have left this conversation and cannot send messages")
-
-        # 3. Fetch all participant IDs early for broadcasting
-        participant_ids = await self.repo.get_all_participant_ids(conversation_id)
+        The happy path is a single statement (see `insert_message_if_allowed`); the detailed
+        checks below only run to produce the right error once a send has been refused.
+        With an idempotency key (`idempotency_key` or `message_in.client_message_id`), a retry of a
+        send that already went through returns the original message, with `replayed` set,
+        without inserting or publishing anything.
+        """
+        if idempotency_key and message_in.client_message_id and idempotency_key != message_in.client_message_id:
+            raise HTTPException(status_code=400, detail="Idempotency-Key and client_message_id differ")
+        key = idempotency_key or message_in.client_message_id
+        message_id = created_at = None
+        if key:
+            replayed = await self._find_idempotent_send(conversation_id, sender_id, key)
+            if replayed is not None:
+                return replayed, True
+            created_at = datetime.now(timezone.utc)
+            message_id = uuid7(created_at)
+            if not await self.repo.claim_idempotency_key(sender_id, key, conversation_id, message_id, created_at):
+                # A concurrent send with the same key committed while this one waited for the key
+                replayed = await self._find_idempotent_send(conversation_id, sender_id, key)
+                if replayed is not None:
+                    return replayed, True
+                raise HTTPException(status_code=409, detail="A send with this idempotency key is in progress, please retry")
 
-        # 4. Insert message
-        message = self.repo.create_message(
+        # 1. Insert the message if the sender is an active participant of a non-archived conversation
+        #    (also assigns its sequence number and touches conversation.updated_at)
+        inserted = await self.repo.insert_message_if_allowed(
             conversation_id=conversation_id,
             sender_id=sender_id,
             content=message_in.content,
             message_type=message_in.message_type,
-            media_url=message_in.media_url
+            media_url=message_in.media_url,
+            message_id=message_id,
+            created_at=created_at
         )
-        
-        # 5. Update conversation.updated_at
-        self.repo.touch_conversation(conversation)
-        
-        # 6. Commit transaction
+        if inserted is None:
+            # Nothing is committed, so the idempotency key stays free for a later retry
+            await self._raise_send_refused(conversation_id, sender_id)
+        message_row, participant_ids = inserted
+
+        # 2. Participant IDs for broadcasting (already returned by the fused statement on PostgreSQL)
+        if participant_ids is None:
+            participant_ids = await self.repo.get_active_participant_ids(conversation_id)
+
+        # 3. Commit transaction. The row came back via RETURNING, so no refresh is needed.
         await self.db.commit()
-        await self.db.refresh(message)
-        
-        msg_response = MessageResponse.model_validate(message)
+        await read_your_writes.mark_write(sender_id)
+
+        msg_response = MessageResponse.model_validate(dict(message_row))
+        if key:
+            idempotency_cache.set(sender_id, key, msg_response)
         
-        # 7. Publish event to PubSub
+        # 4. Publish event to PubSub
         try:
             await pubsub_manager.publish_message(msg_response.model_dump(mode='json'), participant_ids)
         except Exception as e:
             logger.error(f"Failed to publish message event: {e}")
             
-        return msg_response
+        return msg_response, False
+
+    async def _find_idempotent_send(self, conversation_id: str, sender_id: str, key: str) -> Optional[MessageResponse]:
+        """
+        The message already sent with this idempotency key, if any: from the in-process cache when
+        possible, else from the key table.
+        """
+        message = idempotency_cache.get(sender_id, key)
+        if message is None:
+            found = await self.repo.get_idempotent_message(sender_id, key)
+            if found is None:
+                return None
+            key_conversation_id, key_created_at, row = found
+            if row is None:
+                raise HTTPException(status_code=409, detail="The message sent with this idempotency key no longer exists")
+            message = MessageResponse.model_validate(dict(row))
+            if key_created_at.tzinfo is None:
+                key_created_at = key_created_at.replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - key_created_at).total_seconds()
+            idempotency_cache.set(sender_id, key, message, age_seconds=age)
+
+        if str(message.conversation_id) != conversation_id:
+            raise HTTPException(status_code=422, detail="This idempotency key was already used in another conversation")
+        return message
 
-    async def list_messages(self, conversation_id: str, user_id: str, limit: int, cursor: Optional[str]) -> MessageList:
+    async def _raise_send_refused(self, conversation_id: str, sender_id: str):
         """
-        Validates membership and lists messages with cursor pagination.
+        Raises the HTTP error explaining why a send was refused.
+        """
+        state = await self.repo.get_send_state(conversation_id, sender_id)
+        self._check_send_state(state)
+
+        # State changed between the insert attempt and this check (e.g. just re-joined); let the client retry
+        raise HTTPException(status_code=409, detail="Conversation state changed, please retry")
+
+    @staticmethod
+    def _check_send_state(state: Optional[Tuple[bool, Optional[bool]]]):
+        """
+        Raises unless `state` (is_archived, participant.is_active) allows sending.
+        """
+        if state is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        is_archived, participant_active = state
+        if is_archived:
+            raise HTTPException(status_code=403, detail="Cannot send messages to an archived conversation")
+        if participant_active is None:
+            raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
+        if not participant_active:
+            raise HTTPException(status_code=403, detail="You have left this conversation and cannot send messages")
+
+    async def send_messages_batch(self, sender_id: str, items: List[MessageBatchItem]) -> MessageBatchResponse:
+        """
+        Sends several messages, possibly to different conversations, all-or-nothing.
+        Membership is validated once per conversation, the messages are written with one bulk INSERT
+        and a single commit, and one `message_batch` event is published per conversation.
+        """
+        if len(items) > settings.MESSAGE_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"A batch can contain at most {settings.MESSAGE_BATCH_MAX_ITEMS} messages")
+
+        # 1. Group by conversation, keeping the submitted order within each one
+        by_conversation: Dict[str, List[int]] = {}
+        for index, item in enumerate(items):
+            by_conversation.setdefault(str(item.conversation_id), []).append(index)
+
+        # 2. Validate every conversation in one query
+        states = await self.repo.get_send_states(list(by_conversation), sender_id)
+        for conversation_id in by_conversation:
+            try:
+                self._check_send_state(states.get(conversation_id))
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail=f"{e.detail} ({conversation_id})") from None
+
+        # 3. Reserve sequence numbers, one UPDATE per conversation, re-checking step 2 under its row lock.
+        #    Sorted so concurrent batches lock conversations in the same order and can't deadlock.
+        now = datetime.now(timezone.utc)
+        rows: List[Optional[dict]] = [None] * len(items)
+        for conversation_id in sorted(by_conversation):
+            indexes = by_conversation[conversation_id]
+            last_seq = await self.repo.allocate_seq(conversation_id, sender_id, count=len(indexes))
+            if last_seq is None:
+                # Removed or archived since step 2: nothing of the batch is written
+                await self.db.rollback()
+                try:
+                    await self._raise_send_refused(conversation_id, sender_id)
+                except HTTPException as e:
+                    raise HTTPException(status_code=e.status_code, detail=f"{e.detail} ({conversation_id})") from None
+            first_seq = last_seq - len(indexes) + 1
+            for offset, index in enumerate(indexes):
+                item = items[index]
+                # Distinct timestamps keep (created_at, id) ordering equal to the submitted order
+                created_at = now + timedelta(microseconds=offset)
+                rows[index] = {
+                    "id": uuid7(created_at),
+                    "conversation_id": item.conversation_id,
+                    "sender_id": uuid.UUID(sender_id),
+                    "seq": first_seq + offset,
+                    "content": item.content,
+                    "message_type": item.message_type,
+                    "media_url": item.media_url,
+                    "is_deleted": False,
+                    "created_at": created_at,
+                }
+
+        # 4. Bulk insert and commit once
+        inserted = await self.repo.insert_messages(rows)
+        participant_ids = {cid: await self.repo.get_active_participant_ids(cid) for cid in by_conversation}
+        await self.db.commit()
+        await read_your_writes.mark_write(sender_id)
+
+        responses = [MessageResponse.model_validate(dict(row)) for row in inserted]
+
+        # 5. One combined event per conversation
+        for conversation_id, indexes in by_conversation.items():
+            event_payload = {
+                "event_type": "message_batch",
+                "conversation_id": conversation_id,
+                "messages": [responses[i].model_dump(mode='json') for i in indexes]
+            }
+            try:
+                await pubsub_manager.publish_message(event_payload, participant_ids[conversation_id])
+            except Exception as e:
+                logger.error(f"Failed to publish message batch event: {e}")
+
+        return MessageBatchResponse(items=responses)
+
+    async def list_messages(
+        self,
+        conversation_id: str,
+        user_id: str,
+        limit: int,
+        cursor: Optional[str] = None,
+        around: Optional[str] = None
+    ) -> MessageList:
+        """
+        Validates membership and lists messages, newest first, with composite keyset cursors.
+        `next_cursor` pages towards older messages and `prev_cursor` towards newer ones.
+        `around` returns a window centred on the given message (jump-to-reply).
         """
         # 1. Verify participation
-        participant = await self.repo.get_participant(conversation_id, user_id)
-        if not participant:
+        members = await self.repo.get_members(conversation_id)
+        if user_id not in members:
             raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
             
         # Note: even if participant.is_active == False, they can still usually read past messages.
 
+        if cursor and around:
+            raise HTTPException(status_code=400, detail="cursor and around cannot be combined")
+        if around:
+            return await self._list_messages_around(conversation_id, limit, around)
+
         # 2. Parse cursor
-        cursor_dt = None
+        position, newer = None, False
         if cursor:
-            try:
-                cursor_dt = datetime.fromisoformat(cursor)
-            except ValueError:
-                pass # Ignore invalid cursor
+            position, newer = self._parse_cursor(conversation_id, cursor)
 
-        # 3. Fetch messages
-        messages = await self.repo.get_messages_paginated(conversation_id, limit, cursor_dt)
+        # 3. Fetch one extra message to know whether another page exists
+        messages = await self.repo.get_messages_page(conversation_id, limit + 1, position, newer)
+        has_more = len(messages) > limit
+        # Pages come back newest first, so the extra message is the first one when paging newer
+        messages = messages[len(messages) - limit:] if newer and has_more else messages[:limit]
 
-        # 4. Calculate next cursor
-        next_cursor = None
-        if messages and len(messages) == limit:
-            next_cursor = messages[-1].created_at.isoformat()
+        # 4. Calculate cursors
+        next_cursor = prev_cursor = None
+        if messages:
+            has_older = has_more or newer
+            has_newer = has_more if newer else position is not None
+            if has_older:
+                next_cursor = self._make_cursor(conversation_id, messages[-1], "older")
+            if has_newer:
+                prev_cursor = self._make_cursor(conversation_id, messages[0], "newer")
+        elif newer:
+            # Nothing newer yet: hand the same position back so clients can poll it
+            prev_cursor = cursor
             
         return MessageList(
             items=[MessageResponse.model_validate(m) for m in messages],
-            next_cursor=next_cursor
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor
         )
 
+    async def _list_messages_around(self, conversation_id: str, limit: int, message_id: str) -> MessageList:
+        anchor = await self.repo.get_message(message_id)
+        if not anchor or str(anchor.conversation_id) != conversation_id:
+            raise HTTPException(status_code=404, detail="Message not found in this conversation")
+
+        position = (anchor.created_at, anchor.id)
+        newer_count = (limit - 1) // 2
+        older_count = limit - 1 - newer_count
+
+        newer = await self.repo.get_messages_page(conversation_id, newer_count + 1, position, newer=True)
+        has_newer = len(newer) > newer_count
+        newer = newer[len(newer) - newer_count:] if has_newer else newer
+        older = await self.repo.get_messages_page(conversation_id, older_count + 1, position)
+        has_older = len(older) > older_count
+        older = older[:older_count]
+
+        messages = newer + ([] if anchor.is_deleted else [anchor]) + older
+        next_cursor = prev_cursor = None
+        if messages:
+            if has_older:
+                next_cursor = self._make_cursor(conversation_id, messages[-1], "older")
+            if has_newer:
+                prev_cursor = self._make_cursor(conversation_id, messages[0], "newer")
+
+        return MessageList(
+            items=[MessageResponse.model_validate(m) for m in messages],
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor
+        )
+
+    @staticmethod
+    def _make_cursor(conversation_id: str, message, direction: str) -> str:
+        return encode_cursor({
+            "c": conversation_id,
+            "t": message.created_at.isoformat(),
+            "id": str(message.id),
+            "d": direction
+        })
+
+    @staticmethod
+    def _parse_cursor(conversation_id: str, cursor: str) -> Tuple[Tuple[datetime, uuid.UUID], bool]:
+        """
+        Returns ((created_at, id), newer) from a cursor issued for this conversation.
+        """
+        payload = decode_cursor(cursor)
+        try:
+            if payload["c"] != conversation_id or payload["d"] not in ("older", "newer"):
+                raise ValueError("cursor issued for another listing")
+            position = (datetime.fromisoformat(payload["t"]), uuid.UUID(payload["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return position, payload["d"] == "newer"
+
+    async def search_messages(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        cursor: Optional[str] = None,
+        conversation_id: Optional[str] = None
+    ) -> MessageSearchList:
+        """
+        Full-text search over the messages of the user's conversations (optionally just one),
+        best match first, paged with keyset cursors over (rank, created_at, id).
+        """
+        if conversation_id is not None:
+            members = await self.repo.get_members(conversation_id)
+            if user_id not in members:
+                raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
+
+        terms = re.findall(r"\w+", query.lower())[:SEARCH_MAX_TERMS]
+        if not terms:
+            return MessageSearchList(items=[])
+        normalized = " ".join(terms)
+
+        position = None
+        if cursor:
+            payload = decode_cursor(cursor)
+            try:
+                if payload["q"] != normalized or payload["c"] != conversation_id:
+                    raise ValueError("cursor issued for another search")
+                position = (float(payload["r"]), datetime.fromisoformat(payload["t"]), uuid.UUID(payload["id"]))
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        rows = await self.repo.search_messages(user_id, terms, limit + 1, position, conversation_id)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor({
+                "q": normalized,
+                "c": conversation_id,
+                "r": last["rank"],
+                "t": last["created_at"].isoformat(),
+                "id": str(last["id"])
+            })
+        return MessageSearchList(items=[MessageSearchResult.model_validate(dict(row)) for row in rows], next_cursor=next_cursor)
+
+    async def export_messages(self, conversation_id: str, user_id: str, compress: bool = False) -> AsyncIterator[bytes]:
+        """
+        Validates membership, then returns an iterator streaming the conversation's full history
+        as NDJSON (gzip-compressed if `compress`). Rows are read through a server-side cursor and
+        written out in fixed-size chunks, so memory stays flat however long the history is.
+        The iterator closes this service's session once exhausted (or abandoned).
+        """
+        members = await self.repo.get_members(conversation_id)
+        if user_id not in members:
+            raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
+
+        async def chunks() -> AsyncIterator[bytes]:
+            compressor = zlib.compressobj(wbits=31) if compress else None
+            buffer = bytearray()
+            try:
+                async for rows in self.repo.stream_messages(conversation_id):
+                    for row in rows:
+                        buffer += MessageResponse.model_validate(dict(row)).model_dump_json().encode()
+                        buffer += b"\n"
+                        if len(buffer) >= EXPORT_CHUNK_SIZE:
+                            yield compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+                            buffer.clear()
+                tail = bytes(buffer)
+                if compressor:
+                    tail = compressor.compress(tail) + compressor.flush()
+                if tail:
+                    yield tail
+            finally:
+                await self.db.close()
+
+        return chunks()
+
     async def read_message(self, conversation_id: str, user_id: str, last_seen_message_id: str):
         """
-        Updates the user's last seen message ID for a conversation.
+        Moves the user's last seen message (and sequence position) in a conversation forward.
+        The position is buffered and written behind (see ReadReceiptBuffer); moves backwards are ignored.
         """
-        participant = await self.repo.get_participant(conversation_id, user_id)
-        if not participant:
+        members = await self.repo.get_members(conversation_id)
+        if user_id not in members:
             raise HTTPException(status_code=403, detail="You are not a participant of this conversation")
             
-        import uuid
-        participant.last_seen_message_id = uuid.UUID(last_seen_message_id) if last_seen_message_id else None
+        message = await self.repo.get_message(last_seen_message_id)
+        if not message or str(message.conversation_id) != conversation_id:
+            raise HTTPException(status_code=404, detail="Message not found in this conversation")
+
+        # Normally just buffered and written in a later batch; written directly only if the buffer is full
+        if read_receipt_buffer.add(conversation_id, user_id, message.id, message.seq):
+            return {"status": "ok"}
+
+        await self.repo.update_read_position(conversation_id, user_id, message.id, message.seq)
         await self.db.commit()
+        await read_your_writes.mark_write(user_id)
         return {"status": "ok"}
 
     async def soft_delete_message(self, conversation_id: str, sender_id: str, message_id: str):
@@ -132,14 +457,17 @@ class MessageService:
             "conversation_id": conversation_id
         }
 
-        # 4. Perform soft delete
+        # 4. Perform soft delete, keeping unread counters of participants who haven't read it in step
         message.is_deleted = True
+        message.deleted_at = datetime.now(timezone.utc)
+        await self.repo.increment_deleted_unread(conversation_id, message.seq)
         await self.db.commit()
+        await read_your_writes.mark_write(sender_id)
         
         # We might want to broadcast a 'message_deleted' event to participants
         # so clients can remove it from their UI in real-time.
         # This is strictly optional for MVP but good for V2 completeness.
-        participant_ids = await self.repo.get_all_participant_ids(conversation_id)
+        participant_ids = await self.repo.get_active_participant_ids(conversation_id)
         try:
             await pubsub_manager.publish_message(event_payload, participant_ids)
         except Exception as e:
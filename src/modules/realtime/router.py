@@ -1,5 +1,7 @@
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 from src.core.connection_manager import manager
+from src.core.pubsub import pubsub_manager
 from src.models.all_models import User
 from src.api.deps import get_current_user_ws
 
@@ -8,14 +10,19 @@ router = APIRouter()
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
+    last_event_id: Optional[str] = None,
     current_user: User = Depends(get_current_user_ws)
 ):
     """
     WebSocket endpoint for realtime communication.
     Clients connect here with their token as a query parameter.
+    Reconnecting clients pass the `event_id` of the last event they got as `last_event_id`:
+    the events they missed are sent first (or a resync_required event, when that's not possible).
     """
     user_id_str = str(current_user.id)
-    await manager.connect(user_id_str, websocket)
+    connection = await manager.connect(user_id_str, websocket, replaying=last_event_id is not None)
+    if last_event_id is not None:
+        connection.finish_replay(await pubsub_manager.replay_events(user_id_str, last_event_id))
     
     try:
         while True:
@@ -25,7 +32,8 @@ async def websocket_endpoint(
             
             # For debugging/ping-pong
             if data == "ping":
-                await websocket.send_text("pong")
+                # Through the outbound queue, so it is never written concurrently with the writer task
+                connection.enqueue("pong")
                 
     except WebSocketDisconnect:
         manager.disconnect(user_id_str, websocket)
@@ -6,7 +6,7 @@ from typing import List
 from src.api import deps
 from src.schemas.user import UserCreate, UserResponse, UserUpdate
 from src.models.all_models import User
-from src.core.security import get_password_hash
+from src.core.hashing import password_hasher
 
 router = APIRouter()
 
@@ -37,7 +37,7 @@ async def create_user(
     user = User(
         email=user_in.email,
         username=user_in.username,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=await password_hasher.hash(user_in.password),
         is_active=user_in.is_active,
         is_superuser=user_in.is_superuser
     )
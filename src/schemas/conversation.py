@@ -22,11 +22,15 @@ class ConversationUpdate(BaseModel):
 class ConversationAddParticipants(BaseModel):
     participant_ids: List[UUID]
 
+class ConversationRemoveParticipants(BaseModel):
+    participant_ids: List[UUID]
+
 class ConversationResponse(ConversationBase):
     id: UUID
     creator_id: Optional[UUID]
     created_at: datetime
     updated_at: Optional[datetime]
+    last_activity_at: Optional[datetime] = None
     unread_count: int = 0
     # We might want to return participants or last message here
     
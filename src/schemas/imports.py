@@ -0,0 +1,56 @@
+from typing import Annotated, List, Literal, Optional, Union
+from pydantic import BaseModel, Field
+from uuid import UUID
+from datetime import datetime
+
+class ImportConversation(BaseModel):
+    kind: Literal["conversation"]
+    id: UUID
+    title: Optional[str] = None
+    is_group: bool = False
+    is_archived: bool = False
+    creator_id: Optional[UUID] = None
+    created_at: Optional[datetime] = None
+
+class ImportParticipant(BaseModel):
+    kind: Literal["participant"]
+    conversation_id: UUID
+    user_id: UUID
+    role: str = "member"
+    is_active: bool = True
+    last_seen_seq: int = Field(0, ge=0)
+    created_at: Optional[datetime] = None
+
+class ImportMessage(BaseModel):
+    """
+    A historical message. Messages of a conversation must appear in chronological order;
+    `seq` is assigned in file order; if given, it must be that number (checked, not trusted).
+    """
+    kind: Literal["message"]
+    id: Optional[UUID] = None
+    conversation_id: UUID
+    sender_id: UUID
+    seq: Optional[int] = Field(None, ge=1)
+    content: Optional[str] = None
+    message_type: str = "text"
+    media_url: Optional[str] = None
+    is_deleted: bool = False
+    # When it was deleted, if the history says; its creation time otherwise
+    deleted_at: Optional[datetime] = None
+    created_at: datetime
+
+ImportRecord = Annotated[Union[ImportConversation, ImportParticipant, ImportMessage], Field(discriminator="kind")]
+
+class ImportReport(BaseModel):
+    """
+    Progress / outcome of a history import.
+    """
+    lines: int = 0
+    conversations: int = 0
+    participants: int = 0
+    messages: int = 0
+    rejected: int = 0
+    errors: List[str] = [] # First few rejected lines, with the reason
+    elapsed_seconds: float = 0.0
+    rows_per_second: float = 0.0
+    completed: bool = False
@@ -1,5 +1,5 @@
 from typing import Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
 
@@ -12,7 +12,21 @@ class MessageCreate(MessageBase):
     """
     Schema for sending a message.
     """
-    pass
+    # Idempotency key chosen by the client (alternatively sent as the Idempotency-Key header):
+    # retrying a send with the same key returns the original message instead of sending it again
+    client_message_id: Optional[str] = Field(None, min_length=1, max_length=128)
+
+class MessageBatchItem(MessageBase):
+    """
+    One message of a batch send; batches may span several conversations.
+    """
+    conversation_id: UUID
+
+class MessageBatchCreate(BaseModel):
+    """
+    Schema for sending several messages at once.
+    """
+    items: List[MessageBatchItem] = Field(..., min_length=1)
 
 class MessageRead(BaseModel):
     """
@@ -24,6 +38,7 @@ class MessageResponse(MessageBase):
     id: UUID
     conversation_id: UUID
     sender_id: UUID
+    seq: int
     created_at: datetime
     is_deleted: bool
     
@@ -32,4 +47,16 @@ class MessageResponse(MessageBase):
 
 class MessageList(BaseModel):
     items: List[MessageResponse]
-    next_cursor: Optional[str] = None # For pagination (e.g. timestamp or ID of last item)
+    next_cursor: Optional[str] = None # Opaque cursor towards older messages
+    prev_cursor: Optional[str] = None # Opaque cursor towards newer messages
+
+
+class MessageBatchResponse(BaseModel):
+    items: List[MessageResponse] # In the order they were submitted
+
+class MessageSearchResult(MessageResponse):
+    rank: float # Relevance; higher is better (only comparable within one search)
+
+class MessageSearchList(BaseModel):
+    items: List[MessageSearchResult] # Best match first
+    next_cursor: Optional[str] = None # Opaque cursor towards weaker matches
@@ -4,9 +4,11 @@ from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from src.main import app
 from src.database.base_class import Base
-from src.database.session import get_db
+from src.database.session import get_db, get_session_factory
+from src.api.deps import get_read_db, get_read_session_factory
 from src.core.security import get_password_hash
 from src.models.all_models import User
+from src.modules.messages.read_receipts import read_receipt_buffer
 import uuid
 
 # Use SQLite for tests to avoid needing a dedicated Postgres test instance
@@ -49,6 +51,10 @@ async def async_client(db_session: AsyncSession) -> AsyncClient:
         yield db_session
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
+    app.dependency_overrides[get_read_session_factory] = lambda: TestingSessionLocal
+    read_receipt_buffer.session_factory = TestingSessionLocal
     
     from httpx import ASGITransport
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
@@ -75,3 +81,85 @@ async def test_user(db_session: AsyncSession) -> User:
         await db_session.commit()
         await db_session.refresh(user)
     return user
+
+class WebSocketTestSession:
+    """
+    Drives the ASGI app's websocket protocol directly on the test event loop,
+    so the app shares the same loop (and SQLite engine) as the fixtures.
+    """
+    def __init__(self, path: str, query_string: str = ""):
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query_string.encode(),
+            "headers": [],
+            "server": ("test", 80),
+            "client": ("testclient", 50000),
+            "subprotocols": [],
+        }
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+        self.accepted = False
+        self.close_code = None
+        self._task = None
+
+    async def __aenter__(self):
+        await self.incoming.put({"type": "websocket.connect"})
+        self._task = asyncio.create_task(app(self.scope, self.incoming.get, self.outgoing.put))
+        message = await asyncio.wait_for(self.outgoing.get(), timeout=5)
+        if message["type"] == "websocket.accept":
+            self.accepted = True
+        else:
+            self.close_code = message.get("code")
+        return self
+
+    async def send_text(self, text: str):
+        await self.incoming.put({"type": "websocket.receive", "text": text})
+
+    async def receive_text(self, timeout: float = 5) -> str:
+        message = await asyncio.wait_for(self.outgoing.get(), timeout=timeout)
+        if message["type"] == "websocket.close":
+            self.close_code = message.get("code")
+            raise ConnectionError(f"WebSocket closed with code {self.close_code}")
+        return message.get("text") or message.get("bytes").decode()
+
+    async def __aexit__(self, *exc_info):
+        await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, timeout=5)
+
+@pytest.fixture
+def websocket_connect(async_client: AsyncClient):
+    """
+    Returns a factory opening websocket sessions against the app (with the test DB overrides active).
+    """
+    def _connect(path: str, query_string: str = "") -> WebSocketTestSession:
+        return WebSocketTestSession(path, query_string)
+    return _connect
+
+@pytest.fixture
+def user_factory(async_client: AsyncClient, db_session: AsyncSession):
+    """
+    Returns a coroutine creating a fresh user and logging it in.
+    Resolves to (user_id as str, auth headers).
+    """
+    async def _create(password: str = "password123"):
+        username = f"user_{uuid.uuid4().hex[:12]}"
+        user_id = uuid.uuid4()
+        db_session.add(User(
+            id=user_id,
+            email=f"{username}@example.com",
+            username=username,
+            hashed_password=get_password_hash(password)
+        ))
+        await db_session.commit()
+
+        response = await async_client.post(
+            "/api/v1/auth/login/access-token",
+            data={"username": username, "password": password}
+        )
+        return str(user_id), {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return _create
@@ -0,0 +1,154 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from src.core.security import get_password_hash
+from src.models.all_models import User
+
+@pytest.fixture
+async def superuser_headers(async_client: AsyncClient, db_session: AsyncSession):
+    from sqlalchemy import select
+    result = await db_session.execute(select(User).where(User.username == "admin"))
+    if not result.scalars().first():
+        db_session.add(User(
+            email="admin@example.com",
+            username="admin",
+            hashed_password=get_password_hash("password123"),
+            is_superuser=True
+        ))
+        await db_session.commit()
+
+    r = await async_client.post("/api/v1/auth/login/access-token", data={"username": "admin", "password": "password123"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+@pytest.mark.asyncio
+async def test_pool_stats_requires_superuser(async_client: AsyncClient, test_user, superuser_headers):
+    # test_user was expired by the superuser fixture's commit, so log in by its known username
+    r = await async_client.post("/api/v1/auth/login/access-token", data={"username": "testuser", "password": "password123"})
+    user_headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    assert (await async_client.get("/api/v1/admin/db/pool", headers=user_headers)).status_code == 403
+
+    response = await async_client.get("/api/v1/admin/db/pool", headers=superuser_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["pool_class"] == "InstrumentedAsyncQueuePool"
+    assert {"size", "checked_out", "overflow", "checkout_wait"} <= data.keys()
+
+@pytest.mark.asyncio
+async def test_realtime_stats(async_client: AsyncClient, superuser_headers):
+    response = await async_client.get("/api/v1/admin/realtime", headers=superuser_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert {"connections", "queued_frames", "max_queue_depth", "frames_dropped", "evictions"} <= data.keys()
+
+@pytest.mark.asyncio
+async def test_instrumented_pool_records_checkout_waits():
+    from src.database.session import InstrumentedAsyncQueuePool, get_pool_stats
+
+    instrumented = create_async_engine(
+        "sqlite+aiosqlite:///./test.db",
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=1,
+        max_overflow=0
+    )
+    try:
+        async with instrumented.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            assert get_pool_stats(instrumented)["checked_out"] == 1
+        async with instrumented.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+        stats = get_pool_stats(instrumented)
+        assert stats["checked_out"] == 0
+        assert stats["checkout_wait"]["count"] == 2
+        assert stats["timeouts"] == 0
+    finally:
+        await instrumented.dispose()
+
+@pytest.mark.asyncio
+async def test_history_import_loads_ndjson_in_batches(async_client: AsyncClient, superuser_headers, user_factory):
+    import gzip
+    import json
+    import uuid
+    from datetime import datetime, timezone
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    conv_id = str(uuid.uuid4())
+    records = [
+        {"kind": "conversation", "id": conv_id, "title": "Imported", "is_group": True, "creator_id": u1_id, "created_at": "2020-01-01T00:00:00Z"},
+        {"kind": "participant", "conversation_id": conv_id, "user_id": u1_id, "role": "admin", "last_seen_seq": 3},
+        {"kind": "participant", "conversation_id": conv_id, "user_id": u2_id},
+        *[
+            {"kind": "message", "conversation_id": conv_id, "sender_id": u1_id, "content": f"old {i}", "created_at": f"2020-01-01T00:0{i}:00+00:00", **({"seq": 2} if i == 2 else {})}
+            for i in range(1, 6)
+        ],
+        # Deleted just now, so it stays out of the tombstone compactor's reach in other tests
+        {"kind": "message", "conversation_id": conv_id, "sender_id": u1_id, "content": "gone", "is_deleted": True, "created_at": "2020-01-01T00:06:00Z", "deleted_at": datetime.now(timezone.utc).isoformat()},
+        # Explicit sequence numbers that would duplicate one or leave a gap
+        {"kind": "message", "conversation_id": conv_id, "sender_id": u1_id, "seq": 3, "content": "dup", "created_at": "2020-01-01T00:07:00Z"},
+        {"kind": "message", "conversation_id": conv_id, "sender_id": u1_id, "seq": 1000, "content": "jump", "created_at": "2020-01-01T00:08:00Z"},
+        {"kind": "message", "conversation_id": conv_id, "sender_id": str(uuid.uuid4()), "content": "ghost", "created_at": "2020-01-02T00:00:00Z"},
+        {"kind": "message", "conversation_id": conv_id, "content": "no sender"},
+    ]
+    body = "\n".join(json.dumps(r) for r in records) + "\nnot json\n"
+
+    response = await async_client.post(
+        "/api/v1/admin/import",
+        params={"batch_size": 3},
+        files={"file": ("history.ndjson.gz", gzip.compress(body.encode()), "application/gzip")},
+        headers=superuser_headers
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["completed"] is True
+    assert (report["conversations"], report["participants"], report["messages"], report["rejected"]) == (1, 2, 6, 5)
+    assert any("unknown sender_id" in e for e in report["errors"])
+    assert any("seq 3 isn't the next sequence number (7)" in e for e in report["errors"])
+    assert any("seq 1000 isn't the next sequence number (7)" in e for e in report["errors"])
+
+    # Imported history is numbered in file order and counts towards unread (deleted messages don't)
+    listed = (await async_client.get(f"/api/v1/conversations/{conv_id}/messages", headers=h2)).json()["items"]
+    assert [(m["seq"], m["content"]) for m in listed] == [(5, "old 5"), (4, "old 4"), (3, "old 3"), (2, "old 2"), (1, "old 1")]
+    inbox = (await async_client.get("/api/v1/conversations/", headers=h1)).json()
+    assert next(c["unread_count"] for c in inbox if c["id"] == conv_id) == 2
+    inbox = (await async_client.get("/api/v1/conversations/", headers=h2)).json()
+    assert next(c["unread_count"] for c in inbox if c["id"] == conv_id) == 5
+
+    # New messages continue the imported sequence
+    sent = await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": "new"}, headers=h2)
+    assert sent.json()["seq"] == 7
+
+    user_import = await async_client.post("/api/v1/admin/import", files={"file": ("h.ndjson", b"")}, headers=h1)
+    assert user_import.status_code == 403
+
+@pytest.mark.asyncio
+async def test_history_import_reports_a_failed_batch(async_client: AsyncClient, superuser_headers, user_factory):
+    import json
+    import uuid
+    from datetime import datetime, timezone
+    from src.core.ids import uuid7
+
+    u1_id, h1 = await user_factory()
+    conv_id = str(uuid.uuid4())
+    created_at = datetime.now(timezone.utc)
+    message_id = str(uuid7(created_at))
+    records = [
+        {"kind": "conversation", "id": conv_id, "title": "Duplicates", "is_group": True, "creator_id": u1_id},
+        {"kind": "participant", "conversation_id": conv_id, "user_id": u1_id},
+        {"kind": "message", "id": message_id, "conversation_id": conv_id, "sender_id": u1_id, "content": "first", "created_at": created_at.isoformat()},
+        {"kind": "message", "id": message_id, "conversation_id": conv_id, "sender_id": u1_id, "content": "again", "created_at": created_at.isoformat()},
+    ]
+    response = await async_client.post(
+        "/api/v1/admin/import",
+        params={"batch_size": 2},
+        files={"file": ("history.ndjson", "\n".join(json.dumps(r) for r in records).encode(), "application/x-ndjson")},
+        headers=superuser_headers
+    )
+    # A report saying where it stopped, not a 500
+    assert response.status_code == 200
+    report = response.json()
+    assert report["completed"] is False
+    assert (report["conversations"], report["participants"], report["messages"]) == (1, 1, 0)
+    assert report["errors"] and "batch failed" in report["errors"][0]
@@ -45,3 +45,76 @@ async def test_get_current_user_profile(async_client: AsyncClient, test_user):
     data = response.json()
     assert data["email"] == test_user.email
     assert data["username"] == test_user.username
+
+@pytest.mark.asyncio
+async def test_current_user_is_served_from_principal_cache(async_client: AsyncClient, db_session):
+    from sqlalchemy import event
+    from src.core.principal_cache import principal_cache
+    from src.core.security import get_password_hash
+    from src.models.all_models import User
+
+    user = User(email="cached@example.com", username="cacheduser", hashed_password=get_password_hash("password123"))
+    db_session.add(user)
+    await db_session.commit()
+
+    login_response = await async_client.post(
+        "/api/v1/auth/login/access-token",
+        data={"username": "cacheduser", "password": "password123"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    # First request populates the cache
+    assert (await async_client.get("/api/v1/users/me", headers=headers)).status_code == 200
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = db_session.get_bind()
+    event.listen(sync_engine, "before_cursor_execute", count_statements)
+    try:
+        hits_before = principal_cache.hits
+        response = await async_client.get("/api/v1/users/me", headers=headers)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statements)
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "cacheduser"
+    assert principal_cache.hits == hits_before + 1
+    assert statements == []
+
+    # Deactivating the user must drop the cached principal immediately
+    user.is_active = False
+    await db_session.commit()
+
+    response = await async_client.get("/api/v1/users/me", headers=headers)
+    assert response.status_code == 400
+    assert "Inactive user" in response.text
+
+@pytest.mark.asyncio
+async def test_password_hasher_runs_off_loop_and_bounds_pending():
+    import asyncio
+    from fastapi import HTTPException
+    from src.core.hashing import PasswordHasher
+
+    hasher = PasswordHasher(max_workers=2, max_pending=2)
+    try:
+        hashed = await hasher.hash("password123")
+        assert await hasher.verify("password123", hashed)
+        assert not await hasher.verify("wrongpassword", hashed)
+
+        # A third concurrent operation exceeds the pending limit and is rejected instead of queued
+        results = await asyncio.gather(
+            *(hasher.verify("password123", hashed) for _ in range(3)),
+            return_exceptions=True
+        )
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        assert len(rejected) == 1
+        assert rejected[0].status_code == 503
+
+        stats = hasher.stats()
+        assert stats["rejected"] == 1
+        assert stats["pending"] == 0
+        assert stats["verify_latency"]["count"] == 4
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,163 @@
+import pytest
+from httpx import AsyncClient
+
+@pytest.mark.asyncio
+async def test_inbox_keyset_pagination(async_client: AsyncClient, user_factory):
+    owner_id, owner_headers = await user_factory()
+    other_id, _ = await user_factory()
+
+    created = []
+    for i in range(5):
+        r = await async_client.post(
+            "/api/v1/conversations/",
+            json={"title": f"Group {i}", "is_group": True, "participant_ids": [other_id]},
+            headers=owner_headers
+        )
+        created.append(r.json()["id"])
+
+    # Activity in the oldest conversation moves it to the top of the inbox
+    await async_client.post(f"/api/v1/conversations/{created[0]}/messages", json={"content": "bump"}, headers=owner_headers)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = await async_client.get("/api/v1/conversations/", params=params, headers=owner_headers)
+        assert r.status_code == 200
+        seen.extend(c["id"] for c in r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert sorted(seen) == sorted(created)
+    assert len(seen) == len(set(seen))
+    assert seen[0] == created[0]
+
+@pytest.mark.asyncio
+async def test_inbox_rejects_invalid_cursor(async_client: AsyncClient, user_factory):
+    _, headers = await user_factory()
+    r = await async_client.get("/api/v1/conversations/", params={"cursor": "garbage"}, headers=headers)
+    assert r.status_code == 400
+
+@pytest.mark.asyncio
+async def test_direct_chat_is_reused_per_pair(async_client: AsyncClient, user_factory):
+    a_id, a_headers = await user_factory()
+    b_id, b_headers = await user_factory()
+    c_id, _ = await user_factory()
+
+    first = await async_client.post("/api/v1/conversations/", json={"is_group": False, "participant_ids": [b_id]}, headers=a_headers)
+    assert first.status_code == 201
+    direct_id = first.json()["id"]
+
+    # Either side opening the chat again gets the same conversation
+    again = await async_client.post("/api/v1/conversations/", json={"is_group": False, "participant_ids": [b_id]}, headers=a_headers)
+    reverse = await async_client.post("/api/v1/conversations/", json={"is_group": False, "participant_ids": [a_id]}, headers=b_headers)
+    assert again.status_code == reverse.status_code == 200
+    assert again.json()["id"] == reverse.json()["id"] == direct_id
+
+    inbox = (await async_client.get("/api/v1/conversations/", headers=b_headers)).json()
+    assert [c["id"] for c in inbox] == [direct_id]
+
+    # Direct chats keep both members: removing one would leave the pair's key on a one-person chat
+    r = await async_client.post(f"/api/v1/conversations/{direct_id}/participants/remove", json={"participant_ids": [b_id]}, headers=a_headers)
+    assert r.status_code == 400
+    inbox = (await async_client.get("/api/v1/conversations/", headers=b_headers)).json()
+    assert [c["id"] for c in inbox] == [direct_id]
+
+    # Once it becomes a group, the pair can open a new direct chat
+    await async_client.post(f"/api/v1/conversations/{direct_id}/participants", json={"participant_ids": [c_id]}, headers=a_headers)
+    fresh = await async_client.post("/api/v1/conversations/", json={"is_group": False, "participant_ids": [b_id]}, headers=a_headers)
+    assert fresh.status_code == 201
+    assert fresh.json()["id"] != direct_id
+
+@pytest.mark.asyncio
+async def test_bulk_add_and_remove_participants(async_client: AsyncClient, user_factory, monkeypatch):
+    from src.core.config import get_settings
+    monkeypatch.setattr(get_settings(), "PARTICIPANT_BATCH_SIZE", 2)
+
+    owner_id, owner_headers = await user_factory()
+    users = [await user_factory() for _ in range(5)]
+    ids = [user_id for user_id, _ in users]
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Big", "is_group": True, "participant_ids": ids[:1]}, headers=owner_headers)).json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/participants"
+
+    # Existing members and repeated ids are skipped, across chunks
+    r = await async_client.post(url, json={"participant_ids": ids + ids[2:] + [owner_id]}, headers=owner_headers)
+    assert r.status_code == 200 and r.json()["added"] == 4
+
+    r = await async_client.post(f"{url}/remove", json={"participant_ids": ids[:3] + ids[:1]}, headers=owner_headers)
+    assert r.status_code == 200 and r.json()["removed"] == 3
+    assert (await async_client.get("/api/v1/conversations/", headers=users[0][1])).json() == []
+    refused = await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": "hi"}, headers=users[0][1])
+    assert refused.status_code == 403
+    r = await async_client.post(f"{url}/remove", json={"participant_ids": ids[:3]}, headers=owner_headers)
+    assert r.json()["removed"] == 0
+
+    # Messages sent (and deleted) while they were away
+    messages_url = f"/api/v1/conversations/{conv_id}/messages"
+    sent = [(await async_client.post(messages_url, json={"content": f"m{i}"}, headers=owner_headers)).json()["id"] for i in range(3)]
+    assert (await async_client.delete(f"{messages_url}/{sent[0]}", headers=owner_headers)).status_code == 200
+
+    # Adding removed users back restores them, with the chat read up to its latest message
+    r = await async_client.post(url, json={"participant_ids": ids[:2]}, headers=owner_headers)
+    assert r.json()["added"] == 2
+    inbox = (await async_client.get("/api/v1/conversations/", headers=users[0][1])).json()
+    assert [c["id"] for c in inbox] == [conv_id]
+    assert inbox[0]["unread_count"] == 0
+    await async_client.post(messages_url, json={"content": "back"}, headers=owner_headers)
+    inbox = (await async_client.get("/api/v1/conversations/", headers=users[0][1])).json()
+    assert inbox[0]["unread_count"] == 1
+    # Members who never left still see everything as unread (ids[4] joined in the bulk add)
+    inbox = (await async_client.get("/api/v1/conversations/", headers=users[4][1])).json()
+    assert inbox[0]["unread_count"] == 3
+
+    assert (await async_client.post(f"{url}/remove", json={"participant_ids": [owner_id]}, headers=owner_headers)).status_code == 400
+    assert (await async_client.post(f"{url}/remove", json={"participant_ids": ids[:1]}, headers=users[1][1])).status_code == 403
+
+@pytest.mark.asyncio
+async def test_inbox_is_ordered_by_conversation_activity(async_client: AsyncClient, db_session, user_factory):
+    import uuid
+    from datetime import datetime
+    from sqlalchemy.dialects import sqlite
+    from src.modules.conversations.router import build_inbox_query
+
+    owner_id, owner_headers = await user_factory()
+    other_id, other_headers = await user_factory()
+    groups = [
+        (await async_client.post("/api/v1/conversations/", json={"title": f"G{i}", "is_group": True, "participant_ids": [other_id]}, headers=owner_headers)).json()["id"]
+        for i in range(3)
+    ]
+
+    async def inbox(headers):
+        return [c["id"] for c in (await async_client.get("/api/v1/conversations/", headers=headers)).json()]
+
+    assert await inbox(other_headers) == groups[::-1]
+
+    # Sends (single and batched) move the chat up in every active member's inbox
+    await async_client.post(f"/api/v1/conversations/{groups[0]}/messages", json={"content": "a"}, headers=owner_headers)
+    assert await inbox(other_headers) == [groups[0], groups[2], groups[1]]
+    r = await async_client.post("/api/v1/conversations/messages/batch", json={"items": [{"conversation_id": groups[1], "content": "b"}]}, headers=owner_headers)
+    assert r.status_code == 201
+    assert await inbox(other_headers) == [groups[1], groups[0], groups[2]]
+
+    # A member added back gets the chat placed by the activity they missed
+    url = f"/api/v1/conversations/{groups[2]}/participants"
+    await async_client.post(f"{url}/remove", json={"participant_ids": [other_id]}, headers=owner_headers)
+    await async_client.post(f"/api/v1/conversations/{groups[2]}/messages", json={"content": "c"}, headers=owner_headers)
+    assert await inbox(other_headers) == [groups[1], groups[0]]
+    await async_client.post(url, json={"participant_ids": [other_id]}, headers=owner_headers)
+    assert await inbox(other_headers) == [groups[2], groups[1], groups[0]]
+    assert await inbox(owner_headers) == await inbox(other_headers)
+
+    # The user's active chats are found through the participants' inbox index (whichever side the
+    # planner drives the join from), never by scanning participant rows
+    connection = await db_session.connection()
+    for position in (None, (datetime(2026, 1, 1), uuid.uuid4())):
+        query = build_inbox_query(uuid.UUID(other_id), 20, position)
+        compiled = query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+        result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+        plan = " | ".join(row[-1] for row in result.all())
+        assert "INDEX ix_conversation_participants_inbox" in plan, plan
+        assert "SCAN conversation_participants" not in plan, plan
@@ -97,3 +97,818 @@ async def test_conversation_flow_and_messaging(
         headers=h1
     )
     assert len(list_resp2.json()["items"]) == 0
+
+@pytest.mark.asyncio
+async def test_read_db_pins_recent_writers_to_primary(monkeypatch):
+    import uuid
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from src.api import deps
+    from src.api.deps import get_read_db
+    from src.database.session import ReadYourWritesTracker, read_your_writes, engine
+
+    # A replica distinct from the primary, so the two branches can be told apart
+    replica = create_async_engine("sqlite+aiosqlite://")
+    monkeypatch.setattr(deps, "AsyncReadSessionLocal", async_sessionmaker(replica, class_=AsyncSession))
+
+    async def read_bind(user):
+        sessions = get_read_db(current_user=user)
+        session = await sessions.__anext__()
+        bind = session.bind
+        await sessions.aclose()
+        return bind
+
+    writer, reader = User(id=uuid.uuid4()), User(id=uuid.uuid4())
+    await read_your_writes.mark_write(str(writer.id))
+    try:
+        assert await read_bind(writer) is engine
+        assert await read_bind(reader) is replica
+    finally:
+        await replica.dispose()
+
+    tracker = ReadYourWritesTracker(window_seconds=0)
+    await tracker.mark_write(str(writer.id))
+    assert not await tracker.is_pinned(str(writer.id))
+    assert not await tracker.is_pinned("someone-else")
+
+    # Workers share their markers through Redis: a write on one pins reads on another
+    class FakeRedis:
+        def __init__(self):
+            self.keys = {}
+        async def set(self, key, value, px):
+            self.keys[key] = px
+        async def exists(self, key):
+            return int(key in self.keys)
+
+    shared = FakeRedis()
+    worker_a, worker_b = ReadYourWritesTracker(window_seconds=5), ReadYourWritesTracker(window_seconds=5)
+    worker_a.redis_conn = worker_b.redis_conn = shared
+    await worker_a.mark_write(str(writer.id))
+    assert shared.keys == {f"read_your_writes:{writer.id}": 5000}
+    assert await worker_b.is_pinned(str(writer.id))
+    assert not await worker_b.is_pinned(str(reader.id))
+
+@pytest.mark.asyncio
+async def test_unread_count_uses_sequence_numbers(async_client: AsyncClient, user_factory):
+    from src.modules.messages.read_receipts import read_receipt_buffer
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+
+    create_resp = await async_client.post(
+        "/api/v1/conversations/",
+        json={"title": "Seq Chat", "is_group": False, "participant_ids": [u2_id]},
+        headers=h1
+    )
+    conv_id = create_resp.json()["id"]
+
+    sent = []
+    for i in range(5):
+        r = await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": f"m{i}"}, headers=h1)
+        sent.append(r.json())
+    assert [m["seq"] for m in sent] == [1, 2, 3, 4, 5]
+
+    async def unread_for_u2():
+        await read_receipt_buffer.flush()
+        listing = (await async_client.get("/api/v1/conversations/", headers=h2)).json()
+        return next(c["unread_count"] for c in listing if c["id"] == conv_id)
+
+    assert await unread_for_u2() == 5
+
+    # Reading up to the second message leaves three unread
+    await async_client.put(f"/api/v1/conversations/{conv_id}/messages/read", json={"last_seen_message_id": sent[1]["id"]}, headers=h2)
+    assert await unread_for_u2() == 3
+
+    # Deleting an unread message drops it from the count; deleting an already-read one doesn't
+    await async_client.delete(f"/api/v1/conversations/{conv_id}/messages/{sent[3]['id']}", headers=h1)
+    await async_client.delete(f"/api/v1/conversations/{conv_id}/messages/{sent[0]['id']}", headers=h1)
+    assert await unread_for_u2() == 2
+
+    # Moving the read position past a deleted message keeps the count consistent
+    await async_client.put(f"/api/v1/conversations/{conv_id}/messages/read", json={"last_seen_message_id": sent[2]["id"]}, headers=h2)
+    assert await unread_for_u2() == 1
+
+    # A message from another conversation can't be used as a read position
+    missing = await async_client.put(
+        f"/api/v1/conversations/{conv_id}/messages/read",
+        json={"last_seen_message_id": "00000000-0000-0000-0000-000000000000"},
+        headers=h2
+    )
+    assert missing.status_code == 404
+
+@pytest.mark.asyncio
+async def test_send_message_refusals(async_client: AsyncClient, db_session: AsyncSession, user_factory):
+    import uuid
+    from sqlalchemy import update
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    outsider_id, h3 = await user_factory()
+
+    create_resp = await async_client.post(
+        "/api/v1/conversations/",
+        json={"title": "Refusals", "is_group": True, "participant_ids": [u2_id]},
+        headers=h1
+    )
+    conv_id = create_resp.json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    sent = await async_client.post(url, json={"content": "hello"}, headers=h1)
+    assert sent.status_code == 201
+    assert sent.json()["seq"] == 1
+    assert sent.json()["is_deleted"] is False
+
+    missing = await async_client.post(f"/api/v1/conversations/{uuid.uuid4()}/messages", json={"content": "x"}, headers=h1)
+    assert missing.status_code == 404
+
+    outsider = await async_client.post(url, json={"content": "x"}, headers=h3)
+    assert outsider.status_code == 403
+    assert outsider.json()["detail"] == "You are not a participant of this conversation"
+
+    await db_session.execute(
+        update(ConversationParticipant)
+        .where(ConversationParticipant.user_id == uuid.UUID(u2_id))
+        .values(is_active=False)
+    )
+    await db_session.commit()
+    left = await async_client.post(url, json={"content": "x"}, headers=h2)
+    assert left.status_code == 403
+    assert left.json()["detail"] == "You have left this conversation and cannot send messages"
+
+    await db_session.execute(update(Conversation).where(Conversation.id == uuid.UUID(conv_id)).values(is_archived=True))
+    await db_session.commit()
+    archived = await async_client.post(url, json={"content": "x"}, headers=h1)
+    assert archived.status_code == 403
+    assert archived.json()["detail"] == "Cannot send messages to an archived conversation"
+
+    # Refused sends don't consume sequence numbers
+    await db_session.execute(update(Conversation).where(Conversation.id == uuid.UUID(conv_id)).values(is_archived=False))
+    await db_session.commit()
+    again = await async_client.post(url, json={"content": "again"}, headers=h1)
+    assert again.json()["seq"] == 2
+
+def test_fused_send_statement_shape_on_postgres():
+    import re
+    import uuid
+    from datetime import datetime, timezone
+    from sqlalchemy.dialects import postgresql
+    from src.modules.messages.repository import MessageRepository
+
+    stmt = MessageRepository(None).build_fused_insert(
+        str(uuid.uuid4()), str(uuid.uuid4()), "hi", "text", None, uuid.uuid4(), datetime.now(timezone.utc)
+    )
+    sql = re.sub(r"\s+", " ", str(stmt.compile(dialect=postgresql.dialect())))
+
+    # The membership/archive check gates the sequence bump, which gates the insert: a refused send
+    # matches no row and changes nothing
+    assert sql.startswith("WITH member AS (SELECT conversation_participants.conversation_id"), sql
+    member = sql[:sql.index("bump AS")]
+    assert "conversation_participants.is_active = true" in member and "conversations.is_archived = false" in member
+    assert re.search(r"bump AS \(UPDATE conversations SET last_seq=\(conversations.last_seq \+ \S+\).* "
+                     r"WHERE conversations.id IN \(SELECT member.conversation_id FROM member\) "
+                     r"RETURNING conversations.id, conversations.last_seq\)", sql), sql
+    # One conversation row is written per send, whatever the size of the group
+    assert "UPDATE conversation_participants" not in sql
+    insert = sql[sql.index(" INSERT INTO messages"):]
+    assert insert.startswith(" INSERT INTO messages (id, conversation_id, sender_id, seq, content, message_type, media_url, is_deleted, created_at) SELECT ")
+    assert "bump.id" in insert and "bump.last_seq" in insert and " FROM bump RETURNING messages.id," in insert
+    assert insert.endswith(") AS participant_ids") and "array_agg(conversation_participants.user_id)" in insert
+    assert "conversation_participants.is_active = true) AS participant_ids" in insert
+
+@pytest.mark.asyncio
+async def test_membership_cache_versioning_and_bounds():
+    from src.core.membership_cache import MembershipCache
+
+    cache = MembershipCache(max_members=3, ttl_seconds=60)
+
+    # A fill that raced with an invalidation is discarded
+    version = cache.version("c1")
+    cache.invalidate("c1")
+    cache.set("c1", {"u1": True}, version)
+    assert cache.get("c1") is None
+    assert cache.stale_fills == 1
+
+    cache.set("c1", {"u1": True, "u2": True}, cache.version("c1"))
+    assert cache.get("c1") == {"u1": True, "u2": True}
+
+    # Memory is bounded by total members: adding two more evicts the least recently used conversation
+    cache.set("c2", {"u3": True, "u4": False}, cache.version("c2"))
+    assert cache.get("c1") is None
+    assert cache.get("c2") == {"u3": True, "u4": False}
+    assert cache.stats()["members"] == 2
+
+    # Conversations bigger than the whole budget are never cached
+    cache.set("big", {f"u{i}": True for i in range(4)}, cache.version("big"))
+    assert cache.get("big") is None
+
+    # Forgetting old version counters voids every fill in flight
+    small = MembershipCache(max_members=10, ttl_seconds=60, max_versions=1)
+    version = small.version("c3")
+    small.invalidate("a")
+    small.invalidate("b")
+    small.set("c3", {"u1": True}, version)
+    assert small.get("c3") is None
+
+@pytest.mark.asyncio
+async def test_added_participant_is_not_refused_by_cached_membership(async_client: AsyncClient, user_factory):
+    from src.core.membership_cache import membership_cache
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+
+    create_resp = await async_client.post(
+        "/api/v1/conversations/",
+        json={"title": "Cached", "is_group": True, "participant_ids": []},
+        headers=h1
+    )
+    conv_id = create_resp.json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    # Both lookups are served from one cached member set
+    assert (await async_client.get(url, headers=h1)).status_code == 200
+    assert (await async_client.get(url, headers=h2)).status_code == 403
+    assert membership_cache.get(conv_id) == {u1_id: True}
+
+    await async_client.post(f"/api/v1/conversations/{conv_id}/participants", json={"participant_ids": [u2_id]}, headers=h1)
+    assert membership_cache.get(conv_id) is None
+    assert (await async_client.get(url, headers=h2)).status_code == 200
+
+@pytest.mark.asyncio
+async def test_message_cursors_page_both_ways_and_around(async_client: AsyncClient, db_session: AsyncSession, user_factory):
+    import uuid
+    from datetime import datetime, timezone
+    from sqlalchemy import update
+
+    u1_id, h1 = await user_factory()
+    create_resp = await async_client.post(
+        "/api/v1/conversations/",
+        json={"title": "Paging", "is_group": True, "participant_ids": []},
+        headers=h1
+    )
+    conv_id = create_resp.json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    ids = []
+    for i in range(7):
+        r = await async_client.post(url, json={"content": f"m{i}"}, headers=h1)
+        ids.append(r.json()["id"])
+    # Identical timestamps must neither drop nor repeat messages across pages
+    # (kept within a second of sending so the ids' embedded creation time stays accurate)
+    await db_session.execute(
+        update(Message).where(Message.conversation_id == uuid.UUID(conv_id)).values(created_at=datetime.now(timezone.utc).replace(microsecond=0))
+    )
+    await db_session.commit()
+    expected = sorted(ids, reverse=True)
+
+    seen, pages, cursor = [], [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = (await async_client.get(url, params=params, headers=h1)).json()
+        pages.append(page)
+        seen += [m["id"] for m in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == expected
+    assert pages[0]["prev_cursor"] is None
+
+    # Paging back towards newer messages from the last page returns the previous page
+    back = (await async_client.get(url, params={"limit": 3, "cursor": pages[-1]["prev_cursor"]}, headers=h1)).json()
+    assert [m["id"] for m in back["items"]] == [m["id"] for m in pages[-2]["items"]]
+
+    head = (await async_client.get(url, params={"limit": 3, "cursor": pages[1]["prev_cursor"]}, headers=h1)).json()
+    assert [m["id"] for m in head["items"]] == expected[:3]
+    assert head["prev_cursor"] is None
+
+    around = (await async_client.get(url, params={"limit": 3, "around": expected[3]}, headers=h1)).json()
+    assert [m["id"] for m in around["items"]] == expected[2:5]
+    assert around["next_cursor"] and around["prev_cursor"]
+
+    # Tampered and foreign cursors are rejected rather than ignored
+    body, _, signature = pages[0]["next_cursor"].partition(".")
+    tampered = await async_client.get(url, params={"cursor": f"{body}x.{signature}"}, headers=h1)
+    assert tampered.status_code == 400
+    legacy = await async_client.get(url, params={"cursor": "2026-01-01T12:00:00"}, headers=h1)
+    assert legacy.status_code == 400
+
+    other = (await async_client.post("/api/v1/conversations/", json={"title": "Other", "is_group": True, "participant_ids": []}, headers=h1)).json()
+    foreign = await async_client.get(f"/api/v1/conversations/{other['id']}/messages", params={"cursor": pages[0]["next_cursor"]}, headers=h1)
+    assert foreign.status_code == 400
+
+@pytest.mark.asyncio
+async def test_message_page_queries_use_pagination_index(db_session: AsyncSession):
+    import uuid
+    from datetime import datetime
+    from sqlalchemy.dialects import sqlite
+    from src.modules.messages.repository import MessageRepository
+
+    repo = MessageRepository(db_session)
+    conv_id = str(uuid.uuid4())
+    position = (datetime(2026, 1, 1), uuid.uuid4())
+    for position_, newer in [(None, False), (position, False), (position, True)]:
+        query, params = repo.build_page_query(conv_id, 20, position_, newer)
+        compiled = query.params(params).compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+        connection = await db_session.connection()
+        result = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+        plan = " | ".join(row[-1] for row in result.all())
+        assert "SEARCH messages USING INDEX ix_messages_conversation_id_created_at_desc" in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
+        if position_ is not None:
+            assert "(created_at,id)" in plan, plan
+
+@pytest.mark.asyncio
+async def test_removed_members_get_no_frames(async_client: AsyncClient, user_factory, monkeypatch):
+    import asyncio
+    import orjson
+    from src.core.connection_manager import ConnectionManager
+    from src.core.pubsub import pubsub_manager
+
+    class FakeSocket:
+        def __init__(self):
+            self.frames = []
+        async def accept(self):
+            pass
+        async def send_text(self, frame):
+            self.frames.append(frame)
+
+    # Every publish is delivered straight to the sockets connected to a local manager
+    local = ConnectionManager()
+    async def deliver(message_data, participant_ids):
+        local.send_text_to_users(orjson.dumps(message_data).decode(), participant_ids)
+    monkeypatch.setattr(pubsub_manager, "publish_message", deliver)
+
+    owner_id, owner_headers = await user_factory()
+    stay_id, _ = await user_factory()
+    gone_id, _ = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Fan-out", "is_group": True, "participant_ids": [stay_id, gone_id]}, headers=owner_headers)).json()["id"]
+    r = await async_client.post(f"/api/v1/conversations/{conv_id}/participants/remove", json={"participant_ids": [gone_id]}, headers=owner_headers)
+    assert r.json()["removed"] == 1
+
+    stay, gone = FakeSocket(), FakeSocket()
+    await local.connect(stay_id, stay)
+    await local.connect(gone_id, gone)
+
+    url = f"/api/v1/conversations/{conv_id}/messages"
+    message = (await async_client.post(url, json={"content": "single"}, headers=owner_headers)).json()
+    r = await async_client.post("/api/v1/conversations/messages/batch", json={"items": [{"conversation_id": conv_id, "content": "batch"}]}, headers=owner_headers)
+    assert r.status_code == 201
+    assert (await async_client.delete(f"{url}/{message['id']}", headers=owner_headers)).status_code == 200
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert len(stay.frames) == 3
+    assert gone.frames == []
+    local.disconnect(stay_id, stay)
+    local.disconnect(gone_id, gone)
+
+@pytest.mark.asyncio
+async def test_batch_send_spans_conversations_and_publishes_once_each(async_client: AsyncClient, user_factory, monkeypatch):
+    from src.core.pubsub import pubsub_manager
+
+    published = []
+    async def record(message_data, participant_ids):
+        published.append((message_data, sorted(participant_ids)))
+    monkeypatch.setattr(pubsub_manager, "publish_message", record)
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    conv_a = (await async_client.post("/api/v1/conversations/", json={"title": "A", "is_group": True, "participant_ids": [u2_id]}, headers=h1)).json()["id"]
+    conv_b = (await async_client.post("/api/v1/conversations/", json={"title": "B", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    await async_client.post(f"/api/v1/conversations/{conv_a}/messages", json={"content": "before"}, headers=h1)
+    published.clear()
+
+    items = [
+        {"conversation_id": conv_a, "content": "a1"},
+        {"conversation_id": conv_b, "content": "b1"},
+        {"conversation_id": conv_a, "content": "a2"},
+        {"conversation_id": conv_a, "content": "a3", "message_type": "image", "media_url": "/media/x.png"},
+    ]
+    r = await async_client.post("/api/v1/conversations/messages/batch", json={"items": items}, headers=h1)
+    assert r.status_code == 201
+    sent = r.json()["items"]
+    assert [m["content"] for m in sent] == ["a1", "b1", "a2", "a3"]
+    assert [m["seq"] for m in sent] == [2, 1, 3, 4]
+    assert sent[3]["media_url"] == "/media/x.png"
+
+    # Listing shows the batch in submitted order
+    listed = (await async_client.get(f"/api/v1/conversations/{conv_a}/messages", headers=h1)).json()["items"]
+    assert [m["content"] for m in listed] == ["a3", "a2", "a1", "before"]
+
+    assert len(published) == 2
+    events = {event["conversation_id"]: (event, pids) for event, pids in published}
+    assert events[conv_a][0]["event_type"] == "message_batch"
+    assert [m["content"] for m in events[conv_a][0]["messages"]] == ["a1", "a2", "a3"]
+    assert events[conv_a][1] == sorted([u1_id, u2_id])
+    assert events[conv_b][1] == [u1_id]
+
+    # A conversation the sender can't post to fails the whole batch
+    refused = await async_client.post(
+        "/api/v1/conversations/messages/batch",
+        json={"items": [{"conversation_id": conv_a, "content": "a4"}, {"conversation_id": conv_b, "content": "b2"}]},
+        headers=h2
+    )
+    assert refused.status_code == 403
+    assert conv_b in refused.json()["detail"]
+    listed = (await async_client.get(f"/api/v1/conversations/{conv_a}/messages", headers=h1)).json()["items"]
+    assert listed[0]["content"] == "a3"
+
+    empty = await async_client.post("/api/v1/conversations/messages/batch", json={"items": []}, headers=h1)
+    assert empty.status_code == 422
+
+@pytest.mark.asyncio
+async def test_batch_send_rechecks_membership_under_the_lock(async_client: AsyncClient, db_session: AsyncSession, user_factory, monkeypatch):
+    import uuid
+    from sqlalchemy import update
+    from src.modules.messages.repository import MessageRepository
+
+    # States read before a removal/archive committed: step 2 lets the batch through
+    async def stale(self, conversation_ids, user_id):
+        return {cid: (False, True) for cid in conversation_ids}
+    monkeypatch.setattr(MessageRepository, "get_send_states", stale)
+
+    owner_id, owner_headers = await user_factory()
+    gone_id, gone_headers = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Lock", "is_group": True, "participant_ids": [gone_id]}, headers=owner_headers)).json()["id"]
+    other_id = (await async_client.post("/api/v1/conversations/", json={"title": "Other", "is_group": True, "participant_ids": []}, headers=owner_headers)).json()["id"]
+    await async_client.post(f"/api/v1/conversations/{conv_id}/participants/remove", json={"participant_ids": [gone_id]}, headers=owner_headers)
+
+    batch = "/api/v1/conversations/messages/batch"
+    r = await async_client.post(batch, json={"items": [{"conversation_id": conv_id, "content": "late"}]}, headers=gone_headers)
+    assert r.status_code == 403
+    assert conv_id in r.json()["detail"]
+
+    await db_session.execute(update(Conversation).where(Conversation.id == uuid.UUID(conv_id)).values(is_archived=True))
+    await db_session.commit()
+    # The other conversation's reservation is rolled back with the refused one
+    r = await async_client.post(
+        batch,
+        json={"items": [{"conversation_id": other_id, "content": "o1"}, {"conversation_id": conv_id, "content": "archived"}]},
+        headers=owner_headers
+    )
+    assert r.status_code == 403
+    assert "archived" in r.json()["detail"]
+
+    # No sequence number was consumed
+    sent = (await async_client.post(f"/api/v1/conversations/{other_id}/messages", json={"content": "o1"}, headers=owner_headers)).json()
+    assert sent["seq"] == 1
+    assert (await async_client.get(f"/api/v1/conversations/{conv_id}/messages", headers=owner_headers)).json()["items"] == []
+
+@pytest.mark.asyncio
+async def test_export_streams_full_history_as_ndjson(async_client: AsyncClient, user_factory, monkeypatch):
+    import gzip
+    import json
+    from src.modules.messages import service
+
+    # Tiny chunks so the export crosses several chunk (and gzip block) boundaries
+    monkeypatch.setattr(service, "EXPORT_CHUNK_SIZE", 200)
+
+    u1_id, h1 = await user_factory()
+    outsider_id, h3 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Export", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    ids = []
+    for i in range(12):
+        ids.append((await async_client.post(url, json={"content": f"line {i}"}, headers=h1)).json()["id"])
+    await async_client.delete(f"{url}/{ids[4]}", headers=h1)
+
+    async with async_client.stream("GET", f"{url}/export", headers=h1) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        chunks = [chunk async for chunk in response.aiter_raw()]
+    exported = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert [m["content"] for m in exported] == [f"line {i}" for i in range(12) if i != 4]
+    assert [m["seq"] for m in exported] == [i + 1 for i in range(12) if i != 4]
+
+    compressed = await async_client.get(f"{url}/export", params={"gzip": True}, headers=h1)
+    assert compressed.headers["content-disposition"].endswith('.ndjson.gz"')
+    assert gzip.decompress(compressed.content).splitlines() == b"".join(chunks).splitlines()
+
+    assert (await async_client.get(f"{url}/export", headers=h3)).status_code == 403
+
+@pytest.mark.asyncio
+async def test_message_ids_embed_creation_time_for_partition_pruning(async_client: AsyncClient, db_session: AsyncSession, user_factory):
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from src.core.ids import uuid7, uuid7_time
+    from src.database.partitions import add_months, ensure_partitions, month_start, partition_name
+
+    at = datetime(2026, 3, 15, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    assert uuid7(at).version == 7
+    assert uuid7_time(uuid7(at)) == at.replace(microsecond=123000)
+    assert uuid7(at) < uuid7(at + timedelta(milliseconds=1))
+    assert uuid7_time(uuid.uuid4()) is None
+
+    assert month_start(at) == datetime(2026, 3, 1, tzinfo=timezone.utc)
+    assert add_months(month_start(at), 10) == datetime(2027, 1, 1, tzinfo=timezone.utc)
+    assert add_months(month_start(at), -3) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+    assert partition_name(datetime(2027, 1, 1, tzinfo=timezone.utc)) == "messages_y2027m01"
+
+    # Unpartitioned backends have nothing to maintain
+    assert await ensure_partitions(await db_session.connection(), at, add_months(at, 3)) == []
+
+    u1_id, h1 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Ids", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    sent = (await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": "hi"}, headers=h1)).json()
+    batch = (await async_client.post("/api/v1/conversations/messages/batch", json={"items": [
+        {"conversation_id": conv_id, "content": "a"}, {"conversation_id": conv_id, "content": "b"}
+    ]}, headers=h1)).json()["items"]
+
+    for message in [sent] + batch:
+        embedded = uuid7_time(uuid.UUID(message["id"]))
+        created_at = datetime.fromisoformat(message["created_at"]).replace(tzinfo=timezone.utc)
+        assert abs(embedded - created_at) < timedelta(milliseconds=1)
+
+    # Lookups by id (bounded to the embedded time) still find the message
+    read = await async_client.put(f"/api/v1/conversations/{conv_id}/messages/read", json={"last_seen_message_id": batch[-1]["id"]}, headers=h1)
+    assert read.status_code == 200
+
+@pytest.mark.asyncio
+async def test_search_is_ranked_paged_and_scoped_to_membership(async_client: AsyncClient, user_factory):
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+
+    async def conversation(headers, title):
+        return (await async_client.post("/api/v1/conversations/", json={"title": title, "is_group": True, "participant_ids": []}, headers=headers)).json()["id"]
+
+    async def send(conv_id, headers, content):
+        return (await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": content}, headers=headers)).json()["id"]
+
+    mine = await conversation(h1, "Mine")
+    theirs = await conversation(h2, "Theirs")
+    strong = await send(mine, h1, "Rocket launch: the rocket is on the pad, rocket fuel loaded")
+    weak = await send(mine, h1, "Is the launch still on? Rocket looked fine")
+    await send(mine, h1, "Lunch anyone?")
+    deleted = await send(mine, h1, "rocket launch codes")
+    await async_client.delete(f"/api/v1/conversations/{mine}/messages/{deleted}", headers=h1)
+    await send(theirs, h2, "rocket launch party")
+
+    url = "/api/v1/conversations/messages/search"
+    seen, cursor = [], None
+    while True:
+        params = {"q": "Rocket LAUNCH!", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        page = (await async_client.get(url, params=params, headers=h1)).json()
+        seen += page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    # Deleted messages and conversations the user isn't in never match; stronger matches come first
+    assert [m["id"] for m in seen] == [strong, weak]
+    assert seen[0]["rank"] > seen[1]["rank"]
+
+    # Every word must match; punctuation-only queries match nothing
+    assert (await async_client.get(url, params={"q": "rocket lunch"}, headers=h1)).json()["items"] == []
+    assert (await async_client.get(url, params={"q": "\"*:&"}, headers=h1)).json()["items"] == []
+
+    scoped = await async_client.get(url, params={"q": "rocket", "conversation_id": theirs}, headers=h2)
+    assert [m["conversation_id"] for m in scoped.json()["items"]] == [theirs]
+    assert (await async_client.get(url, params={"q": "rocket", "conversation_id": theirs}, headers=h1)).status_code == 403
+
+    # A cursor only continues the search it was issued for
+    first = (await async_client.get(url, params={"q": "rocket", "limit": 1}, headers=h1)).json()
+    reused = await async_client.get(url, params={"q": "launch", "cursor": first["next_cursor"]}, headers=h1)
+    assert reused.status_code == 400
+
+@pytest.mark.asyncio
+async def test_read_receipts_are_coalesced_and_written_behind(async_client: AsyncClient, db_session: AsyncSession, user_factory):
+    import uuid
+    from sqlalchemy import select
+    from src.database.session import read_your_writes
+    from src.modules.messages.read_receipts import read_receipt_buffer
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Receipts", "is_group": False, "participant_ids": [u2_id]}, headers=h1)).json()["id"]
+    sent = [(await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": f"m{i}"}, headers=h1)).json() for i in range(4)]
+    await read_receipt_buffer.flush()
+
+    async def read(message):
+        r = await async_client.put(f"/api/v1/conversations/{conv_id}/messages/read", json={"last_seen_message_id": message["id"]}, headers=h2)
+        assert r.status_code == 200
+
+    async def stored_position():
+        result = await db_session.execute(
+            select(ConversationParticipant.last_seen_seq, ConversationParticipant.last_seen_message_id)
+            .where(ConversationParticipant.conversation_id == uuid.UUID(conv_id), ConversationParticipant.user_id == uuid.UUID(u2_id))
+        )
+        seq, message_id = result.one()
+        return seq, str(message_id) if message_id else None
+
+    async def unread():
+        listing = (await async_client.get("/api/v1/conversations/", headers=h2)).json()
+        return next(c["unread_count"] for c in listing if c["id"] == conv_id)
+
+    # Only the newest position is kept, moving backwards is ignored, and nothing is written yet
+    await read(sent[1])
+    await read(sent[2])
+    await read(sent[0])
+    assert len(read_receipt_buffer) == 1
+    assert read_receipt_buffer.pending_seq(u2_id, conv_id) == 3
+    assert await stored_position() == (0, None)
+    # ...but the inbox already reflects the buffered position
+    assert await unread() == 1
+
+    assert await read_receipt_buffer.flush() == 1
+    assert await stored_position() == (3, sent[2]["id"])
+    assert await unread() == 1
+    # Flushed receipts don't pin the reader to the primary
+    assert not await read_your_writes.is_pinned(u2_id)
+
+    # A buffered position behind the stored one never moves it back
+    await read(sent[1])
+    await read_receipt_buffer.flush()
+    assert await stored_position() == (3, sent[2]["id"])
+
+    # With the buffer full, receipts are written directly, counting the deleted messages past them
+    later = [(await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": f"m{i}"}, headers=h1)).json() for i in (4, 5)]
+    assert (await async_client.delete(f"/api/v1/conversations/{conv_id}/messages/{later[0]['id']}", headers=h1)).status_code == 200
+    max_pending = read_receipt_buffer.max_pending
+    read_receipt_buffer.max_pending = 0
+    try:
+        await read(sent[3])
+    finally:
+        read_receipt_buffer.max_pending = max_pending
+    assert len(read_receipt_buffer) == 0
+    assert await stored_position() == (4, sent[3]["id"])
+    deleted_unread = await db_session.scalar(
+        select(ConversationParticipant.deleted_unread_count)
+        .where(ConversationParticipant.conversation_id == uuid.UUID(conv_id), ConversationParticipant.user_id == uuid.UUID(u2_id))
+    )
+    assert deleted_unread == 1
+    assert await unread() == 1
+
+@pytest.mark.asyncio
+async def test_tombstone_compaction_clears_old_deleted_messages(async_client: AsyncClient, db_session: AsyncSession, user_factory, tmp_path):
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from sqlalchemy import select, update
+    from src.modules.media.local_storage import LocalFileStorage
+    from src.modules.messages.compaction import TombstoneCompactor
+    from conftest import TestingSessionLocal
+
+    u1_id, h1 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Tombstones", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    async def send(content, media_url=None):
+        return (await async_client.post(url, json={"content": content, "message_type": "image" if media_url else "text", "media_url": media_url}, headers=h1)).json()["id"]
+
+    media_dir = tmp_path / "media"
+    media_dir.mkdir()
+    # Keys shaped like the ones LocalFileStorage.upload issues
+    shared_key, solo_key = f"{uuid.uuid4()}.png", f"{uuid.uuid4()}.png"
+    for name in (shared_key, solo_key):
+        (media_dir / name).write_bytes(b"img")
+    # media_url is whatever the client sends: files it names but the storage never issued stay
+    (tmp_path / "secret.env").write_bytes(b"SECRET")
+    (media_dir / "notes.txt").write_bytes(b"notes")
+    shared_deleted = await send("a", shared_key)
+    shared_kept = await send("b", shared_key)
+    solo = await send("c", solo_key)
+    text_only = await send("d")
+    recent = await send("e")
+    traversal = await send("f", "../secret.env")
+    absolute = await send("g", str(tmp_path / "secret.env"))
+    unissued = await send("h", "notes.txt")
+    for message_id in (shared_deleted, solo, text_only, recent, traversal, absolute, unissued):
+        await async_client.delete(f"{url}/{message_id}", headers=h1)
+
+    # Everything but `recent` was deleted before the grace period
+    await db_session.execute(
+        update(Message)
+        .where(Message.id.in_([uuid.UUID(i) for i in (shared_deleted, solo, text_only, traversal, absolute, unissued)]))
+        .values(deleted_at=datetime.now(timezone.utc) - timedelta(hours=2))
+    )
+    await db_session.commit()
+
+    storage = LocalFileStorage(str(media_dir))
+    compactor = TombstoneCompactor(TestingSessionLocal, storage, grace_seconds=3600, batch_size=2, pause_seconds=0)
+    assert await compactor.compact() == 6
+    assert await compactor.compact() == 0
+    assert (tmp_path / "secret.env").read_bytes() == b"SECRET"
+    assert (media_dir / "notes.txt").exists()
+    # The storage itself refuses keys resolving outside its directory
+    for key in ("../secret.env", str(tmp_path / "secret.env"), "sub/../../secret.env"):
+        with pytest.raises(ValueError):
+            await storage.delete(key)
+    assert (tmp_path / "secret.env").exists()
+
+    result = await db_session.execute(select(Message.id, Message.content, Message.media_url).where(Message.conversation_id == uuid.UUID(conv_id)))
+    rows = {str(i): (content, media_url) for i, content, media_url in result.all()}
+    assert rows[shared_deleted] == rows[solo] == rows[text_only] == (None, None)
+    assert rows[recent] == ("e", None)
+    assert rows[shared_kept] == ("b", shared_key)
+    # Attachments go once no message references them
+    assert (media_dir / shared_key).exists()
+    assert not (media_dir / solo_key).exists()
+
+    # Live messages page as before
+    page = (await async_client.get(url, headers=h1)).json()
+    assert [m["id"] for m in page["items"]] == [shared_kept]
+
+@pytest.mark.asyncio
+async def test_hot_queries_hit_the_compiled_cache(async_client: AsyncClient, db_session: AsyncSession, user_factory):
+    import uuid
+    from datetime import datetime, timezone
+    from sqlalchemy import event
+    from sqlalchemy.engine.default import CACHE_HIT
+    from conftest import engine
+    from src.core.membership_cache import membership_cache
+    from src.core.principal_cache import principal_cache
+    from src.modules.auth.basic_provider import BasicAuthProvider
+    from src.modules.messages.repository import MessageRepository
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Cache", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    sent = [(await async_client.post(f"/api/v1/conversations/{conv_id}/messages", json={"content": f"m{i}"}, headers=h1)).json() for i in range(3)]
+    repo = MessageRepository(db_session)
+    auth = BasicAuthProvider(db_session)
+
+    executions = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executions.append(context.cache_hit)
+    event.listen(engine.sync_engine, "after_cursor_execute", record)
+    try:
+        async def cache_hit(call) -> bool:
+            executions.clear()
+            await call()
+            return executions == [CACHE_HIT]
+
+        # Warm up each query once, then expect every later call (with other parameters) to hit the cache
+        assert await repo.get_participant(conv_id, u1_id) is not None
+        assert await cache_hit(lambda: repo.get_participant(conv_id, u2_id))
+        assert await repo.get_participant(conv_id, u2_id) is None
+
+        membership_cache.clear()
+        await repo.get_active_participant_ids(conv_id)
+        membership_cache.clear()
+        assert await cache_hit(lambda: repo.get_active_participant_ids(conv_id))
+
+        position = (datetime.fromisoformat(sent[1]["created_at"]).replace(tzinfo=timezone.utc), uuid.UUID(sent[1]["id"]))
+        await repo.get_messages_page(conv_id, 10, position)
+        assert await cache_hit(lambda: repo.get_messages_page(conv_id, 5, (position[0], uuid.UUID(sent[2]["id"]))))
+        older = await repo.get_messages_page(conv_id, 10, position)
+        assert [str(m.id) for m in older] == [sent[0]["id"]]
+        newer = await repo.get_messages_page(conv_id, 10, position, newer=True)
+        assert [str(m.id) for m in newer] == [sent[2]["id"]]
+
+        for headers in (h1, h2):
+            principal_cache.clear()
+            token = headers["Authorization"].split()[1]
+            if headers is h2:
+                assert await cache_hit(lambda: auth.get_current_user(token))
+            else:
+                await auth.get_current_user(token)
+        assert str((await auth.get_current_user(token)).id) == u2_id
+    finally:
+        event.remove(engine.sync_engine, "after_cursor_execute", record)
+
+@pytest.mark.asyncio
+async def test_retried_send_with_idempotency_key_returns_original_message(async_client: AsyncClient, user_factory, monkeypatch):
+    from src.core.pubsub import pubsub_manager
+    from src.modules.messages.idempotency import idempotency_cache
+
+    published = []
+    async def record(message_data, participant_ids):
+        published.append(message_data)
+    monkeypatch.setattr(pubsub_manager, "publish_message", record)
+
+    u1_id, h1 = await user_factory()
+    u2_id, h2 = await user_factory()
+    conv_id = (await async_client.post("/api/v1/conversations/", json={"title": "Retry", "is_group": True, "participant_ids": [u2_id]}, headers=h1)).json()["id"]
+    other_id = (await async_client.post("/api/v1/conversations/", json={"title": "Other", "is_group": True, "participant_ids": []}, headers=h1)).json()["id"]
+    url = f"/api/v1/conversations/{conv_id}/messages"
+
+    first = await async_client.post(url, json={"content": "hello"}, headers={**h1, "Idempotency-Key": "k1"})
+    assert first.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+
+    # Answered from the in-process cache, then (after an eviction) from the key table
+    for _ in range(2):
+        retry = await async_client.post(url, json={"content": "hello"}, headers={**h1, "Idempotency-Key": "k1"})
+        assert retry.status_code == 201
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json()
+        idempotency_cache.clear()
+
+    # The key may also travel in the body
+    by_body = await async_client.post(url, json={"content": "again", "client_message_id": "k1"}, headers=h1)
+    assert by_body.json()["id"] == first.json()["id"]
+    mismatch = await async_client.post(url, json={"content": "x", "client_message_id": "k2"}, headers={**h1, "Idempotency-Key": "k1"})
+    assert mismatch.status_code == 400
+
+    # Keys are per conversation send: reusing one elsewhere is an error, a new key is a new message
+    reused = await async_client.post(f"/api/v1/conversations/{other_id}/messages", json={"content": "hello"}, headers={**h1, "Idempotency-Key": "k1"})
+    assert reused.status_code == 422
+    second = await async_client.post(url, json={"content": "hello"}, headers={**h1, "Idempotency-Key": "k2"})
+    assert second.status_code == 201 and second.json()["id"] != first.json()["id"]
+
+    # Keys are scoped to their sender
+    theirs = await async_client.post(url, json={"content": "hello"}, headers={**h2, "Idempotency-Key": "k1"})
+    assert theirs.status_code == 201 and "Idempotent-Replayed" not in theirs.headers
+
+    page = (await async_client.get(url, headers=h1)).json()
+    assert [m["id"] for m in page["items"]] == [theirs.json()["id"], second.json()["id"], first.json()["id"]]
+    assert [p["id"] for p in published] == [first.json()["id"], second.json()["id"], theirs.json()["id"]]
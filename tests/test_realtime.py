@@ -0,0 +1,360 @@
+import asyncio
+import pytest
+from contextlib import AsyncExitStack
+from httpx import AsyncClient
+from src.main import app
+from src.database.session import get_db
+from conftest import engine, TestingSessionLocal
+
+@pytest.mark.asyncio
+async def test_websocket_auth_rejects_invalid_token(websocket_connect):
+    async with websocket_connect("/ws", "token=not-a-jwt") as ws:
+        assert not ws.accepted
+        assert ws.close_code == 1008
+
+@pytest.mark.asyncio
+async def test_open_websockets_hold_no_pooled_connections(async_client: AsyncClient, test_user, websocket_connect):
+    from src.core.principal_cache import principal_cache
+
+    # Like the real get_db: one pooled session per request, closed on teardown
+    async def per_request_db():
+        async with TestingSessionLocal() as session:
+            yield session
+    app.dependency_overrides[get_db] = per_request_db
+
+    login_response = await async_client.post(
+        "/api/v1/auth/login/access-token",
+        data={"username": test_user.username, "password": "password123"}
+    )
+    token = login_response.json()["access_token"]
+
+    pool = engine.sync_engine.pool
+    baseline = pool.checkedout()
+
+    async with AsyncExitStack() as stack:
+        sockets = []
+        for _ in range(5):
+            # Force every handshake through the database rather than the principal cache
+            principal_cache.clear()
+            misses_before = principal_cache.misses
+            ws = await stack.enter_async_context(websocket_connect("/ws", f"token={token}"))
+            assert ws.accepted
+            assert principal_cache.misses == misses_before + 1
+            sockets.append(ws)
+
+        # All sockets are live and serving their receive loops...
+        for ws in sockets:
+            await ws.send_text("ping")
+            assert await ws.receive_text() == "pong"
+
+        # ...yet none of them keeps a connection checked out of the pool
+        assert pool.checkedout() == baseline
+
+@pytest.mark.asyncio
+async def test_fan_out_forwards_one_pre_encoded_frame():
+    import json
+    from src.core.connection_manager import manager
+    from src.core.pubsub import RedisPubSubManager, encode_event, decode_event
+
+    class FakeSocket:
+        def __init__(self):
+            self.frames = []
+        async def accept(self):
+            pass
+        async def send_text(self, frame):
+            self.frames.append(frame)
+        async def send_json(self, data):
+            raise AssertionError("frames must not be re-encoded per socket")
+
+    message = {"id": "m1", "content": "héllo, \"world\"", "data": {"nested": [1, 2]}}
+    frame = json.dumps(message)
+    raw = encode_event({"type": "new_message", "participant_ids": ["u1", "u2", "u3"]}, frame)
+    # Still plain JSON for readers decoding the whole event
+    assert json.loads(raw)["data"] == message
+    assert decode_event(raw) == ({"type": "new_message", "participant_ids": ["u1", "u2", "u3"]}, frame)
+
+    legacy = json.dumps({"type": "new_message", "participant_ids": ["u2"], "data": {"id": "m0"}})
+
+    class FakePubSub:
+        async def listen(self):
+            yield {"type": "message", "data": legacy}
+            yield {"type": "message", "data": raw}
+
+    sockets = {"u1": [FakeSocket(), FakeSocket()], "u2": [FakeSocket()]}
+    for user_id, user_sockets in sockets.items():
+        for socket in user_sockets:
+            await manager.connect(user_id, socket)
+    try:
+        pubsub = RedisPubSubManager()
+        pubsub.pubsub = FakePubSub()
+        await pubsub.reader_task()
+        # Let the writer tasks drain their queues
+        for _ in range(20):
+            await asyncio.sleep(0)
+    finally:
+        for user_id, user_sockets in sockets.items():
+            for socket in user_sockets:
+                manager.disconnect(user_id, socket)
+        await asyncio.sleep(0)
+
+    for socket in sockets["u1"]:
+        assert socket.frames == [frame]
+    assert [json.loads(f) for f in sockets["u2"][0].frames] == [{"id": "m0"}, message]
+    # The very same string object went to every socket
+    assert sockets["u1"][0].frames[0] is sockets["u1"][1].frames[0] is sockets["u2"][0].frames[1]
+
+@pytest.mark.asyncio
+async def test_slow_consumers_never_hold_up_fan_out():
+    from src.core.connection_manager import ConnectionManager
+
+    class FakeSocket:
+        def __init__(self, stalled=False):
+            self.frames = []
+            self.stalled = stalled
+            self.close_code = None
+        async def accept(self):
+            pass
+        async def send_text(self, frame):
+            if self.stalled:
+                await asyncio.Event().wait()
+            self.frames.append(frame)
+        async def close(self, code=1000):
+            self.close_code = code
+
+    async def drain():
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+    # drop_oldest: the stalled client loses its oldest frames, the others get everything
+    manager = ConnectionManager(max_queue=2, overflow_policy="drop_oldest", send_timeout=5)
+    fast, stalled = FakeSocket(), FakeSocket(stalled=True)
+    await manager.connect("fast", fast)
+    stalled_connection = await manager.connect("stalled", stalled)
+    for i in range(5):
+        manager.send_text_to_users(str(i), ["fast", "stalled"])
+        await drain()
+    assert fast.frames == ["0", "1", "2", "3", "4"]
+    # "0" is stuck in flight; of "1".."4" only the newest two are still queued
+    assert list(stalled_connection.queue) == ["3", "4"]
+    stats = manager.stats()
+    assert stats["frames_dropped"] == 2
+    assert stats["max_queue_depth"] == 2 and stats["queued_frames"] == 2
+    assert stats["frames_sent"] == 5
+    manager.disconnect("fast", fast)
+    manager.disconnect("stalled", stalled)
+    assert manager.stats()["connections"] == 0
+
+    # disconnect: an overflowing client is evicted and closed with 1013 (try again later)
+    manager = ConnectionManager(max_queue=2, overflow_policy="disconnect", send_timeout=5)
+    fast, stalled = FakeSocket(), FakeSocket(stalled=True)
+    await manager.connect("fast", fast)
+    await manager.connect("stalled", stalled)
+    for i in range(5):
+        manager.send_text_to_users(str(i), ["fast", "stalled"])
+        await drain()
+    assert fast.frames == ["0", "1", "2", "3", "4"]
+    assert "stalled" not in manager.active_connections
+    assert stalled.close_code == 1013
+    assert manager.stats()["evictions"] == {"queue_overflow": 1, "send_timeout": 0}
+    manager.disconnect("fast", fast)
+
+    # A send that stalls past the timeout evicts the client as well
+    manager = ConnectionManager(max_queue=10, send_timeout=0.05)
+    stalled = FakeSocket(stalled=True)
+    await manager.connect("stalled", stalled)
+    manager.send_text("0", "stalled")
+    await asyncio.sleep(0.2)
+    assert "stalled" not in manager.active_connections
+    assert stalled.close_code == 1013
+    assert manager.stats()["evictions"]["send_timeout"] == 1
+    await drain()
+
+@pytest.mark.asyncio
+async def test_events_only_reach_instances_with_a_connected_recipient(monkeypatch):
+    import json
+    from src.core import pubsub as pubsub_module
+    from src.core.connection_manager import ConnectionManager
+    from src.core.pubsub import RedisPubSubManager, user_shard
+
+    class FakePubSub:
+        def __init__(self):
+            self.channels = set()
+            self.inbox = asyncio.Queue()
+        async def subscribe(self, *channels):
+            self.channels.update(channels)
+        async def unsubscribe(self, *channels):
+            self.channels.difference_update(channels)
+        async def listen(self):
+            while True:
+                channel, data = await self.inbox.get()
+                if channel in self.channels:
+                    yield {"type": "message", "channel": channel, "data": data}
+
+    class FakePipeline:
+        def __init__(self, published):
+            self.published = published
+            self.queued = []
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc_info):
+            pass
+        def publish(self, channel, data):
+            self.queued.append((channel, data))
+        async def execute(self):
+            self.published.extend(self.queued)
+
+    class FakeRedis:
+        def __init__(self):
+            self.published = []
+        def pipeline(self, transaction=True):
+            return FakePipeline(self.published)
+
+    class FakeSocket:
+        async def accept(self):
+            pass
+        async def send_text(self, frame):
+            pass
+
+    shards = 8
+    # Users in three distinct shards
+    users = {}
+    for n in range(100):
+        user_id = f"user-{n}"
+        users.setdefault(user_shard(user_id, shards), user_id)
+    (shard_a, a), (shard_b, b), (shard_c, c) = list(users.items())[:3]
+
+    pubsub = RedisPubSubManager(shards=shards)
+    pubsub.pubsub = FakePubSub()
+    pubsub.redis_conn = FakeRedis()
+    manager = ConnectionManager()
+    monkeypatch.setattr(pubsub_module, "manager", manager)
+    manager.on_user_online = pubsub.user_online
+    manager.on_user_offline = pubsub.user_offline
+
+    socket_a1, socket_a2, socket_b = FakeSocket(), FakeSocket(), FakeSocket()
+    await manager.connect(a, socket_a1)
+    await manager.connect(a, socket_a2)
+    await manager.connect(b, socket_b)
+    assert pubsub.pubsub.channels == {f"chat_events:{shard_a}", f"chat_events:{shard_b}"}
+
+    # One event per shard of the recipients, carrying only that shard's recipients
+    await pubsub.publish_message({"id": "m1"}, [a, b, c])
+    published = {channel: json.loads(data) for channel, data in pubsub.redis_conn.published}
+    assert published == {
+        f"chat_events:{shard}": {"type": "new_message", "participant_ids": [user_id], "data": {"id": "m1"}}
+        for shard, user_id in ((shard_a, a), (shard_b, b), (shard_c, c))
+    }
+
+    # Only subscribed shards are received; an event for a user who merely shares a shard with a
+    # connected one is received but not delivered, which stats() tells apart
+    a_neighbour = next(f"other-{n}" for n in range(1000) if user_shard(f"other-{n}", shards) == shard_a)
+    await pubsub.publish_message({"id": "m2"}, [a_neighbour])
+    reader = asyncio.create_task(pubsub.reader_task())
+    for message in pubsub.redis_conn.published:
+        pubsub.pubsub.inbox.put_nowait(message)
+    while not pubsub.pubsub.inbox.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    reader.cancel()
+    assert (pubsub.events_received, pubsub.events_delivered) == (3, 2)
+
+    # A shard stays subscribed while any of its users is connected
+    manager.disconnect(a, socket_a1)
+    await asyncio.sleep(0)
+    assert f"chat_events:{shard_a}" in pubsub.pubsub.channels
+    manager.disconnect(b, socket_b)
+    manager.disconnect(a, socket_a2)
+    # Reconnecting before the unsubscribe runs keeps the subscription
+    await manager.connect(b, socket_b)
+    await asyncio.sleep(0)
+    assert pubsub.pubsub.channels == {f"chat_events:{shard_b}"}
+    assert pubsub.stats() == {"shards": shards, "subscribed_shards": 1, "events_received": 3, "events_delivered": 2}
+    manager.disconnect(b, socket_b)
+    await asyncio.sleep(0)
+    assert pubsub.pubsub.channels == set()
+
+@pytest.mark.asyncio
+async def test_reconnecting_clients_replay_missed_events(user_factory, websocket_connect, monkeypatch):
+    import json
+    from src.core.connection_manager import ConnectionManager
+    from src.core.event_log import MemoryEventLog
+    from src.core.pubsub import RedisPubSubManager, pubsub_manager, user_shard, RESYNC_FRAME
+
+    class FakePipeline:
+        def __init__(self, published):
+            self.published = published
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc_info):
+            pass
+        def publish(self, channel, data):
+            self.published.append(data)
+        async def execute(self):
+            pass
+
+    class FakeRedis:
+        def __init__(self):
+            self.published = []
+        def pipeline(self, transaction=True):
+            return FakePipeline(self.published)
+
+    log = MemoryEventLog(max_events=100)
+    pubsub = RedisPubSubManager(shards=4, event_log=log, replay_max_events=3)
+    pubsub.redis_conn = FakeRedis()
+
+    # Published events carry the id they got in the log, in the header and in the frame
+    await pubsub.publish_message({"id": "m1"}, ["alice", "bob"])
+    await pubsub.publish_message({"id": "m2"}, ["bob"])
+    await pubsub.publish_message({"id": "m3"}, ["alice"])
+    await pubsub.publish_message({"id": "m4"}, ["alice"])
+    published = [json.loads(event) for event in pubsub.redis_conn.published]
+    assert all(event["event_id"] == event["data"]["event_id"] for event in published)
+    first_id = published[0]["event_id"]
+
+    # Replay: the user's own events after the given one
+    frames = await pubsub.replay_events("alice", first_id)
+    assert [json.loads(frame)["id"] for _, frame in frames] == ["m3", "m4"]
+    # Too far behind, unknown ids and trimmed logs all ask for a resync
+    pubsub.replay_max_events = 1
+    assert await pubsub.replay_events("alice", first_id) == [(None, RESYNC_FRAME)]
+    pubsub.replay_max_events = 3
+    assert await pubsub.replay_events("alice", "not-an-id") == [(None, RESYNC_FRAME)]
+    trimmed = MemoryEventLog(max_events=2)
+    old_id, = await trimmed.append([(0, "{}")])
+    await trimmed.append([(0, "{}"), (0, "{}")])
+    assert (await trimmed.read_after(0, old_id, 10))[1] is False
+
+    # Live events arriving during the replay are held back, and not sent twice
+    class FakeSocket:
+        def __init__(self):
+            self.frames = []
+        async def accept(self):
+            pass
+        async def send_text(self, frame):
+            self.frames.append(frame)
+
+    manager = ConnectionManager()
+    socket = FakeSocket()
+    connection = await manager.connect("alice", socket, replaying=True)
+    manager.send_text("live-m4", "alice", frames[-1][0])
+    manager.send_text("live-m5", "alice", "99999999999999-0")
+    connection.finish_replay(frames)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert [json.loads(frame)["id"] for frame in socket.frames[:2]] == ["m3", "m4"]
+    assert socket.frames[2:] == ["live-m5"]
+    manager.disconnect("alice", socket)
+
+    # Through /ws
+    user_id, headers = await user_factory()
+    token = headers["Authorization"].split()[1]
+    monkeypatch.setattr(pubsub_manager, "event_log", MemoryEventLog(max_events=100))
+    shard = user_shard(user_id, pubsub_manager.shards)
+    encoded = lambda message: '{"type":"new_message","participant_ids":["%s"],"data":%s}' % (user_id, json.dumps(message))
+    seen_id, _ = await pubsub_manager.event_log.append([(shard, encoded({"id": "seen"})), (shard, encoded({"id": "missed"}))])
+
+    async with websocket_connect("/ws", f"token={token}&last_event_id={seen_id}") as ws:
+        frame = json.loads(await ws.receive_text())
+        assert frame["id"] == "missed" and frame["event_id"] != seen_id
+    async with websocket_connect("/ws", f"token={token}&last_event_id=garbage") as ws:
+        assert await ws.receive_text() == RESYNC_FRAME